@@ -0,0 +1,338 @@
+"""End-to-end load test for the flask_stripe Twilio call flow.
+
+Simulated callers post the same form fields Twilio sends (CallSid, Digits,
+SpeechResult) to /voice, /check_passcode, /set_speed, /choose_question_type,
+/get_full_mcq (or the /get_question -> /get_option_* chain) and /transcribe. Each
+caller keeps its own session cookie and follows <Redirect> verbs the way Twilio
+does. OpenAI is replaced by benchmarks/mock_openai.py.
+
+Against a server you started yourself:
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 --passcode 1234
+
+Or let the harness start the mock OpenAI server and gunicorn for each worker
+configuration (WORKERSxTHREADS) and find the saturation point of each:
+
+    python benchmarks/load_test.py --gunicorn 1x4,2x4,4x8 --seed-user \\
+        --concurrency 1,2,4,8,16,32,64 --duration 20 --latency lognormal:-0.7,0.5
+
+To see how logins affect webhook latency, add --login-load N (N concurrent login
+loops). Run it once with PASSWORD_HASH_WORKERS=0 (hashing on the request thread)
+and once with the default process pool, then compare the webhook p99s:
+
+    PASSWORD_HASH_WORKERS=0 python benchmarks/load_test.py --gunicorn 1x8 --seed-user --login-load 8
+    python benchmarks/load_test.py --gunicorn 1x8 --seed-user --login-load 8
+"""
+import argparse
+import http.cookiejar
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mock_openai
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLASK_STRIPE_DIR = os.path.join(REPO_ROOT, 'flask_stripe')
+
+QUESTION_TOPICS = ["photosynthesis", "the French revolution", "black holes", "compound interest",
+                   "the water cycle", "machine learning", "the Roman empire", "plate tectonics"]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Results:
+    """Thread-safe collection of per-endpoint latencies and call outcomes."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.calls_completed = 0
+        self.calls_failed = 0
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def finish_call(self, ok):
+        with self.lock:
+            if ok:
+                self.calls_completed += 1
+            else:
+                self.calls_failed += 1
+
+
+class SimulatedCall:
+    """One phone call: a cookie jar, a CallSid and the webhook sequence Twilio would send."""
+
+    def __init__(self, base_url, results, passcode, turns, repeat_questions):
+        self.base_url = base_url.rstrip('/')
+        self.base_path = urllib.parse.urlsplit(self.base_url).path  # e.g. /stripe behind gateway.py
+        self.results = results
+        self.passcode = passcode
+        self.turns = turns
+        self.repeat_questions = repeat_questions
+        self.call_sid = 'CA' + uuid.uuid4().hex
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def post(self, path, **fields):
+        """POST a webhook, following any <Redirect> in the TwiML, and return the final body."""
+        url = self.base_url + path
+        for _ in range(50):
+            data = urllib.parse.urlencode(dict(fields, CallSid=self.call_sid, From='+15555550100', To='+15555550199')).encode()
+            endpoint = urllib.parse.urlsplit(url).path[len(self.base_path):]
+            started = time.perf_counter()
+            try:
+                with self.opener.open(url, data=data, timeout=30) as response:
+                    body = response.read().decode()
+                ok = True
+            except (urllib.error.URLError, socket.timeout, ConnectionError) as e:
+                body = str(e)
+                ok = False
+            self.results.record(endpoint, time.perf_counter() - started, ok)
+            if not ok:
+                raise RuntimeError(f"{endpoint} failed: {body}")
+            redirect = re.search(r'<Redirect[^>]*>([^<]+)</Redirect>', body)
+            if not redirect:
+                return body
+            # Twilio plays any <Pause> before following the redirect; the poll interval is part of the call
+            pause = re.search(r'<Pause length="(\d+)"', body)
+            if pause:
+                time.sleep(int(pause.group(1)))
+            # Redirect URLs are relative to the webhook, as Twilio resolves them
+            url, fields = urllib.parse.urljoin(url, redirect.group(1)), {}
+        raise RuntimeError(f"Too many redirects from {url}")
+
+    def question(self):
+        topic = random.choice(QUESTION_TOPICS)
+        if self.repeat_questions:
+            return f"Can you explain {topic}?"
+        return f"Can you explain {topic} in {random.randint(2, 9999)} words?"
+
+    def run(self, mcq):
+        body = self.post('/voice')
+        if 'check_passcode' in body:
+            self.post('/check_passcode', Digits=self.passcode)
+        self.post('/set_speed', SpeechResult='fast')
+        if mcq:
+            body = self.post('/choose_question_type', SpeechResult='multiple choice')
+            single_utterance = '/get_full_mcq' in body
+            for _ in range(self.turns):
+                if single_utterance:
+                    options = ' '.join(f'option {letter} answer {random.randint(1, 99)}' for letter in 'abcd')
+                    self.post('/get_full_mcq', SpeechResult=f"{self.question()} {options}")
+                    continue
+                self.post('/get_question', SpeechResult=self.question())
+                for letter in 'abcd':
+                    self.post(f'/get_option_{letter}', SpeechResult=f'answer {random.randint(1, 99)}')
+        else:
+            self.post('/choose_question_type', SpeechResult='general question')
+            for _ in range(self.turns):
+                self.post('/transcribe', SpeechResult=self.question())
+        self.post('/transcribe', SpeechResult='goodbye')
+
+
+def login_loop(base_url, results, stop_at):
+    """Post the login form repeatedly to load the server with password hashing."""
+    data = urllib.parse.urlencode({'login': '1', 'username': 'loadtest', 'password': 'loadtest'}).encode()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            with opener.open(base_url.rstrip('/') + '/', data=data, timeout=30) as response:
+                response.read()
+            ok = True
+        except urllib.error.HTTPError as e:
+            # 429/503 mean throttling or admission control turned the login away
+            ok = e.code in (429, 503)
+        except (urllib.error.URLError, socket.timeout, ConnectionError):
+            ok = False
+        results.record('/ (login)', time.perf_counter() - started, ok)
+
+def run_level(base_url, concurrency, duration, passcode, turns, mcq_fraction, repeat_questions, login_load=0):
+    """Keep `concurrency` callers (and `login_load` login loops) busy for `duration` seconds."""
+    results = Results()
+    stop_at = time.monotonic() + duration
+
+    def caller():
+        while time.monotonic() < stop_at:
+            call = SimulatedCall(base_url, results, passcode, turns, repeat_questions)
+            try:
+                call.run(mcq=random.random() < mcq_fraction)
+                results.finish_call(True)
+            except RuntimeError:
+                results.finish_call(False)
+
+    threads = [threading.Thread(target=caller, daemon=True) for _ in range(concurrency)]
+    threads += [threading.Thread(target=login_loop, args=(base_url, results, stop_at), daemon=True)
+                for _ in range(login_load)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.elapsed = time.monotonic() - started
+    return results
+
+def report_level(concurrency, results):
+    """Print per-endpoint percentiles for one concurrency level and return its summary."""
+    calls_per_second = results.calls_completed / results.elapsed
+    total_requests = sum(len(v) for v in results.latencies.values())
+    total_errors = sum(results.errors.values())
+    print(f"\n== concurrency {concurrency}: {calls_per_second:.2f} calls/s, "
+          f"{results.calls_completed} calls ok, {results.calls_failed} failed, "
+          f"{total_requests / results.elapsed:.1f} req/s")
+    print(f"{'endpoint':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    worst_p95 = 0.0
+    for endpoint in sorted(results.latencies):
+        values = sorted(results.latencies[endpoint])
+        p50, p95, p99 = (percentile(values, f) * 1000 for f in (0.50, 0.95, 0.99))
+        worst_p95 = max(worst_p95, p95)
+        print(f"{endpoint:<24}{len(values):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{results.errors[endpoint]:>8}")
+    return {
+        "concurrency": concurrency,
+        "calls_per_second": calls_per_second,
+        "worst_p95_ms": worst_p95,
+        "error_rate": total_errors / total_requests if total_requests else 0.0,
+    }
+
+def find_saturation(summaries, slo_ms, max_error_rate=0.01):
+    """Return the highest concurrency level that still met the SLO and kept scaling throughput."""
+    best = None
+    for summary in summaries:
+        if summary["worst_p95_ms"] > slo_ms or summary["error_rate"] > max_error_rate:
+            break
+        if best is not None and summary["calls_per_second"] < best["calls_per_second"] * 1.05:
+            break
+        best = summary
+    return best
+
+def sweep(base_url, args):
+    summaries = []
+    for concurrency in args.concurrency:
+        results = run_level(base_url, concurrency, args.duration, args.passcode, args.turns,
+                            args.mcq_fraction, args.repeat_questions, args.login_load)
+        summaries.append(report_level(concurrency, results))
+    saturation = find_saturation(summaries, args.slo_ms)
+    if saturation:
+        print(f"\nSaturation point: ~{saturation['concurrency']} concurrent calls "
+              f"({saturation['calls_per_second']:.2f} calls/s, worst p95 {saturation['worst_p95_ms']:.0f} ms)")
+    else:
+        print(f"\nEven the lowest concurrency level missed the {args.slo_ms:.0f} ms p95 SLO")
+    return saturation
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+def seed_paid_user(env):
+    """Create a paying test user in flask_stripe's database and return its passcode."""
+    script = (
+        "from app import app, db, User, issue_passcode\n"
+        "from werkzeug.security import generate_password_hash\n"
+        "from password_pool import PASSWORD_HASH_METHOD\n"
+        "with app.app_context():\n"
+        "    user = User.query.filter_by(username='loadtest').first()\n"
+        "    if user is None:\n"
+        "        user = User(username='loadtest', password=generate_password_hash('loadtest', PASSWORD_HASH_METHOD))\n"
+        "        db.session.add(user)\n"
+        "        db.session.flush()\n"
+        "    passcode = issue_passcode(user)\n"
+        "    user.has_paid = True\n"
+        "    db.session.commit()\n"
+        "    print(passcode)\n"
+    )
+    output = subprocess.run([sys.executable, '-c', script], cwd=FLASK_STRIPE_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return output.strip().splitlines()[-1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="base URL of an already running app")
+    parser.add_argument('--gunicorn', help="comma-separated WORKERSxTHREADS configurations to launch, e.g. 1x4,4x8")
+    parser.add_argument('--app', default='app:app', help="WSGI app for gunicorn, relative to flask_stripe/")
+    parser.add_argument('--passcode', default='1234', help="passcode of a paying user")
+    parser.add_argument('--seed-user', action='store_true', help="create a paying user and use its passcode")
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                        type=lambda v: [int(c) for c in v.split(',')], help="concurrent callers per step")
+    parser.add_argument('--duration', type=float, default=20, help="seconds per concurrency step")
+    parser.add_argument('--turns', type=int, default=3, help="questions asked per call")
+    parser.add_argument('--mcq-fraction', type=float, default=0.5, help="fraction of calls using the MCQ flow")
+    parser.add_argument('--repeat-questions', action='store_true', help="draw questions from a small fixed pool so caches hit")
+    parser.add_argument('--slo-ms', type=float, default=3000, help="p95 latency above which a step counts as saturated")
+    parser.add_argument('--login-load', type=int, default=0,
+                        help="concurrent login loops to run alongside the calls (needs the seeded loadtest user)")
+    parser.add_argument('--latency', default='lognormal:-0.7,0.5', help="mock OpenAI latency distribution")
+    parser.add_argument('--mock-port', type=int, default=0, help="port for the mock OpenAI server (default: any free port)")
+    args = parser.parse_args()
+
+    if args.url and not args.gunicorn:
+        sweep(args.url, args)
+        sys.exit(0)
+
+    mock_port = args.mock_port or free_port()
+    mock_server = mock_openai.serve(port=mock_port, latency=args.latency)
+    env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{mock_port}/v1", OPENAI_API_KEY='test')
+    # flask_stripe refuses to start without a passcode pepper
+    env.setdefault('PASSCODE_PEPPER', 'load-test-pepper')
+    if args.login_load:
+        # Every login comes from 127.0.0.1, so lift the per-IP limit to measure hashing itself
+        env.setdefault('LOGIN_RATE_PER_MINUTE', '1000000')
+        env.setdefault('LOGIN_BURST', '1000000')
+    print(f"Mock OpenAI on port {mock_port} with latency {args.latency}")
+    if args.seed_user:
+        args.passcode = seed_paid_user(env)
+
+    overall = []
+    for config in (args.gunicorn or '1x1').split(','):
+        workers, threads = (int(v) for v in config.lower().split('x'))
+        port = free_port()
+        server = subprocess.Popen(
+            ['gunicorn', '--workers', str(workers), '--threads', str(threads),
+             '--bind', f'127.0.0.1:{port}', '--chdir', FLASK_STRIPE_DIR, args.app],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port)
+            print(f"\n######## gunicorn {workers} worker(s) x {threads} thread(s) ########")
+            overall.append((config, sweep(f"http://127.0.0.1:{port}", args)))
+        finally:
+            server.terminate()
+            server.wait()
+
+    mock_server.shutdown()
+    print("\nSummary (saturation point per configuration):")
+    for config, saturation in overall:
+        if saturation:
+            print(f"  {config:>8}: {saturation['concurrency']} concurrent calls, {saturation['calls_per_second']:.2f} calls/s")
+        else:
+            print(f"  {config:>8}: saturated at the lowest level")
@@ -0,0 +1,117 @@
+"""Local stand-in for the OpenAI chat completions API, for load testing the voice apps.
+
+Run it and point the apps at it with OPENAI_BASE_URL:
+
+    python benchmarks/mock_openai.py --port 8090 --latency lognormal:-0.7,0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 OPENAI_API_KEY=test python memory.py
+
+Latency distributions (seconds):
+    fixed:S            always S
+    uniform:LO,HI      uniformly between LO and HI
+    normal:MEAN,SD     normal, clipped at zero
+    lognormal:MU,SIGMA exp(normal(MU, SIGMA)); lognormal:-0.7,0.5 has a median of ~0.5s
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def parse_latency(spec):
+    """Turn a latency spec such as 'uniform:0.2,1.5' into a function returning seconds."""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(random.gauss(values[0], values[1]), 0.0)
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    latency = staticmethod(lambda: 0.0)
+    error_rate = 0.0
+    requests_served = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {"error": {"message": "Not found"}})
+            return
+
+        time.sleep(self.latency())
+        with MockOpenAIHandler.lock:
+            MockOpenAIHandler.requests_served += 1
+        if random.random() < self.error_rate:
+            self._send(500, {"error": {"message": "Simulated upstream failure", "type": "server_error"}})
+            return
+
+        messages = body.get('messages', [])
+        question = messages[-1]['content'] if messages else ''
+        # Multiple-choice prompts get a letter so the MCQ flow behaves realistically
+        if 'multiple-choice' in question:
+            answer = f"{random.choice('ABCD')}. This is the simulated answer."
+        else:
+            answer = "This is a simulated answer from the mock OpenAI server."
+        prompt_tokens = sum(len(m.get('content', '')) // 4 + 4 for m in messages)
+        completion_tokens = len(answer) // 4
+        self._send(200, {
+            "id": f"chatcmpl-mock{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'gpt-3.5-turbo'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load
+        pass
+
+
+def serve(host='127.0.0.1', port=8090, latency='fixed:0.5', error_rate=0.0):
+    """Start the mock server in a background thread and return it."""
+    MockOpenAIHandler.latency = staticmethod(parse_latency(latency))
+    MockOpenAIHandler.error_rate = error_rate
+    server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', default='fixed:0.5', help="latency distribution, e.g. lognormal:-0.7,0.5")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail with a 500")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.error_rate)
+    print(f"Mock OpenAI listening on http://{args.host}:{args.port}/v1 (latency {args.latency})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,161 @@
+"""Local stand-in for the parts of Stripe that flask_stripe uses, for testing payments offline.
+
+    python benchmarks/mock_stripe.py --port 12111 --webhook-url http://127.0.0.1:8080/stripe_webhook
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_mock \\
+        STRIPE_WEBHOOK_SECRET=whsec_mock python flask_stripe/app.py
+
+It implements creating and retrieving Checkout Sessions (honouring Idempotency-Key).
+Opening a session's URL simulates the customer paying: the session is marked paid,
+a signed checkout.session.completed event is posted to the webhook URL, and the
+browser is redirected to the session's success_url. Pass --duplicate-webhooks N to
+deliver every event N times, as Stripe may do.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def parse_stripe_form(body):
+    """Decode Stripe's form encoding (e.g. metadata[user_id]=1) into nested dicts."""
+    result = {}
+    for key, value in urllib.parse.parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        target = result
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return result
+
+def sign_payload(payload, secret, timestamp=None):
+    """Build a Stripe-Signature header for payload."""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class MockStripeHandler(BaseHTTPRequestHandler):
+    sessions = {}
+    idempotent_responses = {}
+    webhook_url = None
+    webhook_secret = 'whsec_mock'
+    duplicate_webhooks = 1
+    lock = threading.Lock()
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/checkout/sessions':
+            self._send_json(404, {"error": {"message": f"Unrecognized request URL {self.path}"}})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        key = self.headers.get('Idempotency-Key')
+        with self.lock:
+            if key and key in self.idempotent_responses:
+                self._send_json(200, self.sessions[self.idempotent_responses[key]])
+                return
+            params = parse_stripe_form(body)
+            session_id = f"cs_test_{secrets.token_hex(12)}"
+            host = self.headers.get('Host', '127.0.0.1')
+            self.sessions[session_id] = {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"http://{host}/checkout/{session_id}",
+                "status": "open",
+                "payment_status": "unpaid",
+                "client_reference_id": params.get('client_reference_id'),
+                "metadata": params.get('metadata', {}),
+                "success_url": params.get('success_url'),
+                "cancel_url": params.get('cancel_url'),
+                "expires_at": int(time.time()) + 24 * 3600,
+                "amount_total": 500,
+                "currency": "usd",
+            }
+            if key:
+                self.idempotent_responses[key] = session_id
+            self._send_json(200, self.sessions[session_id])
+
+    def do_GET(self):
+        match = re.fullmatch(r'/v1/checkout/sessions/([\w]+)', self.path)
+        if match:
+            stripe_session = self.sessions.get(match.group(1))
+            if stripe_session is None:
+                self._send_json(404, {"error": {"message": "No such checkout.session"}})
+            else:
+                self._send_json(200, stripe_session)
+            return
+
+        match = re.fullmatch(r'/checkout/([\w]+)', self.path)
+        if match and match.group(1) in self.sessions:
+            stripe_session = self.sessions[match.group(1)]
+            stripe_session.update(status="complete", payment_status="paid")
+            self._send_webhook("checkout.session.completed", stripe_session)
+            self.send_response(302)
+            self.send_header('Location', stripe_session['success_url'].replace('{CHECKOUT_SESSION_ID}', stripe_session['id']))
+            self.end_headers()
+            return
+
+        self._send_json(404, {"error": {"message": f"Unrecognized request URL {self.path}"}})
+
+    def _send_webhook(self, event_type, obj):
+        if not self.webhook_url:
+            return
+        payload = json.dumps({
+            "id": f"evt_{secrets.token_hex(12)}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": obj},
+        })
+        for _ in range(self.duplicate_webhooks):
+            request = urllib.request.Request(self.webhook_url, data=payload.encode(), headers={
+                'Content-Type': 'application/json',
+                'Stripe-Signature': sign_payload(payload, self.webhook_secret),
+            })
+            try:
+                urllib.request.urlopen(request, timeout=10).read()
+            except Exception as e:
+                print(f"Webhook delivery failed: {e}")
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=12111, webhook_url=None, webhook_secret='whsec_mock', duplicate_webhooks=1):
+    """Start the mock Stripe server in a background thread and return it."""
+    MockStripeHandler.webhook_url = webhook_url
+    MockStripeHandler.webhook_secret = webhook_secret
+    MockStripeHandler.duplicate_webhooks = duplicate_webhooks
+    server = ThreadingHTTPServer((host, port), MockStripeHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--webhook-url', default='http://127.0.0.1:8080/stripe_webhook')
+    parser.add_argument('--webhook-secret', default='whsec_mock')
+    parser.add_argument('--duplicate-webhooks', type=int, default=1, help="deliver each event this many times")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.webhook_url, args.webhook_secret, args.duplicate_webhooks)
+    print(f"Mock Stripe listening on http://{args.host}:{args.port}, webhooks to {args.webhook_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
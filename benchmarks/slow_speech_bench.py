@@ -0,0 +1,79 @@
+"""Payload-size benchmark: the old four-words-and-a-pause slow mode versus slow_speech.py.
+
+    python benchmarks/slow_speech_bench.py
+    python benchmarks/slow_speech_bench.py --text "Your own answer to compare."
+
+For each answer it prints the size of the TwiML document, the number of verbs in
+it, the total scripted silence and the time taken to render it.
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twilio.twiml.voice_response import VoiceResponse, Gather
+from slow_speech import render_slow_speech
+from twiml_cache import twiml_then_prompt
+
+# Typical answers at the apps' max_tokens=150
+ANSWERS = {
+    "short": "The capital of France is Paris. It has been the capital since the tenth century.",
+    "150 tokens": (
+        "Photosynthesis is the process plants, algae and some bacteria use to turn light into chemical energy. "
+        "It happens mainly in the leaves, inside chloroplasts, where the green pigment chlorophyll absorbs "
+        "sunlight. In the light-dependent reactions, water is split into oxygen, protons and electrons; the "
+        "oxygen is released into the air. The energy captured is stored in ATP and NADPH. In the Calvin cycle, "
+        "those molecules power the conversion of carbon dioxide into glucose, which the plant uses for growth "
+        "and stores as starch. Nearly all life on Earth depends on this process, either directly or through "
+        "the food chain, and it also produces the oxygen we breathe."
+    ),
+}
+
+def speak_with_pauses(response, text):
+    """The previous slow mode: a <Say> per four words with a 3 second <Pause> between them."""
+    words = text.split()
+    for i in range(0, len(words), 4):
+        chunk = " ".join(words[i:i+4])
+        response.say(chunk)
+        if i + 4 < len(words):  # Add pause only if there are more words left
+            response.pause(length=3)
+
+def legacy_twiml(text):
+    response = VoiceResponse()
+    speak_with_pauses(response, text)
+    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
+    response.append(gather)
+    return str(response)
+
+SLOW_ANSWER_PROMPT = twiml_then_prompt("/transcribe")
+
+def ssml_twiml(text):
+    return SLOW_ANSWER_PROMPT.render(twiml=render_slow_speech(text))
+
+def scripted_silence(twiml):
+    """Seconds of explicit <Pause> and <break> in a document."""
+    seconds = sum(int(n) for n in re.findall(r'<Pause length="(\d+)"', twiml))
+    for value, unit in re.findall(r'<break time="(\d+(?:\.\d+)?)(ms|s)"', twiml):
+        seconds += float(value) / (1000 if unit == "ms" else 1)
+    return seconds
+
+def describe(name, render, text, number):
+    twiml = render(text)
+    verbs = len(re.findall(r"<(?:Say|Pause)\b", twiml))
+    seconds = min(timeit.repeat(lambda: render(text), number=number, repeat=3)) / number
+    print(f"  {name:<7} {len(twiml.encode()):6d} bytes  {verbs:3d} verbs  "
+          f"{scripted_silence(twiml):5.1f}s of pauses  {seconds * 1e6:7.1f} us to render")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--text', help="benchmark this answer instead of the built-in ones")
+    parser.add_argument('--number', type=int, default=2000, help="renders per timing")
+    args = parser.parse_args()
+
+    answers = {"custom": args.text} if args.text else ANSWERS
+    for label, text in answers.items():
+        print(f"{label} ({len(text.split())} words)")
+        describe("legacy", legacy_twiml, text, args.number)
+        describe("ssml", ssml_twiml, text, args.number)
@@ -0,0 +1,79 @@
+"""Startup profiler: where a script's start-up time goes, per import and per initialization step.
+
+    python benchmarks/startup_profile.py vader_sentiment chat_gpt_summarizer
+    python benchmarks/startup_profile.py twilio_vader:get_sentiment_analyzer --top 20
+
+Each target is imported in a fresh interpreter with `python -X importtime`, so
+nothing is cached between targets. `module:function` also calls the function
+after the import, which covers flows that initialize lazily. The report gives the
+wall time and the slowest imports made directly by the module, with time inclusive
+of everything they import. It also lists the steps timed with
+offline_assets.startup_step() (lexicons, pipelines, models).
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time:       412 |       1021 |   nltk.sentiment"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+STEP_LINE = re.compile(r"startup step: ([\d.]+) (.+)")
+
+def profile(target):
+    """Import (and optionally call) a target in a subprocess and return its timings."""
+    module, _, function = target.partition(':')
+    code = f"import {module}" + (f"; {module}.{function}()" if function else "")
+    env = dict(os.environ, STARTUP_PROFILE='true')
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - started
+
+    imports, steps = [], []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            imports.append((len(match.group(3)) // 2, match.group(4), int(match.group(2)) / 1e6))
+            continue
+        match = STEP_LINE.match(line)
+        if match:
+            steps.append((match.group(2), float(match.group(1))))
+    # The target module is reported at depth 0 right after its own imports (depth 1)
+    end = next((i for i, (depth, name, _) in enumerate(imports) if depth == 0 and name == module), None)
+    own, direct = None, []
+    if end is not None:
+        own = imports[end][2]
+        start = end
+        while start > 0 and imports[start - 1][0] > 0:
+            start -= 1
+        direct = [(name, seconds) for depth, name, seconds in imports[start:end] if depth == 1]
+    return {
+        'wall': wall,
+        'module': own,
+        'imports': sorted(direct, key=lambda item: -item[1]),
+        'steps': steps,
+        'error': result.stderr.strip().splitlines()[-1] if result.returncode else None,
+    }
+
+def report(target, timings, top):
+    print(f"{target}: {timings['wall']:.2f}s wall" +
+          (f", {timings['module']:.2f}s importing {target.partition(':')[0]}" if timings['module'] else ""))
+    if timings['error']:
+        print(f"  failed: {timings['error']}")
+    for name, seconds in timings['imports'][:top]:
+        print(f"  import {name:<40} {seconds:7.3f}s")
+    for name, seconds in timings['steps']:
+        print(f"  step   {name:<40} {seconds:7.3f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='+', help="module or module:function to profile")
+    parser.add_argument('--top', type=int, default=10, help="slowest direct imports to show per target")
+    args = parser.parse_args()
+
+    for target in args.targets:
+        report(target, profile(target), args.top)
@@ -0,0 +1,59 @@
+"""Microbenchmark: per-request CPU cost of building TwiML versus twiml_cache.py.
+
+    python benchmarks/twiml_bench.py --number 20000
+
+For a static prompt it compares building a VoiceResponse/Gather tree and
+serializing it against returning the precompiled bytes. For a spoken answer it
+compares building the tree against rendering a TwiMLTemplate. It first checks that
+both paths produce identical XML.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twilio.twiml.voice_response import VoiceResponse, Gather
+from twiml_cache import speech_prompt, compile_twiml, say_then_prompt
+
+PROMPT = "Thank you. Would you like to ask a general question or a multiple-choice question?"
+ANSWER = ("Photosynthesis is the process plants use to turn sunlight, water and carbon dioxide "
+          "into glucose and oxygen. It happens in the chloroplasts & uses chlorophyll <mostly>. ") * 3
+
+def build_prompt():
+    """What the endpoints did before: build the tree and serialize it on every request."""
+    response = VoiceResponse()
+    response.say(PROMPT)
+    gather = Gather(input="speech", speechTimeout="auto", action="/choose_question_type", method="POST")
+    response.append(gather)
+    return str(response)
+
+def build_answer(text):
+    response = VoiceResponse()
+    response.say(text)
+    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
+    response.append(gather)
+    return str(response)
+
+def report(name, number, built, cached):
+    built_us = built / number * 1e6
+    cached_us = cached / number * 1e6
+    print(f"{name:<14} built {built_us:8.2f} us   cached {cached_us:8.2f} us   "
+          f"saved {built_us - cached_us:8.2f} us/request ({built_us / cached_us:.0f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000, help="iterations per measurement")
+    args = parser.parse_args()
+
+    static_prompt = compile_twiml(speech_prompt(PROMPT, "/choose_question_type"))
+    answer_template = say_then_prompt("/transcribe")
+    assert static_prompt == build_prompt().encode()
+    assert answer_template.render(text=ANSWER) == build_answer(ANSWER)
+
+    report("static prompt", args.number,
+           min(timeit.repeat(build_prompt, number=args.number, repeat=3)),
+           min(timeit.repeat(lambda: static_prompt, number=args.number, repeat=3)))
+    report("answer", args.number,
+           min(timeit.repeat(lambda: build_answer(ANSWER), number=args.number, repeat=3)),
+           min(timeit.repeat(lambda: answer_template.render(text=ANSWER), number=args.number, repeat=3)))
@@ -1,13 +1,11 @@
 from flask import Flask, request, session, redirect, url_for
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from datetime import datetime, timedelta
-import openai
-import os
+import llm_client
+from call_metrics import instrument, stage
+from calendar_pool import get_calendar_pool, CalendarAuthError
+from secret_key import load_secret_key
 from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import re
 
 # Load environment variables from .env file
@@ -15,47 +13,31 @@ load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
-
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'better_calendar')  # Per-stage webhook timings, served at /metrics
 
 # Define the scope with read/write access
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Calendar clients and credentials shared by every thread and app in the process
+calendar_pool = get_calendar_pool(SCOPES)
 
 def get_google_calendar_service():
-    """Authenticate and return the Google Calendar service."""
-    creds = None
-    token_path = 'token.json'
-    
-    # Check if the token file exists
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception as e:
-                print(f"Failed to refresh token: {e}")
-                # If refresh failed, delete the token file and reauthenticate
-                if os.path.exists(token_path):
-                    os.remove(token_path)
-                return redirect(url_for('google_auth'))
-        
-        # If no valid credentials, initiate a new authorization flow
-        if not creds:
-            return redirect(url_for('google_auth'))
-    
-    return build('calendar', 'v3', credentials=creds)
+    """Return this thread's Google Calendar service from the shared pool (see calendar_pool.py)."""
+    try:
+        return calendar_pool.get()
+    except CalendarAuthError as e:
+        print(f"Failed to load Google credentials: {e}")
+        return redirect(url_for('google_auth'))
 
 @app.route('/google_auth')
 def google_auth():
     """Initiate the OAuth flow to authenticate with Google and get a new token."""
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
     creds = flow.run_local_server(port=8080)
     # Save the credentials for the next run
-    with open('token.json', 'w') as token:
+    with open(calendar_pool.token_path, 'w') as token:
         token.write(creds.to_json())
     return redirect(url_for('voice'))
 
@@ -74,7 +56,7 @@ def ask_chatgpt_to_format_datetime(date_str, time_str):
         f"Date: {date_str}, Time: {time_str}."
     )
     
-    gpt_response = openai.chat.completions.create(
+    gpt_response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -104,7 +86,8 @@ def add_event_to_calendar(service, summary, location, start_time, end_time, time
             'useDefault': True,
         },
     }
-    event = service.events().insert(calendarId='primary', body=event).execute()
+    with stage('google_calendar'):
+        event = service.events().insert(calendarId='primary', body=event).execute()
     return event.get('htmlLink')
 
 @app.route("/voice", methods=['POST'])
@@ -112,7 +95,7 @@ def voice():
     response = VoiceResponse()
     response.say("Hello! Let's schedule a meeting.")
     
-    gather = Gather(input="speech", speechTimeout="auto", action="/ask_time", method="POST")
+    gather = Gather(input="speech", speechTimeout="auto", action="ask_time", method="POST")
     response.say("Who is the meeting with?")
     response.append(gather)
     
@@ -124,7 +107,7 @@ def ask_time():
     session['summary'] = f"Meeting with {transcription_text}"
     
     response = VoiceResponse()
-    gather = Gather(input="speech", speechTimeout="auto", action="/ask_date", method="POST")
+    gather = Gather(input="speech", speechTimeout="auto", action="ask_date", method="POST")
     response.say(f"At what time is the meeting with {transcription_text}?")
     response.append(gather)
     
@@ -136,7 +119,7 @@ def ask_date():
     session['time'] = transcription_text
     
     response = VoiceResponse()
-    gather = Gather(input="speech", speechTimeout="auto", action="/confirm_event", method="POST")
+    gather = Gather(input="speech", speechTimeout="auto", action="confirm_event", method="POST")
     response.say(f"On what date is the meeting scheduled?")
     response.append(gather)
     
@@ -169,7 +152,8 @@ def confirm_event():
 
         if start_time_line and end_time_line:
             # Add the event to Google Calendar
-            service = get_google_calendar_service()
+            with stage('google_calendar'):
+                service = get_google_calendar_service()
             event_link = add_event_to_calendar(
                 service,
                 summary=session['summary'],
@@ -0,0 +1,167 @@
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import call_metrics
+from cassette import google_build_args, REPLAYING
+
+# Google Calendar clients shared by the calendar apps. Building a client on every
+# webhook meant reading token.json, sometimes refreshing the OAuth token while the
+# caller waited, and parsing the Calendar discovery document again. Here the
+# discovery document is loaded once per process, credentials are loaded once and
+# re-read only when token.json changes (e.g. after /google_auth), and a token close
+# to expiry is refreshed on a background thread while requests keep using the
+# current one. httplib2 connections are not thread-safe, so each thread gets its
+# own client built from the shared document and credentials.
+
+GOOGLE_TOKEN_PATH = os.getenv('GOOGLE_TOKEN_PATH', 'token.json')
+# Seconds before expiry at which the token is refreshed in the background; google-auth
+# itself treats a token as expired a few minutes early, so keep this above that
+GOOGLE_TOKEN_REFRESH_MARGIN = float(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN', '600'))
+
+token_refreshes = call_metrics.register(call_metrics.Counter(
+    'google_token_refreshes_total', "Google OAuth token refreshes by mode (background, blocking) and outcome.",
+    ('mode', 'outcome')))
+
+class CalendarAuthError(Exception):
+    """Raised when there are no usable Google credentials and the user has to authorize again."""
+
+
+def _utcnow():
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+def discovery_document(api='calendar', version='v3'):
+    """The parsed discovery document for an API, loaded once per process."""
+    with _documents_lock:
+        if (api, version) not in _documents:
+            from googleapiclient import discovery_cache
+
+            # Shipped with google-api-python-client, so no request to Google is made
+            document = discovery_cache.get_static_doc(api, version)
+            _documents[(api, version)] = json.loads(document) if document else None
+        return _documents[(api, version)]
+
+
+class CalendarServicePool:
+    """Per-thread Google Calendar clients sharing one set of credentials kept fresh in the background."""
+
+    def __init__(self, scopes, token_path='token.json', refresh_margin=600):
+        self.scopes = scopes
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self._creds = None
+        self._creds_mtime = None
+        self._refreshing = False
+        self._lock = threading.Lock()           # guards the fields above
+        self._refresh_lock = threading.Lock()   # one token refresh at a time
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so each forked server worker gets its own thread
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def credentials(self):
+        """The shared credentials, reloaded if token.json changed and refreshed first if already expired."""
+        from google.oauth2.credentials import Credentials
+
+        try:
+            mtime = os.stat(self.token_path).st_mtime
+        except FileNotFoundError:
+            raise CalendarAuthError(f"{self.token_path} not found; authorize with Google first")
+        with self._lock:
+            if mtime != self._creds_mtime:
+                self._creds = Credentials.from_authorized_user_file(self.token_path, self.scopes)
+                self._creds_mtime = mtime
+            creds = self._creds
+            if creds.valid:
+                if self._expires_soon(creds) and not self._refreshing:
+                    self._refreshing = True
+                    self._get_executor().submit(self._refresh, creds, 'background')
+                return creds
+        # Nothing usable to serve meanwhile, so this caller waits for the refresh
+        self._refresh(creds, 'blocking')
+        if not creds.valid:
+            raise CalendarAuthError("Google token expired and could not be refreshed; authorize again")
+        return creds
+
+    def _expires_soon(self, creds):
+        if creds.expiry is None:
+            return False
+        return (creds.expiry - _utcnow()).total_seconds() < self.refresh_margin
+
+    def _refresh(self, creds, mode):
+        from google.auth.transport.requests import Request
+
+        try:
+            if not creds.refresh_token:
+                raise CalendarAuthError("Google token has no refresh token")
+            # Requests keep using the current token while this runs
+            with self._refresh_lock:
+                # Another thread may have refreshed it while this one waited
+                if creds.valid and not self._expires_soon(creds):
+                    return
+                creds.refresh(Request())
+                self._save(creds)
+            token_refreshes.inc(mode=mode, outcome="ok")
+        except Exception as e:
+            token_refreshes.inc(mode=mode, outcome="error")
+            print(f"Failed to refresh Google token ({mode}): {e}")
+        finally:
+            if mode == 'background':
+                with self._lock:
+                    self._refreshing = False
+
+    def _save(self, creds):
+        # Written atomically so another worker never reads half a token file
+        tmp_path = f"{self.token_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as token:
+            token.write(creds.to_json())
+        os.replace(tmp_path, self.token_path)
+        with self._lock:
+            # Our own write, so the credentials in memory are already current
+            if self._creds is creds:
+                self._creds_mtime = os.stat(self.token_path).st_mtime
+
+    def get(self):
+        """This thread's Calendar service, built once per thread and per set of credentials."""
+        from googleapiclient.discovery import build, build_from_document
+
+        creds = None if REPLAYING else self.credentials()
+        cached = getattr(self._local, 'service', None)
+        # Rebuilt after a fork or once token.json has been reloaded into new credentials
+        if cached is not None and cached[0] == os.getpid() and cached[1] is creds:
+            return cached[2]
+
+        # Replayed Calendar traffic needs no token.json (see cassette.py)
+        document = discovery_document('calendar', 'v3')
+        if document is not None:
+            service = build_from_document(document, **google_build_args(creds))
+        else:
+            service = build('calendar', 'v3', **google_build_args(creds))
+        self._local.service = (os.getpid(), creds, service)
+        return service
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_calendar_pool(scopes, token_path=None):
+    """The process-wide pool for a token file and scopes, shared by every app in the process."""
+    token_path = token_path or GOOGLE_TOKEN_PATH
+    key = (token_path, tuple(scopes))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = CalendarServicePool(scopes, token_path, GOOGLE_TOKEN_REFRESH_MARGIN)
+        return _pools[key]
@@ -0,0 +1,254 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Where the time of a phone call goes. Every webhook is timed per CallSid and split
+# into stages: the LLM, external APIs (Google, Stripe), TwiML rendering and the rest
+# of our own code ("app"). The gap between our reply to a call and its next webhook
+# is recorded as the "caller" stage: Twilio playing the prompt, the caller speaking
+# and speech endpointing. Histograms, in-flight gauges and LLM token counts are
+# served in the Prometheus text format at /metrics by instrument().
+#
+# Metrics live in the process, so with several gunicorn workers each worker reports
+# its own numbers; scrape the workers individually or run one worker per port.
+
+CALL_IDLE_TIMEOUT = float(os.getenv('CALL_IDLE_TIMEOUT', '120'))  # seconds before a silent call stops counting as in flight
+CALL_METRICS_LOG = os.getenv('CALL_METRICS_LOG', 'true').lower() == 'true'
+
+# Requests that are not webhook turns of a call: the metrics themselves and Twilio's
+# partial speech callbacks, which arrive while the caller is still talking
+UNTRACED_PATHS = {'/metrics', '/partial_speech'}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose labelled values are read from a callback when rendered."""
+
+    def __init__(self, name, help_text, labelnames, read):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.read = read
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in snapshot:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=bound))} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]:.6f}")
+        return lines
+
+
+# (app, CallSid) -> [last webhook seen, when our last reply was sent]
+_calls = {}
+_calls_lock = threading.Lock()
+# app -> webhooks currently being handled
+_webhooks_in_flight = {}
+
+def _calls_in_flight():
+    cutoff = time.monotonic() - CALL_IDLE_TIMEOUT
+    counts = {}
+    with _calls_lock:
+        for key in [k for k, v in _calls.items() if v[0] < cutoff]:
+            del _calls[key]
+        for app_name, _ in _calls:
+            counts[(app_name,)] = counts.get((app_name,), 0) + 1
+    return counts
+
+def _webhooks_in_flight_counts():
+    with _calls_lock:
+        return {(app_name,): count for app_name, count in _webhooks_in_flight.items()}
+
+webhook_seconds = Histogram('twilio_webhook_seconds', "Time to answer a webhook.", ('app', 'endpoint'))
+stage_seconds = Histogram('twilio_webhook_stage_seconds', "Time spent in each stage of a call.", ('app', 'stage'))
+llm_tokens = Counter('llm_tokens_total', "Tokens used by chat completions.", ('model', 'kind'))
+llm_requests = Counter('llm_requests_total', "Chat completion calls by outcome.", ('model', 'outcome'))
+calls_in_flight = Gauge('twilio_calls_in_flight', "Calls with a webhook in the last CALL_IDLE_TIMEOUT seconds.",
+                        ('app',), _calls_in_flight)
+webhooks_in_flight = Gauge('twilio_webhooks_in_flight', "Webhooks currently being handled.",
+                           ('app',), _webhooks_in_flight_counts)
+
+METRICS = [webhook_seconds, stage_seconds, calls_in_flight, webhooks_in_flight, llm_tokens, llm_requests]
+
+def register(metric):
+    """Add a metric defined elsewhere to the /metrics output and return it."""
+    METRICS.append(metric)
+    return metric
+
+def render_metrics():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# The webhook being handled on this thread, if any
+_current = threading.local()
+
+@contextmanager
+def stage(name):
+    """Time a block of work as a stage of the current webhook, e.g. stage('llm')."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        trace = getattr(_current, 'trace', None)
+        if trace is not None:
+            trace['stages'].append((name, started - trace['started'], elapsed))
+            app_name = trace['app']
+        else:
+            app_name = "background"
+        stage_seconds.observe(elapsed, app=app_name, stage=name)
+
+def record_llm_usage(model, usage):
+    """Count the prompt and completion tokens of a chat completion."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    llm_tokens.inc(prompt_tokens, model=model, kind="prompt")
+    llm_tokens.inc(completion_tokens, model=model, kind="completion")
+    counted = getattr(_current, 'token_count', None)
+    if counted is not None:
+        counted['tokens'] += prompt_tokens + completion_tokens
+
+@contextmanager
+def count_tokens():
+    """Add up the LLM tokens used on this thread inside the block, in the yielded dict's 'tokens'."""
+    counted = _current.token_count = {'tokens': 0}
+    try:
+        yield counted
+    finally:
+        _current.token_count = None
+
+def in_webhook():
+    """Whether this thread is handling a webhook of an instrumented app."""
+    return getattr(_current, 'trace', None) is not None
+
+def current_route():
+    """(app, route) of the webhook this thread is handling, or ('background', '-') outside one."""
+    trace = getattr(_current, 'trace', None)
+    if trace is None:
+        return "background", "-"
+    return trace['app'], trace['route']
+
+def end_call(app_name, call_sid):
+    """Stop counting a call as in flight, e.g. when the caller says goodbye."""
+    with _calls_lock:
+        _calls.pop((app_name, call_sid), None)
+
+def instrument(app, name):
+    """Time every webhook of a Flask app by stage and serve the metrics at /metrics."""
+    from flask import request, Response
+
+    @app.before_request
+    def start_trace():
+        if request.path in UNTRACED_PATHS:
+            return
+        now = time.monotonic()
+        call_sid = request.form.get('CallSid') if request.mimetype == 'application/x-www-form-urlencoded' else None
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        _current.trace = {'app': name, 'route': route, 'call_sid': call_sid, 'started': time.perf_counter(), 'stages': []}
+        with _calls_lock:
+            _webhooks_in_flight[name] = _webhooks_in_flight.get(name, 0) + 1
+            call = _calls.get((name, call_sid)) if call_sid else None
+            if call_sid:
+                _calls[(name, call_sid)] = [now, call[1] if call else None]
+        if call and call[1] is not None:
+            stage_seconds.observe(now - call[1], app=name, stage="caller")
+            _current.trace['caller'] = now - call[1]
+
+    @app.teardown_request
+    def finish_trace(exc):
+        trace = getattr(_current, 'trace', None)
+        if trace is None:
+            return
+        _current.trace = None
+        total = time.perf_counter() - trace['started']
+        endpoint = trace['route']
+        webhook_seconds.observe(total, app=name, endpoint=endpoint)
+        stage_seconds.observe(max(0.0, total - sum(s[2] for s in trace['stages'])), app=name, stage="app")
+
+        call_sid = trace['call_sid']
+        with _calls_lock:
+            _webhooks_in_flight[name] -= 1
+            call = _calls.get((name, call_sid)) if call_sid else None
+            if call is not None:
+                call[1] = time.monotonic()
+
+        if CALL_METRICS_LOG and call_sid:
+            parts = [f"{s[0]}@{s[1]:.3f}s={s[2]:.3f}s" for s in trace['stages']]
+            if 'caller' in trace:
+                parts.insert(0, f"caller={trace['caller']:.3f}s")
+            print(f"[{call_sid}] {endpoint} {total:.3f}s {' '.join(parts)}")
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
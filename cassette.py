@@ -0,0 +1,275 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+# Record/replay of outbound HTTP at the transport level, so an app can run, be load
+# tested and be profiled on a machine with no OpenAI, Google or Twilio access.
+#
+#   CASSETTE_MODE=record  pass requests through and append each exchange to the cassette
+#   CASSETTE_MODE=replay  answer from the cassette only; a request that was never
+#                         recorded raises CassetteMissError instead of going out
+#
+# Hooks: httpx_transport() for the OpenAI client, mount() for requests sessions
+# (Custom Search, Twilio's REST client), httplib2_http() for the Google API client.
+# Requests are matched on method, URL and body, ignoring volatile or secret query
+# parameters (CASSETTE_IGNORE_PARAMS). A request recorded several times is replayed
+# in recorded order, wrapping around, so replay is deterministic per process.
+# CASSETTE_LATENCY delays each replayed response: "recorded" for the recorded
+# duration, or a distribution such as "fixed:0.5" or "lognormal:-0.7,0.5".
+
+CASSETTE_MODE = os.getenv('CASSETTE_MODE', 'off').lower()   # off, record or replay
+CASSETTE_PATH = os.getenv('CASSETTE_PATH', os.path.join('cassettes', 'default.jsonl'))
+CASSETTE_LATENCY = os.getenv('CASSETTE_LATENCY', '')
+CASSETTE_IGNORE_PARAMS = set(os.getenv('CASSETTE_IGNORE_PARAMS', 'access_token,key,timeMin,quotaUser').split(','))
+
+ENABLED = CASSETTE_MODE in ('record', 'replay')
+REPLAYING = CASSETTE_MODE == 'replay'
+
+# Headers that describe the wire encoding; bodies are stored decoded
+HOP_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection'}
+
+class CassetteMissError(Exception):
+    """Raised in replay mode for a request the cassette has no recording of."""
+
+
+def parse_latency(spec):
+    """Turn a latency spec such as 'uniform:0.2,1.5' into a function of the recorded duration."""
+    if not spec:
+        return lambda recorded: 0.0
+    if spec == 'recorded':
+        return lambda recorded: recorded
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda recorded: values[0]
+    if kind == 'uniform':
+        return lambda recorded: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda recorded: max(random.gauss(values[0], values[1]), 0.0)
+    if kind == 'lognormal':
+        return lambda recorded: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def _normalize_url(url, ignore):
+    parts = urllib.parse.urlsplit(url)
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if k not in ignore)
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, urllib.parse.urlencode(query), ''))
+
+def _normalize_body(body):
+    if not body:
+        return b''
+    if isinstance(body, str):
+        body = body.encode()
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except ValueError:
+        return body
+
+
+class Cassette:
+    """A JSON-lines file of recorded HTTP exchanges."""
+
+    def __init__(self, path, mode, latency='', ignore_params=()):
+        self.path = path
+        self.mode = mode
+        self.latency = parse_latency(latency)
+        self.ignore_params = set(ignore_params)
+        self._recordings = {}   # key -> [exchange, ...]
+        self._played = {}       # key -> times replayed
+        self._lock = threading.Lock()
+        if mode == 'replay':
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise CassetteMissError(f"No cassette at {self.path}; record one with CASSETTE_MODE=record")
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self._recordings.setdefault(exchange['key'], []).append(exchange)
+
+    def key(self, method, url, body):
+        """Match key of a request: method, URL without ignored parameters, and a hash of the body."""
+        digest = hashlib.sha256(_normalize_body(body)).hexdigest()[:16]
+        return f"{method.upper()} {_normalize_url(url, self.ignore_params)} {digest}"
+
+    def play(self, method, url, body, send):
+        """Return (status, headers, body bytes) for a request, from the cassette or from send()."""
+        key = self.key(method, url, body)
+        if self.mode == 'replay':
+            with self._lock:
+                recordings = self._recordings.get(key)
+                if not recordings:
+                    raise CassetteMissError(f"No recording for {key} in {self.path}")
+                played = self._played.get(key, 0)
+                self._played[key] = played + 1
+            exchange = recordings[played % len(recordings)]
+            delay = self.latency(exchange['duration'])
+            if delay > 0:
+                time.sleep(delay)
+            content = base64.b64decode(exchange['body_b64']) if 'body_b64' in exchange else exchange['body'].encode()
+            return exchange['status'], exchange['headers'], content
+
+        started = time.perf_counter()
+        status, headers, content = send()
+        exchange = {
+            'key': key,
+            'method': method.upper(),
+            'url': _normalize_url(url, self.ignore_params),  # secrets in the query string are not stored
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS},
+            'duration': round(time.perf_counter() - started, 6),
+        }
+        try:
+            exchange['body'] = content.decode()
+        except UnicodeDecodeError:
+            exchange['body_b64'] = base64.b64encode(content).decode()
+        line = json.dumps(exchange) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # One write per exchange in append mode, so workers recording together do not interleave lines
+            with open(self.path, 'a') as f:
+                f.write(line)
+        return status, exchange['headers'], content
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette():
+    """The process-wide cassette for CASSETTE_MODE, or None when it is off."""
+    global _cassette
+    if not ENABLED:
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_LATENCY, CASSETTE_IGNORE_PARAMS)
+    return _cassette
+
+def httpx_transport(**transport_options):
+    """httpx transport for the OpenAI client: recording or replaying when enabled, plain otherwise."""
+    import httpx
+
+    inner = httpx.HTTPTransport(**transport_options)
+    cassette = get_cassette()
+    if cassette is None:
+        return inner
+
+    class CassetteTransport(httpx.BaseTransport):
+        def handle_request(self, request):
+            def send():
+                response = inner.handle_request(request)
+                try:
+                    content = response.read()
+                finally:
+                    response.close()
+                return response.status_code, dict(response.headers), content
+
+            status, headers, content = cassette.play(request.method, str(request.url), request.read(), send)
+            return httpx.Response(status, headers=headers, content=content, request=request)
+
+        def close(self):
+            inner.close()
+
+    return CassetteTransport()
+
+def mount(session):
+    """Route a requests.Session (or anything with .mount) through the cassette when enabled."""
+    cassette = get_cassette()
+    if cassette is None:
+        return session
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.structures import CaseInsensitiveDict
+
+    class CassetteAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            def send_live():
+                response = super(CassetteAdapter, self).send(request, **kwargs)
+                return response.status_code, dict(response.headers), response.content
+
+            status, headers, content = cassette.play(request.method, request.url, request.body, send_live)
+            response = requests.Response()
+            response.status_code = status
+            response.headers = CaseInsensitiveDict(headers)
+            response._content = content
+            response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+            response.url = request.url
+            response.request = request
+            response.reason = ''
+            return response
+
+    adapter = CassetteAdapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def requests_session():
+    """A requests.Session that records or replays when the cassette is enabled."""
+    import requests
+
+    return mount(requests.Session())
+
+def twilio_http_client():
+    """http_client for twilio.rest.Client: Twilio's own client on a cassette session, or None for the default."""
+    if get_cassette() is None:
+        return None
+    from twilio.http.http_client import TwilioHttpClient
+
+    http_client = TwilioHttpClient()
+    mount(http_client.session)
+    return http_client
+
+def httplib2_http(inner=None):
+    """An httplib2-compatible object for googleapiclient's build(http=...), around `inner` when recording.
+
+    In replay mode `inner` may be None, so no credentials are needed.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return inner
+
+    class CassetteHttp:
+        def __init__(self, inner):
+            self.inner = inner
+            # googleapiclient reads these off the http object
+            self.timeout = getattr(inner, 'timeout', None)
+            self.redirect_codes = getattr(inner, 'redirect_codes', set())
+
+        def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+            import httplib2
+
+            def send():
+                if self.inner is None:
+                    raise CassetteMissError("Recording Google traffic needs an authorized http")
+                response, content = self.inner.request(uri, method, body, headers, *args, **kwargs)
+                headers_out = {k: v for k, v in response.items() if k != 'status'}
+                return response.status, headers_out, content
+
+            status, headers_out, content = cassette.play(method, uri, body, send)
+            response = httplib2.Response(dict(headers_out, status=str(status)))
+            return response, content
+
+        def close(self):
+            if self.inner is not None and hasattr(self.inner, 'close'):
+                self.inner.close()
+
+    return CassetteHttp(inner)
+
+def google_build_args(creds):
+    """Keyword arguments for googleapiclient's build(): credentials, or an http that records or replays."""
+    if get_cassette() is None:
+        return {'credentials': creds}
+    inner = None
+    if creds is not None:
+        from google_auth_httplib2 import AuthorizedHttp
+
+        inner = AuthorizedHttp(creds)
+    return {'http': httplib2_http(inner)}
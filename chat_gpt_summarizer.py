@@ -2,26 +2,24 @@ import speech_recognition as sr
 from gtts import gTTS
 from playsound import playsound
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
 import os
-import openai
-from transformers import pipeline
+import llm_client
+from offline_assets import require_nltk, load_summarizer, startup_step
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Download the VADER lexicon for sentiment analysis
-nltk.download('vader_lexicon')
+# Load the VADER lexicon from the bundled assets (python offline_assets.py prepare)
+require_nltk('vader_lexicon')
 
 # Initialize the sentiment analyzer
-sid = SentimentIntensityAnalyzer()
+with startup_step('sentiment analyzer'):
+    sid = SentimentIntensityAnalyzer()
 
-# Initialize the summarization pipeline
-summarizer = pipeline("summarization")
-
-# OpenAI API Key from environment variable
-openai.api_key = os.getenv('OPENAI_API_KEY')
+# Initialize the summarization pipeline from the bundled model weights
+with startup_step('summarization pipeline'):
+    summarizer = load_summarizer()
 
 def recognize_speech_from_streaming_audio(prompt=""):
     recognizer = sr.Recognizer()
@@ -56,7 +54,7 @@ def text_to_speech(text):
     os.remove(filename)
 
 def get_chatgpt_response(user_question):
-    chat_response = openai.chat.completions.create(
+    chat_response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are an expert at answering questions."},
@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import threading
+import time
+from ttl_cache import TTLCache
+
+# Server-side storage for per-call conversation history, keyed by Twilio's CallSid.
+# Keeping the history here instead of in the Flask session keeps the signed cookie
+# small and means each webhook only touches the turns it adds.
+
+class MemoryConversationStore:
+    """In-process store: an LRU of call histories that expire after a period of inactivity."""
+
+    def __init__(self, max_calls=1000, ttl=3600):
+        self._calls = TTLCache(maxsize=max_calls, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def load(self, call_sid, limit=None):
+        """Return the stored messages for a call, optionally only the last `limit` of them."""
+        history = self._calls.get(call_sid, [])
+        if limit is not None:
+            return list(history[-limit:]) if limit > 0 else []
+        return list(history)
+
+    def load_recent(self, call_sid, limit):
+        """Return (offset, messages): the last `limit` messages and how many earlier ones were left out."""
+        history = self._calls.get(call_sid, [])
+        recent = history[-limit:] if limit > 0 else []
+        return len(history) - len(recent), list(recent)
+
+    def append(self, call_sid, *messages):
+        """Append one or more {"role", "content"} messages to a call's history."""
+        with self._lock:
+            history = self._calls.get(call_sid)
+            if history is None:
+                history = []
+                self._calls.set(call_sid, history)
+            else:
+                self._calls.touch(call_sid)
+            history.extend(messages)
+
+    def clear(self, call_sid):
+        """Forget everything stored for a call."""
+        self._calls.pop(call_sid)
+
+
+class SQLiteConversationStore:
+    """SQLite-backed store that can be shared by several worker processes on one host."""
+
+    # Purge expired calls once every this many appends
+    PURGE_EVERY = 200
+
+    def __init__(self, path='conversations.db', ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._appends = 0
+        conn = self._connection()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS calls (
+                call_sid TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                call_sid TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_call ON messages (call_sid, id);
+            CREATE INDEX IF NOT EXISTS idx_calls_updated ON calls (updated_at);
+        ''')
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a fork must not be used by the child process
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, call_sid, limit=None):
+        """Return the stored messages for a call, optionally only the last `limit` of them."""
+        conn = self._connection()
+        row = conn.execute('SELECT updated_at FROM calls WHERE call_sid = ?', (call_sid,)).fetchone()
+        if row is None or row[0] < time.time() - self.ttl:
+            return []
+        if limit is None:
+            rows = conn.execute(
+                'SELECT role, content FROM messages WHERE call_sid = ? ORDER BY id', (call_sid,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT role, content FROM messages WHERE call_sid = ? ORDER BY id DESC LIMIT ?',
+                (call_sid, max(limit, 0))
+            ).fetchall()
+            rows.reverse()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def load_recent(self, call_sid, limit):
+        """Return (offset, messages): the last `limit` messages and how many earlier ones were left out."""
+        conn = self._connection()
+        row = conn.execute('SELECT updated_at FROM calls WHERE call_sid = ?', (call_sid,)).fetchone()
+        if row is None or row[0] < time.time() - self.ttl:
+            return 0, []
+        # Counted over the (call_sid, id) index, so older messages are never read
+        total = conn.execute('SELECT COUNT(*) FROM messages WHERE call_sid = ?', (call_sid,)).fetchone()[0]
+        rows = conn.execute(
+            'SELECT role, content FROM messages WHERE call_sid = ? ORDER BY id DESC LIMIT ?',
+            (call_sid, max(limit, 0))
+        ).fetchall()
+        rows.reverse()
+        return total - len(rows), [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, call_sid, *messages):
+        """Append one or more {"role", "content"} messages to a call's history."""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO calls (call_sid, updated_at) VALUES (?, ?) '
+                'ON CONFLICT(call_sid) DO UPDATE SET updated_at = excluded.updated_at',
+                (call_sid, time.time())
+            )
+            conn.executemany(
+                'INSERT INTO messages (call_sid, role, content) VALUES (?, ?, ?)',
+                [(call_sid, m["role"], m["content"]) for m in messages]
+            )
+        self._appends += 1
+        if self._appends % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def clear(self, call_sid):
+        """Forget everything stored for a call."""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM messages WHERE call_sid = ?', (call_sid,))
+            conn.execute('DELETE FROM calls WHERE call_sid = ?', (call_sid,))
+
+    def purge_expired(self):
+        """Delete calls that have been idle for longer than the TTL."""
+        cutoff = time.time() - self.ttl
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'DELETE FROM messages WHERE call_sid IN (SELECT call_sid FROM calls WHERE updated_at < ?)',
+                (cutoff,)
+            )
+            conn.execute('DELETE FROM calls WHERE updated_at < ?', (cutoff,))
+
+
+def create_conversation_store():
+    """Build the conversation store selected by the CONVERSATION_STORE environment variable."""
+    backend = os.getenv('CONVERSATION_STORE', 'memory').lower()
+    ttl = int(os.getenv('CONVERSATION_TTL', '3600'))
+    if backend == 'sqlite':
+        return SQLiteConversationStore(os.getenv('CONVERSATION_DB', 'conversations.db'), ttl=ttl)
+    if backend == 'memory':
+        return MemoryConversationStore(int(os.getenv('CONVERSATION_MAX_CALLS', '1000')), ttl=ttl)
+    raise ValueError(f"Unknown CONVERSATION_STORE backend: {backend}")
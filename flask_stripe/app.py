@@ -1,74 +1,302 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from twilio.twiml.voice_response import VoiceResponse, Gather
+from sqlalchemy.exc import IntegrityError
 import os
-import stripe
-import random
-import openai
+import sys
+import hmac
+import hashlib
+import secrets
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+# Make the shared modules in the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_client
+from call_metrics import instrument, stage, end_call
+from conversation_store import create_conversation_store
+from history_window import create_history_manager
+from mcq_cache import create_mcq_cache
+from slow_speech import render_slow_speech
+from speculative import create_prefetcher, observe_partial, PREFETCH_GATHER_OPTIONS
+from mcq_parser import parse_mcq, MCQ_SINGLE_UTTERANCE, MCQ_SPEECH_TIMEOUT, MCQ_PROMPT, MCQ_HINTS
+from twiml_cache import (speech_prompt, digits_prompt, redirect_response, hangup_response, compile_twiml,
+                         TwiMLTemplate, say_then_prompt, twiml_then_prompt, slot, GOODBYE)
+from semantic_cache import create_semantic_cache
+from ttl_cache import TTLCache
+from secret_key import load_secret_key
+from rate_limiter import priority
+from password_pool import hash_password, verify_password, needs_rehash, allow_login_attempt, PasswordPoolBusyError
+
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize the Flask app
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# Initialize the Flask app. The instance folder (and the database in it) is pinned next to
+# this file: imported as flask_stripe.app, Flask would otherwise use <repo>/instance
+app = Flask(__name__, instance_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'stripe')  # Per-stage webhook timings, served at /metrics
 
-# Set the database URI - the name of your SQLite database file
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///my_database.db'
+# Set the database URI - the name of your SQLite database file; DATABASE_URI points elsewhere (e.g. in tests)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///my_database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Initialize SQLAlchemy and Stripe
+# Initialize SQLAlchemy
 db = SQLAlchemy(app)
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# The Stripe SDK is slow to import and only the payment routes need it, so it is loaded on first use
+_stripe = None
+
+def get_stripe():
+    """Import and configure the Stripe SDK the first time it is needed."""
+    global _stripe
+    if _stripe is None:
+        import stripe
+        stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+        # Point STRIPE_API_BASE at a local Stripe stand-in (stripe-mock or benchmarks/mock_stripe.py) for testing
+        if os.getenv('STRIPE_API_BASE'):
+            stripe.api_base = os.getenv('STRIPE_API_BASE')
+        _stripe = stripe
+    return _stripe
+
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+# Conversation history lives server-side, keyed by the Twilio CallSid
+conversation_store = create_conversation_store()
+
+# Keeps prompts under a token budget by summarizing older turns
+history_manager = create_history_manager()
+
+# Answers to multiple-choice questions, shared between callers
+mcq_cache = create_mcq_cache()
+
+def mcq_prompt(*texts):
+    """Prompt for a multiple-choice question, in one utterance when MCQ_SINGLE_UTTERANCE is on."""
+    if MCQ_SINGLE_UTTERANCE:
+        texts = texts[:-1] + (f"{texts[-1]} {MCQ_PROMPT}",)
+        return speech_prompt(texts, "get_full_mcq", speechTimeout=MCQ_SPEECH_TIMEOUT, hints=MCQ_HINTS)
+    return speech_prompt(texts, "get_question")
+
+# Replies that never change are serialized once, at import (see twiml_cache.py)
+QUESTION_TYPE_PROMPT = compile_twiml(speech_prompt(
+    "Thank you. Would you like to ask a general question or a multiple-choice question?", "choose_question_type"))
+GENERAL_QUESTION_PROMPT = compile_twiml(speech_prompt("Please state your question.", "transcribe", **PREFETCH_GATHER_OPTIONS))
+MCQ_QUESTION_PROMPT = compile_twiml(mcq_prompt("Please state your question."))
+OPTION_PROMPTS = {
+    letter: compile_twiml(speech_prompt(f"Thank you. Please state option {letter.upper()}.", f"get_option_{letter}"))
+    for letter in "abcd"
+}
+# Replies that only differ in the answer are rendered from templates
+MCQ_ANSWER = TwiMLTemplate(mcq_prompt(slot('answer'), "Please state your next multiple-choice question."))
+ANSWER_PROMPT = say_then_prompt("transcribe", **PREFETCH_GATHER_OPTIONS)
+SLOW_ANSWER_PROMPT = twiml_then_prompt("transcribe", **PREFETCH_GATHER_OPTIONS)
+
+# Answers to opening questions, matched by similarity rather than exact wording
+semantic_cache = create_semantic_cache()
+
+# In async mode /transcribe answers immediately with a filler prompt and the caller's
+# question is answered on a worker pool; Twilio then polls /answer_status for it.
+# Pending answers live in this process, so run async mode with a single process
+# (more threads) or route each call to the same worker.
+ASYNC_ANSWERS = os.getenv('ASYNC_ANSWERS', 'false').lower() == 'true'
+ANSWER_TIMEOUT = float(os.getenv('ANSWER_TIMEOUT', '30'))
+answer_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ANSWER_WORKERS', '8')))
+# CallSid -> (future, user message, time submitted). Callers who hang up mid-answer never
+# poll again, so their entries expire shortly after they could last have been collected.
+pending_answers = TTLCache(maxsize=int(os.getenv('PENDING_ANSWERS_MAX', '10000')), ttl=ANSWER_TIMEOUT + 60)
+
+def answer_in_background(conversation_history, call_sid, offset=0):
+    """answer_question on the answer pool; the caller is waiting on the line, so it keeps live priority."""
+    with priority('live'):
+        return answer_question(conversation_history, call_sid, offset)
+
+def speculative_answer(call_sid, question):
+    """Answer a partial question against the call's saved history, for the prefetcher."""
+    offset, conversation_history = conversation_store.load_recent(call_sid, history_manager.load_limit)
+    conversation_history.append({"role": "user", "content": question})
+    # Only the final transcript's answer goes in the semantic cache (see transcribe)
+    return answer_question(conversation_history, call_sid, offset, cache_answer=False)
+
+# Answers started from partial speech results while the caller is still talking
+prefetcher = create_prefetcher('stripe', speculative_answer)
+THINKING_PROMPT = compile_twiml(redirect_response("answer_status", text="One moment while I think about that.", method="POST"))
+POLL_AGAIN = compile_twiml(redirect_response("answer_status", pause=1, method="POST"))
+LOST_QUESTION_PROMPT = compile_twiml(speech_prompt("Sorry, I lost track of your question. Please ask it again.", "transcribe", **PREFETCH_GATHER_OPTIONS))
+ANSWER_TIMEOUT_PROMPT = compile_twiml(speech_prompt("Sorry, that is taking too long. Please ask your question again.", "transcribe", **PREFETCH_GATHER_OPTIONS))
+ANSWER_FAILED_PROMPT = compile_twiml(speech_prompt("Sorry, something went wrong. Please ask your question again.", "transcribe", **PREFETCH_GATHER_OPTIONS))
 
 # Create User model
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
+    # Plaintext passcodes from before the Passcode table; moved into it and cleared at startup
     passcode = db.Column(db.String(10), nullable=True)
     has_paid = db.Column(db.Boolean, default=False)
 
+# Hashed passcodes of paying users, one per user, looked up by hash over a unique index
+class Passcode(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    code_hash = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+
+# Checkout Sessions created for users, so repeated clicks on "Pay" reuse the open one
+class CheckoutSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    stripe_session_id = db.Column(db.String(255), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True, nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='open', nullable=False)
+
+# Checkout Sessions that have been fulfilled; the unique key makes fulfillment idempotent
+class FulfilledPayment(db.Model):
+    stripe_session_id = db.Column(db.String(255), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    fulfilled_at = db.Column(db.Float, nullable=False)
+
+# Number of digits in newly issued phone passcodes; raise it as the number of paying users grows.
+# Callers end the passcode with # instead of Twilio counting digits, so codes issued
+# at an earlier length keep working after a change.
+PASSCODE_DIGITS = int(os.getenv('PASSCODE_DIGITS', '4'))
+
+# Passcode prompts, serialized once like the others
+PASSCODE_PROMPT = compile_twiml(digits_prompt(
+    "Hello, please enter your passcode, then press pound.", "check_passcode", finish_on_key="#"))
+PASSCODE_ACCEPTED = compile_twiml(speech_prompt(
+    "Passcode accepted. Would you like a slow response with pauses, or a fast response?", "set_speed"))
+PASSCODE_REJECTED = compile_twiml(hangup_response("Invalid passcode. Goodbye."))
+PASSCODE_RETRY = compile_twiml(redirect_response("voice", text="Invalid passcode. Please try again."))
+
+# Secret mixed into passcode hashes so the table cannot be reversed by hashing every code.
+# There are only 10^PASSCODE_DIGITS codes, so without it the hashes protect nothing.
+PASSCODE_PEPPER = os.getenv('PASSCODE_PEPPER', '').encode()
+if not PASSCODE_PEPPER:
+    raise RuntimeError("Set PASSCODE_PEPPER to a long random secret, e.g. python -c 'import secrets; print(secrets.token_hex(32))'")
+
+# Read-through cache of active passcode hashes -> user id. Only found codes are cached, and only
+# briefly: a code replaced through /new_passcode is dropped from this worker's cache at once, but
+# other workers keep accepting it until their entry expires (PASSCODE_CACHE_TTL seconds)
+PASSCODE_CACHE_TTL = float(os.getenv('PASSCODE_CACHE_TTL', '5'))
+active_passcodes = TTLCache(maxsize=int(os.getenv('PASSCODE_CACHE_SIZE', '100000')), ttl=PASSCODE_CACHE_TTL)
+
+def hash_passcode(passcode):
+    """Return the keyed hash stored for a passcode."""
+    return hmac.new(PASSCODE_PEPPER, passcode.encode(), hashlib.sha256).hexdigest()
+
+def lookup_passcode(passcode):
+    """Return the id of the paying user that owns passcode, or None."""
+    code_hash = hash_passcode(passcode)
+    user_id = active_passcodes.get(code_hash)
+    if user_id is None:
+        row = Passcode.query.filter_by(code_hash=code_hash).first()
+        if row is None:
+            return None
+        user_id = row.user_id
+        active_passcodes.set(code_hash, user_id)
+    return user_id
+
+def issue_passcode(user, replace=True):
+    """Assign the user a new passcode that no other user holds and return it.
+
+    Only its hash is stored, so the returned code can be shown to the user once. With
+    replace=False a user who already has a passcode keeps it and None is returned.
+    """
+    for _ in range(20):
+        passcode = str(secrets.randbelow(9 * 10 ** (PASSCODE_DIGITS - 1)) + 10 ** (PASSCODE_DIGITS - 1))
+        code_hash = hash_passcode(passcode)
+        if Passcode.query.filter_by(code_hash=code_hash).first():
+            continue
+        try:
+            # A savepoint, so losing a race for the same code only undoes this attempt
+            with db.session.begin_nested():
+                row = Passcode.query.filter_by(user_id=user.id).first()
+                if row is None:
+                    db.session.add(Passcode(user_id=user.id, code_hash=code_hash))
+                elif not replace:
+                    return None
+                else:
+                    active_passcodes.pop(row.code_hash)
+                    row.code_hash = code_hash
+        except IntegrityError:
+            continue
+        active_passcodes.set(code_hash, user.id)
+        return passcode
+    raise RuntimeError("Could not find a free passcode; increase PASSCODE_DIGITS")
+
 # Initialize the database
 with app.app_context():
     db.create_all()
 
+    # Move plaintext passcodes into the Passcode table, hashed with the current pepper,
+    # and clear them. Codes that were already hashed without a pepper are rehashed too.
+    for legacy_user in User.query.filter(User.passcode != None).all():
+        code_hash = hash_passcode(legacy_user.passcode)
+        row = Passcode.query.filter_by(user_id=legacy_user.id).first()
+        taken = Passcode.query.filter(Passcode.code_hash == code_hash, Passcode.user_id != legacy_user.id).first()
+        if legacy_user.has_paid and taken is None:
+            if row is None:
+                db.session.add(Passcode(user_id=legacy_user.id, code_hash=code_hash))
+            else:
+                row.code_hash = code_hash
+        elif row is not None:
+            # Two users were given the same code; the later one gets a new one from the dashboard
+            db.session.delete(row)
+        legacy_user.passcode = None
+        db.session.flush()
+    db.session.commit()
+
 # Route for the login and registration page
 @app.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        if 'login' in request.form:
-            # Handle the login
-            username = request.form['username']
-            password = request.form['password']
-
-            user = User.query.filter_by(username=username).first()
-            if user and check_password_hash(user.password, password):
-                session['user_id'] = user.id
-                return redirect(url_for('dashboard'))
-            else:
-                flash('Invalid username or password', 'danger')
+        # Throttle attempts per client before doing any expensive hashing
+        if not allow_login_attempt(request.remote_addr):
+            flash('Too many attempts. Please wait a minute and try again.', 'danger')
+            return render_template('login.html'), 429
+        try:
+            return handle_login_form()
+        except PasswordPoolBusyError:
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_template('login.html'), 503
 
-        elif 'register' in request.form:
-            # Handle the registration
-            username = request.form['username']
-            password = request.form['password']
+    return render_template('login.html')
 
-            # Check if the username already exists
-            if User.query.filter_by(username=username).first():
-                flash('Username already exists. Please choose another.', 'danger')
-            else:
-                # Create a new user and add to the database
-                new_user = User(username=username, password=generate_password_hash(password, method='pbkdf2:sha256'))
-                db.session.add(new_user)
+def handle_login_form():
+    """Process a login or registration form post."""
+    if 'login' in request.form:
+        # Handle the login
+        username = request.form['username']
+        password = request.form['password']
+
+        user = User.query.filter_by(username=username).first()
+        if user and verify_password(user.password, password):
+            # Upgrade hashes made with older parameters while we have the plain password
+            if needs_rehash(user.password):
+                user.password = hash_password(password)
                 db.session.commit()
-                flash('Registration successful! Please log in.', 'success')
-                return redirect(url_for('login'))
+            session['user_id'] = user.id
+            return redirect(url_for('dashboard'))
+        else:
+            flash('Invalid username or password', 'danger')
+
+    elif 'register' in request.form:
+        # Handle the registration
+        username = request.form['username']
+        password = request.form['password']
+
+        # Check if the username already exists
+        if User.query.filter_by(username=username).first():
+            flash('Username already exists. Please choose another.', 'danger')
+        else:
+            # Create a new user and add to the database
+            new_user = User(username=username, password=hash_password(password))
+            db.session.add(new_user)
+            db.session.commit()
+            flash('Registration successful! Please log in.', 'success')
+            return redirect(url_for('login'))
 
     return render_template('login.html')
 
@@ -81,9 +309,28 @@ def dashboard():
     user = User.query.filter_by(id=session['user_id']).first()
 
     if user.has_paid:
-        return render_template('dashboard.html', passcode=user.passcode)
+        session.pop('payment_pending', None)
+        # Only the hash is kept, so a passcode is shown once: on the first visit after paying
+        passcode = issue_passcode(user, replace=False)
+        db.session.commit()
+        return render_template('dashboard.html', passcode=passcode)
     else:
-        return render_template('payment.html')
+        # While a payment is being fulfilled the page refreshes itself until the passcode is ready
+        processing = time.time() - session.get('payment_pending', 0) < 120
+        return render_template('payment.html', processing=processing)
+
+# Route to replace a lost passcode
+@app.route('/new_passcode', methods=['POST'])
+def new_passcode():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    user = User.query.filter_by(id=session['user_id']).first()
+    if not user.has_paid:
+        return redirect(url_for('dashboard'))
+    passcode = issue_passcode(user)
+    db.session.commit()
+    return render_template('dashboard.html', passcode=passcode)
 
 # Route to handle the payment process
 @app.route('/pay', methods=['POST'])
@@ -92,24 +339,37 @@ def pay():
         return redirect(url_for('login'))
 
     user = User.query.filter_by(id=session['user_id']).first()
-
-    # Create a Stripe Checkout Session
-    stripe_session = stripe.checkout.Session.create(
-        payment_method_types=['card'],
-        line_items=[{
-            'price_data': {
-                'currency': 'usd',
-                'product_data': {
-                    'name': 'Premium Passcode',
+    if user.has_paid:
+        return redirect(url_for('dashboard'))
+
+    # Send the user back to their open Checkout Session if they already have one
+    checkout_url = open_checkout_url(user.id)
+    if checkout_url:
+        return redirect(checkout_url)
+
+    # Create a Stripe Checkout Session; the idempotency key collapses double clicks into one session
+    with stage('stripe'):
+        stripe_session = get_stripe().checkout.Session.create(
+            idempotency_key=checkout_idempotency_key(user.id),
+            client_reference_id=str(user.id),
+            metadata={'user_id': str(user.id)},
+            payment_method_types=['card'],
+            line_items=[{
+                'price_data': {
+                    'currency': 'usd',
+                    'product_data': {
+                        'name': 'Premium Passcode',
+                    },
+                    'unit_amount': 500,  # $5.00
                 },
-                'unit_amount': 500,  # $5.00
-            },
-            'quantity': 1,
-        }],
-        mode='payment',
-        success_url=url_for('payment_success', _external=True),
-        cancel_url=url_for('dashboard', _external=True),
-    )
+                'quantity': 1,
+            }],
+            mode='payment',
+            # Stripe fills in {CHECKOUT_SESSION_ID}, so it must not be URL-encoded by url_for
+            success_url=url_for('payment_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
+            cancel_url=url_for('dashboard', _external=True),
+        )
+    remember_checkout(user.id, stripe_session)
 
     return redirect(stripe_session.url)
 
@@ -119,15 +379,179 @@ def payment_success():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    user = User.query.filter_by(id=session['user_id']).first()
-
-    # Generate a random 4-digit passcode
-    user.passcode = str(random.randint(1000, 9999))
-    user.has_paid = True
-    db.session.commit()
+    # The webhook is authoritative; this only speeds things up if the redirect arrives first.
+    # The fulfillment worker confirms the session with Stripe before issuing a passcode.
+    stripe_session_id = request.args.get('session_id')
+    if stripe_session_id:
+        enqueue_fulfillment(stripe_session_id, session['user_id'], verify=True)
+        session['payment_pending'] = time.time()
 
     return redirect(url_for('dashboard'))
 
+# Endpoint Stripe calls with payment events
+@app.route('/stripe_webhook', methods=['POST'])
+def stripe_webhook():
+    stripe = get_stripe()
+    try:
+        event = stripe.Webhook.construct_event(
+            request.get_data(), request.headers.get('Stripe-Signature', ''), STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        print(f"Rejected Stripe webhook: {e}")
+        return "Invalid payload", 400
+
+    # A StripeObject, not a dict: fields are read by subscript (it has no .get())
+    stripe_session = event['data']['object']
+    if event['type'] in ('checkout.session.completed', 'checkout.session.async_payment_succeeded'):
+        if stripe_session['payment_status'] == 'paid':
+            user_id = int(stripe_session['client_reference_id'] or stripe_session['metadata']['user_id'])
+            enqueue_fulfillment(stripe_session['id'], user_id)
+    elif event['type'] == 'checkout.session.expired':
+        forget_checkout(stripe_session['id'])
+
+    # Acknowledge right away; fulfillment happens on the background worker
+    return "", 200
+
+# Open Checkout Sessions by user id, in front of the CheckoutSession table
+open_checkouts = TTLCache(maxsize=10000, ttl=3600)
+
+def open_checkout_url(user_id):
+    """Return the URL of the user's unexpired open Checkout Session, if any."""
+    # Leave a minute of slack so the user is not sent to a session about to expire
+    now = time.time() + 60
+    cached = open_checkouts.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+    checkout = (
+        CheckoutSession.query.filter_by(user_id=user_id, status='open')
+        .filter(CheckoutSession.expires_at > now)
+        .order_by(CheckoutSession.expires_at.desc())
+        .first()
+    )
+    if checkout is None:
+        return None
+    open_checkouts.set(user_id, (checkout.url, checkout.expires_at))
+    return checkout.url
+
+def checkout_idempotency_key(user_id):
+    """Idempotency key for the next Checkout Session: the same until that session has been recorded."""
+    # Keyed on the user's newest CheckoutSession row, so clicks racing to create a session
+    # share a key whenever they arrive, while a new session once that one is gone gets a new key
+    latest = (
+        db.session.query(db.func.max(CheckoutSession.id))
+        .filter(CheckoutSession.user_id == user_id)
+        .scalar()
+    )
+    return f"checkout-{user_id}-{latest or 0}"
+
+def remember_checkout(user_id, stripe_session):
+    """Record a newly created Checkout Session as the user's open session."""
+    if CheckoutSession.query.filter_by(stripe_session_id=stripe_session.id).first() is None:
+        db.session.add(CheckoutSession(
+            stripe_session_id=stripe_session.id, user_id=user_id,
+            url=stripe_session.url, expires_at=stripe_session.expires_at
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent click with the same idempotency key already recorded it
+            db.session.rollback()
+    open_checkouts.set(user_id, (stripe_session.url, stripe_session.expires_at))
+
+def forget_checkout(stripe_session_id):
+    """Mark a Checkout Session as no longer open."""
+    checkout = CheckoutSession.query.filter_by(stripe_session_id=stripe_session_id).first()
+    if checkout:
+        checkout.status = 'expired'
+        db.session.commit()
+        open_checkouts.pop(checkout.user_id)
+
+# Background fulfillment: webhook and redirect handlers only enqueue, and a worker
+# thread applies the database writes in batches
+FULFILLMENT_BATCH_SIZE = int(os.getenv('FULFILLMENT_BATCH_SIZE', '50'))
+FULFILLMENT_BATCH_WAIT = float(os.getenv('FULFILLMENT_BATCH_WAIT', '0.25'))
+fulfillment_queue = queue.Queue()
+fulfillment_worker = None
+fulfillment_lock = threading.Lock()
+
+def enqueue_fulfillment(stripe_session_id, user_id, verify=False):
+    """Queue a paid Checkout Session for fulfillment; duplicates are ignored by the worker."""
+    global fulfillment_worker
+    # Start the worker on first use so forking servers start one per worker process
+    with fulfillment_lock:
+        if fulfillment_worker is None or not fulfillment_worker.is_alive():
+            fulfillment_worker = threading.Thread(target=run_fulfillment_worker, daemon=True)
+            fulfillment_worker.start()
+    fulfillment_queue.put({'session_id': stripe_session_id, 'user_id': user_id, 'verify': verify})
+
+def run_fulfillment_worker():
+    while True:
+        # Block for the first job, then collect whatever else arrives within the batch window
+        batch = [fulfillment_queue.get()]
+        deadline = time.monotonic() + FULFILLMENT_BATCH_WAIT
+        while len(batch) < FULFILLMENT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(fulfillment_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            with app.app_context():
+                fulfill_batch(batch)
+        except Exception as e:
+            print(f"Error fulfilling payments: {e}")
+
+def fulfill_batch(batch):
+    """Apply a batch of fulfillments in one transaction, falling back to one at a time on conflicts."""
+    jobs = {}
+    for job in batch:
+        # A webhook job needs no verification, so it wins over a redirect job for the same session
+        if job['session_id'] not in jobs or not job['verify']:
+            jobs[job['session_id']] = job
+    done = {
+        row.stripe_session_id
+        for row in FulfilledPayment.query.filter(FulfilledPayment.stripe_session_id.in_(list(jobs))).all()
+    }
+    pending = [job for session_id, job in jobs.items() if session_id not in done]
+    if not pending:
+        return
+
+    try:
+        for job in pending:
+            apply_fulfillment(job)
+        db.session.commit()
+        print(f"Fulfilled {len(pending)} payment(s)")
+    except IntegrityError:
+        # Another worker fulfilled one of these sessions first; retry individually
+        db.session.rollback()
+        for job in pending:
+            try:
+                apply_fulfillment(job)
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+
+def apply_fulfillment(job):
+    """Give the paying user a passcode and record the session as fulfilled."""
+    if job['verify']:
+        with stage('stripe'):
+            stripe_session = get_stripe().checkout.Session.retrieve(job['session_id'])
+        if stripe_session.payment_status != 'paid' or stripe_session.client_reference_id != str(job['user_id']):
+            print(f"Checkout Session {job['session_id']} is not paid by user {job['user_id']}; skipping")
+            return
+    user = db.session.get(User, job['user_id'])
+    if user is None:
+        return
+    # The passcode itself is issued when the user next opens the dashboard
+    user.has_paid = True
+    db.session.add(FulfilledPayment(stripe_session_id=job['session_id'], user_id=user.id, fulfilled_at=time.time()))
+    checkout = CheckoutSession.query.filter_by(stripe_session_id=job['session_id']).first()
+    if checkout:
+        checkout.status = 'complete'
+    open_checkouts.pop(user.id)
+
 # Route for logging out
 @app.route('/logout')
 def logout():
@@ -137,24 +561,14 @@ def logout():
 # Endpoint to handle incoming voice calls
 @app.route("/voice", methods=['POST'])
 def voice():
-    response = VoiceResponse()
-
-    # Initialize conversation history, speed preference, and attempt count in the session
-    if 'conversation_history' not in session:
-        session['conversation_history'] = []
+    # Initialize speed preference and attempt count in the session
     if 'speed_preference' not in session:
         session['speed_preference'] = 'fast'
     if 'passcode_attempts' not in session:
         session['passcode_attempts'] = 0
 
     # Ask the user to enter a passcode
-    response.say("Hello, please enter your passcode.")
-    
-    # Gather the passcode input from the user
-    gather = Gather(input="dtmf", num_digits=4, action="/check_passcode", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return PASSCODE_PROMPT
 
 # Endpoint to check the passcode
 @app.route("/check_passcode", methods=['POST'])
@@ -162,31 +576,21 @@ def check_passcode():
     passcode = request.form['Digits']
     print(f"User entered passcode: {passcode}")
 
-    response = VoiceResponse()
     session['passcode_attempts'] += 1
 
-    # Check if the passcode exists and is active in the database
-    user = User.query.filter_by(passcode=passcode, has_paid=True).first()
+    # Check if the passcode belongs to a paying user
+    user_id = lookup_passcode(passcode)
 
-    if user:
+    if user_id:
         # Reset the passcode attempt count
         session['passcode_attempts'] = 0
-        
-        response.say("Passcode accepted. Would you like a slow response with pauses, or a fast response?")
-        
-        # Gather the user's preference for response speed
-        gather = Gather(input="speech", speechTimeout="auto", action="/set_speed", method="POST")
-        response.append(gather)
-    else:
-        if session['passcode_attempts'] >= 2:
-            response.say("Invalid passcode. Goodbye.")
-            response.hangup()
-        else:
-            response.say("Invalid passcode. Please try again.")
-            # Redirect to the voice endpoint to ask for the passcode again
-            response.redirect("/voice")
 
-    return str(response)
+        # Ask for the user's preference for response speed
+        return PASSCODE_ACCEPTED
+    if session['passcode_attempts'] >= 2:
+        return PASSCODE_REJECTED
+    # Redirect to the voice endpoint to ask for the passcode again
+    return PASSCODE_RETRY
 
 # Endpoint to handle the user's speed preference
 @app.route("/set_speed", methods=['POST'])
@@ -202,14 +606,7 @@ def set_speed():
         session['speed_preference'] = 'fast'
 
     # Ask if the user wants to ask a general question or a multiple-choice question
-    response = VoiceResponse()
-    response.say("Thank you. Would you like to ask a general question or a multiple-choice question?")
-    
-    # Gather the user's choice
-    gather = Gather(input="speech", speechTimeout="auto", action="/choose_question_type", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return QUESTION_TYPE_PROMPT
 
 # Endpoint to choose question type (general or multiple-choice)
 @app.route("/choose_question_type", methods=['POST'])
@@ -217,16 +614,24 @@ def choose_question_type():
     question_type = request.form['SpeechResult'].lower()
     print(f"User chose question type: {question_type}")
 
-    response = VoiceResponse()
     if "multiple choice" in question_type:
-        response.say("Please state your question.")
-        gather = Gather(input="speech", speechTimeout="auto", action="/get_question", method="POST")
-    else:
-        response.say("Please state your question.")
-        gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    
-    response.append(gather)
-    return str(response)
+        return MCQ_QUESTION_PROMPT
+    return GENERAL_QUESTION_PROMPT
+
+# Endpoint to handle a question and its options spoken in one utterance
+@app.route("/get_full_mcq", methods=['POST'])
+def get_full_mcq():
+    question, options = parse_mcq(request.form['SpeechResult'])
+    print(f"Parsed MCQ: {question} {options}")
+
+    session['mcq_question'] = question
+    for letter, option in zip("abcd", options):
+        session[f'mcq_option_{letter}'] = option
+    if len(options) == 4:
+        return answer_mcq(question, options)
+
+    # Fall back to the step-by-step chain for the options the parser could not find
+    return OPTION_PROMPTS["abcd"[len(options)]]
 
 # Endpoint to handle the question entry
 @app.route("/get_question", methods=['POST'])
@@ -234,12 +639,7 @@ def get_question():
     session['mcq_question'] = request.form['SpeechResult']
     print(f"User's question: {session['mcq_question']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option A.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_a", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["a"]
 
 # Endpoint to handle option A entry
 @app.route("/get_option_a", methods=['POST'])
@@ -247,12 +647,7 @@ def get_option_a():
     session['mcq_option_a'] = request.form['SpeechResult']
     print(f"Option A: {session['mcq_option_a']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option B.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_b", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["b"]
 
 # Endpoint to handle option B entry
 @app.route("/get_option_b", methods=['POST'])
@@ -260,12 +655,7 @@ def get_option_b():
     session['mcq_option_b'] = request.form['SpeechResult']
     print(f"Option B: {session['mcq_option_b']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option C.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_c", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["c"]
 
 # Endpoint to handle option C entry
 @app.route("/get_option_c", methods=['POST'])
@@ -273,45 +663,39 @@ def get_option_c():
     session['mcq_option_c'] = request.form['SpeechResult']
     print(f"Option C: {session['mcq_option_c']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option D.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_d", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["d"]
 
 @app.route("/get_option_d", methods=['POST'])
 def get_option_d():
     session['mcq_option_d'] = request.form['SpeechResult']
     print(f"Option D: {session['mcq_option_d']}")
 
-    # Combine the question and options into a single string
-    mcq_full_question = f"Question: {session['mcq_question']}\nA. {session['mcq_option_a']}\nB. {session['mcq_option_b']}\nC. {session['mcq_option_c']}\nD. {session['mcq_option_d']}"
-    print(f"Full MCQ: {mcq_full_question}")
-
-    # Send the multiple-choice question to ChatGPT
-    chatgpt_response = chat_gpt_response_with_mcq(mcq_full_question)
-    print(f"ChatGPT response: {chatgpt_response}")
+    options = [session['mcq_option_a'], session['mcq_option_b'], session['mcq_option_c'], session['mcq_option_d']]
+    return answer_mcq(session['mcq_question'], options)
 
-    # Respond to the user with the ChatGPT answer
-    response = VoiceResponse()
-    response.say(chatgpt_response)
+def answer_mcq(question, options):
+    """Answer a complete multiple-choice question and prompt for the next one."""
+    # Reuse the answer if someone already asked this question, otherwise ask ChatGPT
+    chatgpt_response = mcq_cache.get(question, options)
+    if chatgpt_response is None:
+        # Combine the question and options into a single string
+        mcq_full_question = f"Question: {question}\nA. {options[0]}\nB. {options[1]}\nC. {options[2]}\nD. {options[3]}"
+        print(f"Full MCQ: {mcq_full_question}")
 
-    # Automatically prompt the user for the next multiple-choice question
-    response.say("Please state your next multiple-choice question.")
-    
-    # Gather the user's next multiple-choice question
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_question", method="POST")
-    response.append(gather)
+        # Send the multiple-choice question to ChatGPT
+        chatgpt_response = chat_gpt_response_with_mcq(mcq_full_question)
+        mcq_cache.set(question, options, chatgpt_response)
+    print(f"ChatGPT response: {chatgpt_response} (MCQ cache: {mcq_cache.stats()})")
 
-    return str(response)
+    # Respond with the answer and prompt for the next multiple-choice question
+    return MCQ_ANSWER.render(answer=chatgpt_response)
 
 
 
 # Function to interact with OpenAI's ChatGPT for multiple-choice questions
 def chat_gpt_response_with_mcq(question_and_options):
     prompt = f"This is a multiple-choice question. Please choose the correct answer.\n\n{question_and_options}\n\nAnswer:"
-    response = openai.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are an expert at answering multiple-choice questions."},
@@ -328,57 +712,122 @@ def transcribe():
     transcription_text = request.form['SpeechResult']
     print(f"User asked: {transcription_text}")
 
+    call_sid = request.form['CallSid']
+
     # Check if the user said "goodbye"
     if "goodbye" in transcription_text.lower():
-        response = VoiceResponse()
-        response.say("Goodbye!")
-        response.hangup()
-        return str(response)
-
-    # Append the user's input to the conversation history
-    conversation_history = session.get('conversation_history', [])
-    conversation_history.append({"role": "user", "content": transcription_text})
+        conversation_store.clear(call_sid)
+        history_manager.forget(call_sid)
+        pending_answers.pop(call_sid, None)
+        prefetcher.forget(call_sid)
+        end_call('stripe', call_sid)
+        return GOODBYE
+
+    # Load the recent part of this call's history (older turns are in its summary) and add the user's input
+    user_message = {"role": "user", "content": transcription_text}
+    offset, conversation_history = conversation_store.load_recent(call_sid, history_manager.load_limit)
+    conversation_history.append(user_message)
+
+    if ASYNC_ANSWERS:
+        # Start the completion in the background (unless partial speech already did) and keep the caller company meanwhile
+        future = prefetcher.claim(call_sid, transcription_text)
+        if future is None:
+            future = answer_executor.submit(answer_in_background, conversation_history, call_sid, offset)
+        else:
+            # The speculative answer is cached under the final transcript, not the partial one
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() or remember_answer(conversation_history, offset, f.result()))
+        pending_answers.set(call_sid, (future, user_message, time.monotonic()))
+        return THINKING_PROMPT
     
-    # Get the response from ChatGPT using the updated API call
-    chatgpt_response = chat_gpt_response_with_history(conversation_history)
+    # Use the answer prefetched from partial speech if it was for this question,
+    # otherwise get the response from the semantic cache or ChatGPT
+    chatgpt_response = prefetcher.result(call_sid, transcription_text, timeout=llm_client.LLM_DEADLINE)
+    if chatgpt_response is None:
+        chatgpt_response = answer_question(conversation_history, call_sid, offset)
+    else:
+        remember_answer(conversation_history, offset, chatgpt_response)
     print(f"ChatGPT response: {chatgpt_response}")
 
-    # Append ChatGPT's response to the conversation history
-    conversation_history.append({"role": "assistant", "content": chatgpt_response})
-    session['conversation_history'] = conversation_history  # Save updated conversation history
+    # Save both turns to the server-side conversation store
+    conversation_store.append(call_sid, user_message, {"role": "assistant", "content": chatgpt_response})
+
+    return answer_response(chatgpt_response)
+
+# Endpoint Twilio posts partial speech results to while the caller is still talking
+@app.route("/partial_speech", methods=['POST'])
+def partial_speech():
+    observe_partial(prefetcher, request.form)
+    return "", 204
+
+# Endpoint Twilio polls while an async answer is being generated
+@app.route("/answer_status", methods=['POST'])
+def answer_status():
+    call_sid = request.form['CallSid']
+    pending = pending_answers.get(call_sid)
+
+    if pending is None:
+        return LOST_QUESTION_PROMPT
+
+    future, user_message, submitted = pending
+    if not future.done():
+        if time.monotonic() - submitted < ANSWER_TIMEOUT:
+            # Still working: wait a moment and poll again
+            return POLL_AGAIN
+        future.cancel()
+        pending_answers.pop(call_sid, None)
+        return ANSWER_TIMEOUT_PROMPT
+
+    pending_answers.pop(call_sid, None)
+    try:
+        chatgpt_response = future.result()
+    except Exception as e:
+        print(f"Error generating answer: {e}")
+        return ANSWER_FAILED_PROMPT
+    print(f"ChatGPT response: {chatgpt_response}")
 
-    # Respond to the user based on their speed preference
-    response = VoiceResponse()
-    if session.get('speed_preference') == 'slow':
-        speak_with_pauses(response, chatgpt_response)
-    else:
-        response.say(chatgpt_response)
+    # Save both turns to the server-side conversation store
+    conversation_store.append(call_sid, user_message, {"role": "assistant", "content": chatgpt_response})
 
-    # Continue the conversation by using <Gather> again
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    response.append(gather)
+    return answer_response(chatgpt_response)
 
-    return str(response)
+def answer_response(chatgpt_response):
+    """Speak an answer according to the caller's speed preference and listen for the next question."""
+    if session.get('speed_preference') == 'slow':
+        return SLOW_ANSWER_PROMPT.render(twiml=render_slow_speech(chatgpt_response))
+    return ANSWER_PROMPT.render(text=chatgpt_response)
+
+# Function to answer the latest question, from the semantic cache when it has no earlier context.
+# Speculative answers to partial transcripts pass cache_answer=False so they never fill the cache.
+def answer_question(conversation_history, call_sid, offset=0, cache_answer=True):
+    question = conversation_history[-1]["content"]
+    standalone = offset == 0 and len(conversation_history) == 1
+    if standalone:
+        cached = semantic_cache.get(question)
+        if cached is not None:
+            return cached
+    chatgpt_response = chat_gpt_response_with_history(conversation_history, call_sid, offset)
+    if cache_answer:
+        remember_answer(conversation_history, offset, chatgpt_response)
+    return chatgpt_response
+
+def remember_answer(conversation_history, offset, chatgpt_response):
+    """Put the answer to a call's first question in the semantic cache; later ones depend on context."""
+    if offset == 0 and len(conversation_history) == 1:
+        semantic_cache.set(conversation_history[-1]["content"], chatgpt_response)
 
 # Function to interact with OpenAI's ChatGPT with conversation history
-def chat_gpt_response_with_history(conversation_history):
-    response = openai.chat.completions.create(
+def chat_gpt_response_with_history(conversation_history, call_sid=None, offset=0):
+    # Send only the recent turns plus a running summary of older ones
+    messages, stats = history_manager.build_messages("You are a helpful assistant.", conversation_history,
+                                                     key=call_sid, offset=offset)
+    print(f"Prompt tokens: {stats['prompt_tokens']} (saved {stats['saved_tokens']} of {stats['full_tokens']})")
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."}
-        ] + conversation_history,
+        messages=messages,
         max_tokens=150
     )
     return response.choices[0].message.content.strip()
 
-# Function to split text into chunks of 4 words and add pauses in between
-def speak_with_pauses(response, text):
-    words = text.split()
-    for i in range(0, len(words), 4):
-        chunk = " ".join(words[i:i+4])
-        response.say(chunk)
-        if i + 4 < len(words):  # Add pause only if there are more words left
-            response.pause(length=3)
-
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080, debug=True)
@@ -0,0 +1,97 @@
+"""One process for every Twilio call flow.
+
+    python gateway.py                      # development server on port 8080
+    python serve.py gateway --workers 2    # under gunicorn, like any other app
+
+Each flow is mounted under its short name from serve.py, so the Stripe flow answers
+at /stripe/voice and the memory flow at /memory/voice. Point each Twilio number's
+voice webhook at https://<host>/<name>/voice. The flows' TwiML uses relative
+actions, so the rest of each call stays under the same prefix.
+
+A flow's module is imported the first time one of its URLs is requested. Flows
+nobody calls never load their dependencies (scikit-learn, NLTK, the Google
+clients, Stripe), and the gateway itself starts in well under a second.
+flask_stripe's database stays in flask_stripe/instance, as when it runs on
+its own, whatever the working directory.
+GATEWAY_FLOWS limits which flows are mounted. GATEWAY_PRELOAD=true imports them
+all at start up instead, so that gunicorn's preload shares them between workers.
+"""
+import importlib
+import os
+import threading
+import time
+from flask import Flask, Response, jsonify
+from call_metrics import render_metrics
+from serve import APPS
+
+# Flows to mount, by short name (default: every app in serve.py)
+GATEWAY_FLOWS = [name.strip() for name in os.getenv('GATEWAY_FLOWS', '').split(',') if name.strip()]
+GATEWAY_PRELOAD = os.getenv('GATEWAY_PRELOAD', 'false').lower() == 'true'
+
+def load_app(target):
+    """Import a 'module:app' target and return the app."""
+    module_name, _, attribute = target.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+class LazyDispatcher:
+    """WSGI app that routes /<prefix>/... to a flow's app, importing the flow on its first request."""
+
+    def __init__(self, flows, default_app):
+        self.flows = dict(flows)  # prefix -> 'module:app'
+        self.default_app = default_app
+        self._apps = {}
+        self._locks = {prefix: threading.Lock() for prefix in self.flows}
+
+    def get_app(self, prefix):
+        """Return the app mounted at prefix, importing it if this is its first use."""
+        app = self._apps.get(prefix)
+        if app is None:
+            with self._locks[prefix]:
+                app = self._apps.get(prefix)
+                if app is None:
+                    started = time.perf_counter()
+                    app = self._apps[prefix] = load_app(self.flows[prefix])
+                    print(f"Loaded the {prefix} flow in {time.perf_counter() - started:.2f}s")
+        return app
+
+    def loaded(self):
+        """The flow apps imported so far, by prefix."""
+        return dict(self._apps)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        prefix, slash, rest = path.lstrip('/').partition('/')
+        if prefix not in self.flows:
+            return self.default_app(environ, start_response)
+        app = self.get_app(prefix)
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + prefix
+        environ['PATH_INFO'] = slash + rest
+        return app(environ, start_response)
+
+
+FLOWS = {name: target for name, target in APPS.items()
+         if name != 'gateway' and (not GATEWAY_FLOWS or name in GATEWAY_FLOWS)}
+
+# Requests outside every prefix: the list of flows and the metrics of the whole process
+index = Flask(__name__)
+
+@index.route('/')
+def flows():
+    loaded = application.loaded()
+    return jsonify({name: {'voice_url': f"/{name}/voice", 'loaded': name in loaded} for name in FLOWS})
+
+@index.route('/metrics')
+def metrics():
+    # Metrics are process-wide, so this is the same as any flow's /<name>/metrics
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+application = LazyDispatcher(FLOWS, index)
+
+if GATEWAY_PRELOAD:
+    for name in FLOWS:
+        application.get_app(name)
+
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+    run_simple('0.0.0.0', int(os.getenv('PORT', '8080')), application, threaded=True)
@@ -0,0 +1,46 @@
+import os
+
+# Production settings for serving the voice apps with gunicorn. serve.py uses this
+# file; every value can also be overridden with the usual gunicorn flags.
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '8080')}")
+
+# Webhooks spend most of their time waiting on OpenAI and Google, so use threaded
+# workers with several request threads in each. One process by default: Twilio sends
+# each webhook of a call to whichever worker is free, and some call state (the memory
+# conversation store, ASYNC_ANSWERS' pending answers, speculative prefetches) lives
+# in the process. With more workers the conversation store defaults to SQLite, which
+# they all share; leave ASYNC_ANSWERS and SPECULATIVE_PREFETCH off in that case.
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+threads = int(os.getenv('WEB_THREADS', '8'))
+if workers > 1:
+    # Read by the apps when they are imported, which happens after this file runs
+    os.environ.setdefault('CONVERSATION_STORE', 'sqlite')
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() == 'true'
+
+# Twilio gives up on a webhook after 15 seconds
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# Recycle workers now and then to cap slow memory growth
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '5000'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '500'))
+
+pidfile = os.getenv('GUNICORN_PIDFILE', 'gunicorn.pid')
+accesslog = '-'
+
+def post_fork(server, worker):
+    # Database connections opened in the master while preloading must not be shared
+    app = worker.app.wsgi()
+    # gateway.py serves several apps; only those it has loaded can hold connections
+    apps = app.loaded().values() if hasattr(app, 'loaded') else [app]
+    for app in apps:
+        sqlalchemy = getattr(app, 'extensions', {}).get('sqlalchemy')
+        if sqlalchemy is not None:
+            with app.app_context():
+                for engine in sqlalchemy.engines.values():
+                    engine.dispose(close=False)
@@ -0,0 +1,171 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import llm_client
+from ttl_cache import TTLCache
+
+# tiktoken gives exact counts for the OpenAI chat models; fall back to a rough
+# characters-per-token estimate when it is not installed.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encodings = {}
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """Count the tokens in a piece of text without calling the API."""
+    if tiktoken is None:
+        return max(1, len(text) // 4) if text else 0
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return len(encoding.encode(text))
+
+def count_message_tokens(messages, model="gpt-3.5-turbo"):
+    """Count the prompt tokens a list of chat messages will use, including per-message overhead."""
+    # Each message carries ~4 tokens of framing and every reply is primed with 2 more
+    return sum(4 + count_tokens(m["content"], model) for m in messages) + 2
+
+def summarize_with_openai(previous_summary, messages):
+    """Fold older conversation turns into a short running summary."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = (
+        f"Current summary of the conversation:\n{previous_summary or '(none)'}\n\n"
+        f"New conversation turns:\n{transcript}\n\n"
+        "Update the summary so it covers everything above in at most three sentences."
+    )
+    response = llm_client.chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You summarize phone conversations concisely."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=120
+    )
+    return response.choices[0].message.content.strip()
+
+
+class HistoryManager:
+    """Keeps the prompt for a conversation under a token budget.
+
+    The last `keep_turns` user/assistant turns are sent verbatim; anything older is
+    folded into a running summary that is refreshed on a background thread so the
+    caller never waits for it.
+    """
+
+    def __init__(self, budget_tokens=1200, keep_turns=4, summarize=summarize_with_openai,
+                 model="gpt-3.5-turbo", max_conversations=1000, ttl=3600, load_slack=8):
+        self.budget_tokens = budget_tokens
+        self.keep_turns = keep_turns
+        # Messages a caller needs to load per turn: the recent window plus room for
+        # turns that have left it while their summary is still being written
+        self.load_limit = keep_turns * 2 + load_slack
+        self.summarize = summarize
+        self.model = model
+        # key -> (number of history messages covered by the summary, summary text)
+        self._summaries = TTLCache(maxsize=max_conversations, ttl=ttl)
+        # key -> (number of history messages counted, their total tokens), for the savings stats
+        self._totals = TTLCache(maxsize=max_conversations, ttl=ttl)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def build_messages(self, system_prompt, history, key=None, offset=0):
+        """Return (messages, stats) for the next completion.
+
+        `key` identifies the conversation (the Twilio CallSid) so its summary can be
+        reused on later turns; without it older turns are simply dropped. `history`
+        may be just the tail of the conversation (e.g. its last `load_limit` messages),
+        with `offset` the number of messages before it.
+        """
+        system = [{"role": "system", "content": system_prompt}]
+        covered, summary = self._summaries.get(key, (0, "")) if key else (0, "")
+        summary_messages = []
+        if summary:
+            summary_messages = [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}]
+
+        # Take the most recent turns, shrinking the window until it fits the budget
+        budget = self.budget_tokens - count_message_tokens(system + summary_messages, self.model)
+        recent = history[-self.keep_turns * 2:]
+        while len(recent) > 1 and count_message_tokens(recent, self.model) > budget:
+            recent = recent[2:] if len(recent) > 2 else recent[1:]
+        older = history[:len(history) - len(recent)]
+        # Older turns the summary does not cover yet; any that are not loaded any more
+        # (the summary fell more than load_limit behind) are left out of it
+        uncovered = older[max(covered - offset, 0):]
+
+        # Older turns the summary does not cover yet are kept verbatim while they fit
+        budget -= count_message_tokens(recent, self.model)
+        gap = []
+        for message in reversed(uncovered):
+            cost = 4 + count_tokens(message["content"], self.model)
+            if cost > budget:
+                break
+            gap.insert(0, message)
+            budget -= cost
+
+        if key and uncovered:
+            self._schedule_refresh(key, offset + len(older), summary, uncovered)
+
+        messages = system + summary_messages + gap + recent
+        full_tokens = count_message_tokens(system, self.model) + self._history_tokens(history, key, offset)
+        prompt_tokens = count_message_tokens(messages, self.model)
+        stats = {
+            "full_tokens": full_tokens,
+            "prompt_tokens": prompt_tokens,
+            "saved_tokens": max(full_tokens - prompt_tokens, 0),
+        }
+        return messages, stats
+
+    def _history_tokens(self, history, key, offset):
+        # A running total per conversation, so each turn only tokenizes the messages added since the last one
+        if not key:
+            return sum(4 + count_tokens(m["content"], self.model) for m in history)
+        counted, total = self._totals.get(key, (0, 0))
+        new = history[max(counted - offset, 0):]
+        new_tokens = sum(4 + count_tokens(m["content"], self.model) for m in new)
+        if counted < offset and new:
+            # Turns this process never saw (another worker answered them) are estimated from the loaded ones
+            new_tokens += (offset - counted) * new_tokens // len(new)
+        total += new_tokens
+        self._totals.set(key, (offset + len(history), total))
+        return total
+
+    def forget(self, key):
+        """Drop the summary and token total kept for a finished conversation."""
+        self._summaries.pop(key)
+        self._totals.pop(key)
+
+    def _schedule_refresh(self, key, covered, summary, new_messages):
+        # `covered` is the number of messages the refreshed summary will cover
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            # Created lazily so forking servers do not inherit a half-initialized pool
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=int(os.getenv('SUMMARY_WORKERS', '2')))
+        self._executor.submit(self._refresh, key, covered, summary, list(new_messages))
+
+    def _refresh(self, key, covered, summary, new_messages):
+        try:
+            new_summary = self.summarize(summary, new_messages)
+            self._summaries.set(key, (covered, new_summary))
+        except Exception as e:
+            print(f"Error refreshing conversation summary: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+def create_history_manager():
+    """Build a HistoryManager configured from HISTORY_BUDGET_TOKENS and HISTORY_KEEP_TURNS."""
+    return HistoryManager(
+        budget_tokens=int(os.getenv('HISTORY_BUDGET_TOKENS', '1200')),
+        keep_turns=int(os.getenv('HISTORY_KEEP_TURNS', '4'))
+    )
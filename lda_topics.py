@@ -1,17 +1,16 @@
 # Required Libraries
 import pandas as pd
 import re
-import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from gensim import corpora
 from gensim.models import LdaModel
+from offline_assets import require_nltk, startup_step
 import pyLDAvis.gensim_models as gensimvis
 import pyLDAvis
 
-# Ensure necessary NLTK downloads
-nltk.download('punkt')
-nltk.download('stopwords')
+# Load the tokenizer and stopwords from the bundled assets (python offline_assets.py prepare)
+require_nltk('punkt', 'stopwords')
 
 # Predefined dataset for LDA (Technology, Movies, Music topics)
 data = {'text': [
@@ -103,7 +102,8 @@ dictionary = corpora.Dictionary(df['cleaned_text'])
 corpus = [dictionary.doc2bow(text) for text in df['cleaned_text']]
 
 # Apply Latent Dirichlet Allocation (LDA)
-lda_model = LdaModel(corpus=corpus, id2word=dictionary, num_topics=3, passes=10, random_state=100)
+with startup_step('LDA model'):
+    lda_model = LdaModel(corpus=corpus, id2word=dictionary, num_topics=3, passes=10, random_state=100)
 
 # Print out the topics
 topics = lda_model.print_topics(num_words=4)
@@ -0,0 +1,214 @@
+import os
+import random
+import threading
+import time
+import httpx
+import openai
+from dotenv import load_dotenv
+import call_metrics
+import token_accounting
+from cassette import httpx_transport, REPLAYING
+from singleflight import SingleFlight, fingerprint
+from rate_limiter import create_rate_limiter, resolve_priority, estimate_tokens, RateLimitTimeoutError
+
+# Load environment variables from .env file before reading the settings below
+load_dotenv()
+
+# Shared OpenAI client for every app. One keep-alive connection pool per process,
+# a deadline on every call, jittered retries for transient failures, a cap on
+# concurrent requests and a circuit breaker so a struggling upstream fails fast
+# instead of tying up every Flask worker. With LLM_RATE_LIMITER set, requests also
+# wait for the requests/tokens-per-minute budget shared by all workers (see
+# rate_limiter.py); the priority argument or rate_limiter.priority() sets their place.
+# Every completion's tokens are accounted to its route and calling function (see
+# token_accounting.py).
+
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '10'))            # seconds per attempt
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '20'))          # seconds per call, retries included
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', '30'))
+# Identical requests made at the same time share one completion (see singleflight.py)
+LLM_COALESCE = os.getenv('LLM_COALESCE', 'true').lower() == 'true'
+
+# Errors worth retrying; anything else (bad request, auth) is raised immediately
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+class LLMUnavailableError(Exception):
+    """Raised when a completion cannot be attempted or did not finish before its deadline."""
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single trial call through once reset_after has passed."""
+
+    def __init__(self, failure_threshold=5, reset_after=30):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after or self._trial_in_flight:
+                return False
+            # Half-open: let one request test the upstream
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+
+breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+rate_limiter = create_rate_limiter()
+_in_flight = SingleFlight('openai')
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _client
+    # Built lazily so preforking servers give each worker its own connection pool
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                limits = httpx.Limits(
+                    max_connections=LLM_MAX_CONCURRENCY,
+                    max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                    keepalive_expiry=60
+                )
+                http_client = httpx.Client(
+                    # A plain HTTP transport unless CASSETTE_MODE records or replays (see cassette.py)
+                    transport=httpx_transport(limits=limits),
+                    timeout=LLM_TIMEOUT
+                )
+                _client = openai.OpenAI(
+                    # Replayed requests never reach OpenAI, so no real key is needed
+                    api_key=os.getenv('OPENAI_API_KEY') or ('replay' if REPLAYING else None),
+                    http_client=http_client,
+                    max_retries=0,  # retries are handled below
+                    timeout=LLM_TIMEOUT
+                )
+    return _client
+
+def chat_completion(deadline=None, priority=None, **kwargs):
+    """Call chat.completions.create with a deadline, retries, a concurrency limit and a circuit breaker.
+
+    Accepts the same keyword arguments as openai.chat.completions.create and returns
+    its response. `deadline` is the total number of seconds the call may take and
+    `priority` ('live', 'background' or 'batch') its place in the shared rate limit.
+    """
+    model = kwargs.get('model', '')
+    caller = token_accounting.caller_name()
+    try:
+        # Timed as the "llm" stage of the current webhook, retries and queueing included
+        with call_metrics.stage('llm'):
+            if LLM_COALESCE:
+                response, shared = _in_flight.do(
+                    fingerprint(kwargs), _chat_completion, deadline, resolve_priority(priority), **kwargs)
+            else:
+                response, shared = _chat_completion(deadline, resolve_priority(priority), **kwargs), False
+    except Exception:
+        call_metrics.llm_requests.inc(model=model, outcome="error")
+        raise
+    if shared:
+        # The tokens were counted for the request that actually went out
+        call_metrics.llm_requests.inc(model=model, outcome="coalesced")
+        return response
+    call_metrics.llm_requests.inc(model=model, outcome="ok")
+    usage = getattr(response, 'usage', None)
+    call_metrics.record_llm_usage(model, usage)
+    # Per route and calling function, for `python token_accounting.py report`
+    token_accounting.record(model, caller, usage=usage, messages=kwargs.get('messages'),
+                            completion=_completion_text(response))
+    return response
+
+def _completion_text(response):
+    choices = getattr(response, 'choices', None) or []
+    return "".join((getattr(c.message, 'content', None) or "") for c in choices)
+
+def _refund_unsent(estimate):
+    # The request was admitted by the rate limiter but never sent, so its tokens go back
+    if rate_limiter is not None:
+        rate_limiter.refund(estimate)
+
+def _chat_completion(deadline, priority, **kwargs):
+    deadline_at = time.monotonic() + (LLM_DEADLINE if deadline is None else deadline)
+    client = get_client()
+    estimate = estimate_tokens(kwargs.get('messages'), kwargs.get('max_tokens'))
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            try:
+                rate_limiter.acquire(estimate, priority, timeout=max(0.0, deadline_at - time.monotonic()))
+            except RateLimitTimeoutError as e:
+                raise LLMUnavailableError(str(e)) from e
+
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0 or not _slots.acquire(timeout=remaining):
+            _refund_unsent(estimate)
+            raise LLMUnavailableError("Timed out waiting for a free OpenAI request slot")
+        # Checked only once nothing is left to wait for (rate limit and slot), so a half-open
+        # trial is never held by a caller that then gives up before reaching the upstream
+        if not breaker.allow():
+            _slots.release()
+            _refund_unsent(estimate)
+            raise LLMUnavailableError("OpenAI circuit breaker is open")
+        try:
+            remaining = deadline_at - time.monotonic()
+            response = client.chat.completions.create(timeout=max(min(LLM_TIMEOUT, remaining), 0.1), **kwargs)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            if rate_limiter is not None and isinstance(e, openai.RateLimitError):
+                # Our budget was too generous; make every worker wait for the buckets to refill
+                rate_limiter.drain()
+            error = e
+        except openai.APIStatusError:
+            # The upstream answered, so it is healthy even though the request was rejected
+            breaker.record_success()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+            usage = getattr(response, 'usage', None)
+            if rate_limiter is not None and usage is not None:
+                rate_limiter.refund(estimate - (getattr(usage, 'total_tokens', 0) or 0))
+            return response
+        finally:
+            _slots.release()
+
+        # Full-jitter exponential backoff, never sleeping past the deadline
+        attempt += 1
+        remaining = deadline_at - time.monotonic()
+        if attempt > LLM_MAX_RETRIES or remaining <= 0:
+            raise LLMUnavailableError(f"OpenAI request failed after {attempt} attempt(s): {error}") from error
+        backoff = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+        print(f"OpenAI request failed ({error}); retrying in {backoff:.2f}s")
+        time.sleep(min(backoff, remaining))
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from ttl_cache import TTLCache
+
+# Cache of answers to multiple-choice questions. Whole classes call in with the same
+# quiz, so the key ignores case, spacing, punctuation and the order of the options.
+
+LETTERS = "ABCD"
+
+# Places where an answer refers to an option by its letter, as one alternation so that
+# each letter is rewritten exactly once: "B. Paris", "(C)", "option B", "The answer is: B",
+# "the correct option is B", "B is correct". Each alternative captures the letter in
+# its own group; the text around it is matched by lookarounds or kept as a prefix group.
+LETTER_REFERENCE = re.compile(
+    r"^(?P<line>[A-D])(?=[.):]|\s+(?i:is|would be)\b)"
+    r"|(?<=\()(?P<paren>[A-D])(?=\))"
+    r"|(?P<named_prefix>\b(?i:option|choice|answer|letter)(?:\s+(?i:is|would be))?:?\s*)(?P<named>[A-D])\b"
+    r"|(?P<is_prefix>\b(?i:is|be)\s+)(?P<is>[A-D])\b(?=\s*(?:[.,;:!)]|$))"
+    r"|\b(?P<claim>[A-D])(?=\s+(?i:is)\s+(?i:correct|right|the\s+(?:correct|right|best)))",
+    re.MULTILINE
+)
+# Any capital A-D standing alone, except the article "A" in front of a word
+ANY_LETTER = re.compile(r"\b[A-D]\b(?!\s+[a-z])|\b[B-D]\b")
+
+def normalize_text(text):
+    """Lowercase text and drop punctuation and repeated whitespace."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+def mcq_key(question, options):
+    """Fingerprint a question and its options independently of option order."""
+    payload = json.dumps([normalize_text(question), sorted(normalize_text(o) for o in options)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def remap_letters(answer, cached_options, options):
+    """Rewrite option letters in a cached answer to match the caller's option order.
+
+    Returns None when the answer mentions a letter in a way it cannot safely rewrite,
+    so the caller asks again instead of hearing the wrong letter.
+    """
+    cached = [normalize_text(o) for o in cached_options]
+    current = [normalize_text(o) for o in options]
+    if cached == current:
+        return answer
+    mapping = {}
+    for i, option in enumerate(cached):
+        if option in current:
+            mapping[LETTERS[i]] = LETTERS[current.index(option)]
+
+    if len(ANY_LETTER.findall(answer)) > len(LETTER_REFERENCE.findall(answer)):
+        return None
+
+    def rewrite(match):
+        groups = match.groupdict()
+        name = next(name for name in ('line', 'paren', 'named', 'is', 'claim') if groups[name])
+        return (groups.get(f"{name}_prefix") or "") + mapping.get(groups[name], groups[name])
+
+    return LETTER_REFERENCE.sub(rewrite, answer)
+
+
+class MCQCache:
+    """Two-tier answer cache: an in-memory LRU in front of an optional shared SQLite file."""
+
+    def __init__(self, maxsize=5000, ttl=86400, db_path=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.db_path = db_path
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "sqlite_hits": 0, "misses": 0}
+        if db_path:
+            self._connection().execute('''
+                CREATE TABLE IF NOT EXISTS mcq_answers (
+                    key TEXT PRIMARY KEY,
+                    options TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a fork must not be used by the child process
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, question, options):
+        """Return the cached answer for this question, or None."""
+        key = mcq_key(question, options)
+        entry = self._memory.get(key)
+        answer = None if entry is None else remap_letters(entry[1], entry[0], options)
+        if answer is not None:
+            self._count("memory_hits")
+            return answer
+
+        # An entry whose letters could not be remapped is a miss; the shared tier has the same answer
+        if self.db_path and entry is None:
+            row = self._connection().execute(
+                'SELECT options, answer, created_at FROM mcq_answers WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and row[2] >= time.time() - self.ttl:
+                cached_options = json.loads(row[0])
+                self._memory.set(key, (cached_options, row[1]))
+                answer = remap_letters(row[1], cached_options, options)
+                if answer is not None:
+                    self._count("sqlite_hits")
+                    return answer
+
+        self._count("misses")
+        return None
+
+    def set(self, question, options, answer):
+        """Remember the answer given for this question and option order."""
+        key = mcq_key(question, options)
+        self._memory.set(key, (list(options), answer))
+        if self.db_path:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO mcq_answers (key, options, answer, created_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(list(options)), answer, time.time())
+            )
+            # Keep the shared table bounded: drop expired rows, then the oldest extras
+            conn.execute('DELETE FROM mcq_answers WHERE created_at < ?', (time.time() - self.ttl,))
+            conn.execute(
+                'DELETE FROM mcq_answers WHERE key IN '
+                '(SELECT key FROM mcq_answers ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.maxsize * 10,)
+            )
+
+    def stats(self):
+        """Return the hit and miss counters along with the overall hit rate."""
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["sqlite_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+
+def create_mcq_cache():
+    """Build the MCQ cache; set MCQ_CACHE_DB to share answers between apps and workers."""
+    return MCQCache(
+        maxsize=int(os.getenv('MCQ_CACHE_SIZE', '5000')),
+        ttl=int(os.getenv('MCQ_CACHE_TTL', '86400')),
+        db_path=os.getenv('MCQ_CACHE_DB') or None
+    )
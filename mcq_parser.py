@@ -0,0 +1,76 @@
+import os
+import re
+
+# Lets a caller speak a multiple-choice question and all four options in one turn:
+# "What is the capital of France? Option A Berlin, option B Paris, option C Rome,
+# option D Madrid." Each step of the one-option-at-a-time chain is a full Twilio
+# round trip with speech endpointing, so one utterance saves four of them.
+
+# Set MCQ_SINGLE_UTTERANCE=false to go back to asking for each option separately
+MCQ_SINGLE_UTTERANCE = os.getenv('MCQ_SINGLE_UTTERANCE', 'true').lower() == 'true'
+# Seconds of silence that end the utterance; "auto" tends to cut callers off between options
+MCQ_SPEECH_TIMEOUT = os.getenv('MCQ_SPEECH_TIMEOUT', '3')
+
+MCQ_PROMPT = "Say the question, then each answer starting with option A, option B, option C and option D."
+# Passed to Twilio as speech recognition hints
+MCQ_HINTS = "option A, option B, option C, option D"
+
+LETTERS = "abcd"
+
+# How speech recognition tends to write each option letter
+LETTER_WORDS = {
+    'a': r"a|ay|eh",
+    'b': r"b|be|bee",
+    'c': r"c|see|sea|cee",
+    'd': r"d|dee",
+}
+MARKERS = {
+    letter: re.compile(rf"\b(?:option|choice)\s+(?:{words})\b[\s.,:;)-]*", re.IGNORECASE)
+    for letter, words in LETTER_WORDS.items()
+}
+# Any marker, including a misheard letter ("option V"), so an option never runs on into the next one
+ANY_MARKER = re.compile(
+    rf"\b(?:option|choice)\s+([a-z]|{'|'.join(LETTER_WORDS.values())})\b[\s.,:;)-]*", re.IGNORECASE)
+WORD_LETTERS = {word: letter for letter, words in LETTER_WORDS.items() for word in words.split('|')}
+
+def clean_part(text):
+    """Strip separators and a dangling "and"/"or" from a piece of the utterance."""
+    text = text.strip(" \t.,:;-")
+    text = re.sub(r"\s+(?:and|or)$", "", text, flags=re.IGNORECASE)
+    return text.strip(" \t.,:;-")
+
+def parse_mcq(utterance):
+    """Split an utterance into (question, options) on "option A/B/C/D" markers.
+
+    Options are returned in order up to the first one that could not be found, so
+    a partial parse still saves the round trips for the options that were heard.
+    Each option ends at the next marker of any letter; when that marker is not the
+    expected letter (misheard or out of order), parsing stops there and the caller
+    is asked for the remaining options one at a time. Without an "option A" marker
+    the whole utterance is treated as the question.
+    """
+    utterance = utterance.strip()
+    first = MARKERS['a'].search(utterance)
+    question = clean_part(utterance[:first.start()]) if first else ""
+    if not question:
+        return utterance, []
+
+    options = []
+    position = first.end()
+    for letter in LETTERS[1:]:
+        marker = ANY_MARKER.search(utterance, position)
+        if marker is None:
+            # The next marker was not heard, so everything after the last one is a single option
+            break
+        option = clean_part(utterance[position:marker.start()])
+        if not option:
+            return question, options
+        options.append(option)
+        if WORD_LETTERS.get(marker.group(1).lower()) != letter:
+            return question, options
+        position = marker.end()
+
+    option = clean_part(utterance[position:])
+    if option:
+        options.append(option)
+    return question, options
@@ -1,33 +1,37 @@
 from flask import Flask, request, session
-from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
-import openai
-import os
+import llm_client
+from call_metrics import instrument, end_call
+from secret_key import load_secret_key
+from history_window import create_history_manager
+from semantic_cache import create_semantic_cache
+from twiml_cache import speech_prompt, compile_twiml, say_then_prompt, GOODBYE
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secret key for session management
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'memory')  # Per-stage webhook timings, served at /metrics
 
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Keeps prompts under a token budget by summarizing older turns
+history_manager = create_history_manager()
+
+# Answers to opening questions, matched by similarity rather than exact wording
+semantic_cache = create_semantic_cache()
+
+# Replies serialized once at import; answers are rendered into a template (see twiml_cache.py)
+GREETING_PROMPT = compile_twiml(speech_prompt(
+    "Hello! I'm a chatbot powered by ChatGPT. What would you like to talk about today?", "transcribe"))
+ANSWER_PROMPT = say_then_prompt("transcribe")
 
 # Endpoint to handle incoming voice calls
 @app.route("/voice", methods=['POST'])
 def voice():
-    response = VoiceResponse()
-
     # Initialize conversation history in the session
     if 'conversation_history' not in session:
         session['conversation_history'] = []
 
     # Greet the user and ask them to say something
-    response.say("Hello! I'm a chatbot powered by ChatGPT. What would you like to talk about today?")
-
-    # Use Twilio's <Gather> to capture speech input from the user
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return GREETING_PROMPT
 
 # Endpoint to handle the transcribed speech
 @app.route("/transcribe", methods=['POST'])
@@ -38,17 +42,22 @@ def transcribe():
 
     # Check if the user said "goodbye"
     if "goodbye" in transcription_text.lower():
-        response = VoiceResponse()
-        response.say("Goodbye!")
-        response.hangup()
-        return str(response)
+        history_manager.forget(request.form.get('CallSid'))
+        end_call('memory', request.form.get('CallSid'))
+        return GOODBYE
 
     # Append the user's input to the conversation history
     conversation_history = session.get('conversation_history', [])
     conversation_history.append({"role": "user", "content": transcription_text})
     
-    # Get the response from ChatGPT using the updated API call
-    chatgpt_response = chat_gpt_response_with_history(conversation_history)
+    # A question with no earlier context can be answered from the semantic cache
+    standalone = len(conversation_history) == 1
+    chatgpt_response = semantic_cache.get(transcription_text) if standalone else None
+    if chatgpt_response is None:
+        # Get the response from ChatGPT using the updated API call
+        chatgpt_response = chat_gpt_response_with_history(conversation_history, request.form.get('CallSid'))
+        if standalone:
+            semantic_cache.set(transcription_text, chatgpt_response)
     print(f"ChatGPT response: {chatgpt_response}")
 
     # Append ChatGPT's response to the conversation history
@@ -56,22 +65,16 @@ def transcribe():
     session['conversation_history'] = conversation_history  # Save updated conversation history
 
     # Respond to the user with the generated text from ChatGPT
-    response = VoiceResponse()
-    response.say(chatgpt_response)
-
-    # Continue the conversation by using <Gather> again
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return ANSWER_PROMPT.render(text=chatgpt_response)
 
 # Function to interact with OpenAI's ChatGPT with conversation history
-def chat_gpt_response_with_history(conversation_history):
-    response = openai.chat.completions.create(
+def chat_gpt_response_with_history(conversation_history, call_sid=None):
+    # Send only the recent turns plus a running summary of older ones
+    messages, stats = history_manager.build_messages("You are a helpful assistant.", conversation_history, key=call_sid)
+    print(f"Prompt tokens: {stats['prompt_tokens']} (saved {stats['saved_tokens']} of {stats['full_tokens']})")
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."}
-        ] + conversation_history,
+        messages=messages,
         max_tokens=150
     )
     return response.choices[0].message.content.strip()
@@ -0,0 +1,125 @@
+"""NLTK corpora and model weights bundled on disk, so scripts start without the network.
+
+    python offline_assets.py prepare              # download everything into ASSET_DIR
+    python offline_assets.py prepare --no-models  # NLTK data only (no transformers needed)
+    python offline_assets.py check                # report what is missing
+
+Run prepare once at build or deploy time. At runtime the scripts load from
+ASSET_DIR with require_nltk() and load_summarizer(), which never download. A
+missing asset raises MissingAssetError that names the prepare command.
+"""
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_DIR = os.getenv('ASSET_DIR', os.path.join(REPO_ROOT, 'assets'))
+NLTK_DATA_DIR = os.path.join(ASSET_DIR, 'nltk_data')
+MODEL_DIR = os.path.join(ASSET_DIR, 'models')
+
+# NLTK resources the scripts use, by download name -> path nltk.data.find() looks for.
+# Newer NLTK releases tokenize with punkt_tab, older ones with punkt, so bundle both.
+NLTK_RESOURCES = {
+    'vader_lexicon': 'sentiment/vader_lexicon.zip',
+    'punkt': 'tokenizers/punkt',
+    'punkt_tab': 'tokenizers/punkt_tab',
+    'stopwords': 'corpora/stopwords',
+}
+# pipeline("summarization") picks this model when none is given
+SUMMARIZATION_MODEL = os.getenv('SUMMARIZATION_MODEL', 'sshleifer/distilbart-cnn-12-6')
+
+# Set by benchmarks/startup_profile.py: print how long each startup_step takes
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE', 'false').lower() == 'true'
+
+class MissingAssetError(Exception):
+    """Raised when a bundled asset is not in ASSET_DIR."""
+
+
+@contextmanager
+def startup_step(name):
+    """Time an initialization step for the startup profiler, e.g. startup_step('summarizer')."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if STARTUP_PROFILE:
+            print(f"startup step: {time.perf_counter() - started:.6f} {name}", file=sys.stderr)
+
+def require_nltk(*names):
+    """Point NLTK at the bundled data and check the named resources are there, without downloading."""
+    import nltk
+
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    for name in names:
+        resources = [NLTK_RESOURCES[name]]
+        if name == 'punkt':
+            resources.append(NLTK_RESOURCES['punkt_tab'])
+        for resource in resources:
+            try:
+                nltk.data.find(resource)
+                break
+            except LookupError:
+                continue
+        else:
+            raise MissingAssetError(
+                f"NLTK resource '{name}' is not in {NLTK_DATA_DIR}; run `python offline_assets.py prepare`")
+
+def model_path(name):
+    """Directory a Hugging Face model is bundled in."""
+    return os.path.join(MODEL_DIR, name.replace('/', '--'))
+
+def load_summarizer(model=None):
+    """Build the summarization pipeline from the bundled weights, with the Hugging Face Hub switched off."""
+    path = model_path(model or SUMMARIZATION_MODEL)
+    if not os.path.isdir(path):
+        raise MissingAssetError(f"{model or SUMMARIZATION_MODEL} is not in {MODEL_DIR}; "
+                                f"run `python offline_assets.py prepare`")
+    os.environ['HF_HUB_OFFLINE'] = '1'
+    os.environ['TRANSFORMERS_OFFLINE'] = '1'
+    from transformers import pipeline
+
+    return pipeline("summarization", model=path, tokenizer=path)
+
+def missing_assets(models=True):
+    """Names of the assets that are not bundled yet."""
+    missing = []
+    for name, resource in NLTK_RESOURCES.items():
+        path = os.path.join(NLTK_DATA_DIR, resource)
+        if not os.path.exists(path) and not os.path.exists(path + '.zip'):
+            missing.append(name)
+    if models and not os.path.isdir(model_path(SUMMARIZATION_MODEL)):
+        missing.append(SUMMARIZATION_MODEL)
+    return missing
+
+def prepare(models=True):
+    """Download the NLTK resources and model weights into ASSET_DIR."""
+    import nltk
+
+    os.makedirs(NLTK_DATA_DIR, exist_ok=True)
+    for name in NLTK_RESOURCES:
+        if not nltk.download(name, download_dir=NLTK_DATA_DIR, quiet=True):
+            raise RuntimeError(f"Could not download NLTK resource '{name}'")
+        print(f"NLTK {name} -> {NLTK_DATA_DIR}")
+    if models:
+        from transformers import pipeline
+
+        path = model_path(SUMMARIZATION_MODEL)
+        pipeline("summarization", model=SUMMARIZATION_MODEL).save_pretrained(path)
+        print(f"{SUMMARIZATION_MODEL} -> {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['prepare', 'check'])
+    parser.add_argument('--no-models', action='store_true', help="skip the transformers model weights")
+    args = parser.parse_args()
+
+    if args.command == 'prepare':
+        prepare(models=not args.no_models)
+    missing = missing_assets(models=not args.no_models)
+    if missing:
+        print(f"Missing from {ASSET_DIR}: {', '.join(missing)}")
+        sys.exit(1)
+    print(f"All assets are in {ASSET_DIR}")
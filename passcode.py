@@ -1,21 +1,55 @@
 from flask import Flask, request, session
-from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
-import openai
-import os
+import llm_client
+from call_metrics import instrument, end_call
+from secret_key import load_secret_key
+from history_window import create_history_manager
+from mcq_cache import create_mcq_cache
+from slow_speech import render_slow_speech
+from mcq_parser import parse_mcq, MCQ_SINGLE_UTTERANCE, MCQ_SPEECH_TIMEOUT, MCQ_PROMPT, MCQ_HINTS
+from twiml_cache import (speech_prompt, digits_prompt, redirect_response, hangup_response, compile_twiml,
+                         TwiMLTemplate, say_then_prompt, twiml_then_prompt, slot, GOODBYE)
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secret key for session management
-
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'passcode')  # Per-stage webhook timings, served at /metrics
+
+# Keeps prompts under a token budget by summarizing older turns
+history_manager = create_history_manager()
+
+# Answers to multiple-choice questions, shared between callers
+mcq_cache = create_mcq_cache()
+
+def mcq_prompt(*texts):
+    """Prompt for a multiple-choice question, in one utterance when MCQ_SINGLE_UTTERANCE is on."""
+    if MCQ_SINGLE_UTTERANCE:
+        texts = texts[:-1] + (f"{texts[-1]} {MCQ_PROMPT}",)
+        return speech_prompt(texts, "get_full_mcq", speechTimeout=MCQ_SPEECH_TIMEOUT, hints=MCQ_HINTS)
+    return speech_prompt(texts, "get_question")
+
+# Replies that never change are serialized once, at import (see twiml_cache.py)
+PASSCODE_PROMPT = compile_twiml(digits_prompt("Hello Jesse, please enter your passcode.", "check_passcode", 4))
+PASSCODE_ACCEPTED = compile_twiml(speech_prompt(
+    "Passcode accepted. Would you like a slow response with pauses, or a fast response?", "set_speed"))
+PASSCODE_REJECTED = compile_twiml(hangup_response("Invalid passcode. Goodbye."))
+PASSCODE_RETRY = compile_twiml(redirect_response("voice", text="Invalid passcode. Please try again."))
+QUESTION_TYPE_PROMPT = compile_twiml(speech_prompt(
+    "Thank you. Would you like to ask a general question or a multiple-choice question?", "choose_question_type"))
+GENERAL_QUESTION_PROMPT = compile_twiml(speech_prompt("Please state your question.", "transcribe"))
+MCQ_QUESTION_PROMPT = compile_twiml(mcq_prompt("Please state your question."))
+OPTION_PROMPTS = {
+    letter: compile_twiml(speech_prompt(f"Thank you. Please state option {letter.upper()}.", f"get_option_{letter}"))
+    for letter in "abcd"
+}
+# Replies that only differ in the answer are rendered from templates
+MCQ_ANSWER = TwiMLTemplate(mcq_prompt(slot('answer'), "Please state your next multiple-choice question."))
+ANSWER_PROMPT = say_then_prompt("transcribe")
+SLOW_ANSWER_PROMPT = twiml_then_prompt("transcribe")
 
 # Endpoint to handle incoming voice calls
 @app.route("/voice", methods=['POST'])
 def voice():
-    response = VoiceResponse()
-
     # Initialize conversation history, speed preference, and attempt count in the session
     if 'conversation_history' not in session:
         session['conversation_history'] = []
@@ -25,13 +59,7 @@ def voice():
         session['passcode_attempts'] = 0
 
     # Ask the user to enter a passcode
-    response.say("Hello Jesse, please enter your passcode.")
-    
-    # Gather the passcode input from the user
-    gather = Gather(input="dtmf", num_digits=4, action="/check_passcode", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return PASSCODE_PROMPT
 
 # Endpoint to check the passcode
 @app.route("/check_passcode", methods=['POST'])
@@ -39,28 +67,18 @@ def check_passcode():
     passcode = request.form['Digits']
     print(f"User entered passcode: {passcode}")
 
-    response = VoiceResponse()
     session['passcode_attempts'] += 1
 
     if passcode == "1337":
         # Reset the passcode attempt count
         session['passcode_attempts'] = 0
-        
-        response.say("Passcode accepted. Would you like a slow response with pauses, or a fast response?")
-        
-        # Gather the user's preference for response speed
-        gather = Gather(input="speech", speechTimeout="auto", action="/set_speed", method="POST")
-        response.append(gather)
-    else:
-        if session['passcode_attempts'] >= 2:
-            response.say("Invalid passcode. Goodbye.")
-            response.hangup()
-        else:
-            response.say("Invalid passcode. Please try again.")
-            # Redirect to the voice endpoint to ask for the passcode again
-            response.redirect("/voice")
 
-    return str(response)
+        # Ask for the user's preference for response speed
+        return PASSCODE_ACCEPTED
+    if session['passcode_attempts'] >= 2:
+        return PASSCODE_REJECTED
+    # Redirect to the voice endpoint to ask for the passcode again
+    return PASSCODE_RETRY
 
 # Endpoint to handle the user's speed preference
 @app.route("/set_speed", methods=['POST'])
@@ -76,14 +94,7 @@ def set_speed():
         session['speed_preference'] = 'fast'
 
     # Ask if the user wants to ask a general question or a multiple-choice question
-    response = VoiceResponse()
-    response.say("Thank you. Would you like to ask a general question or a multiple-choice question?")
-    
-    # Gather the user's choice
-    gather = Gather(input="speech", speechTimeout="auto", action="/choose_question_type", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return QUESTION_TYPE_PROMPT
 
 # Endpoint to choose question type (general or multiple-choice)
 @app.route("/choose_question_type", methods=['POST'])
@@ -91,16 +102,24 @@ def choose_question_type():
     question_type = request.form['SpeechResult'].lower()
     print(f"User chose question type: {question_type}")
 
-    response = VoiceResponse()
     if "multiple choice" in question_type:
-        response.say("Please state your question.")
-        gather = Gather(input="speech", speechTimeout="auto", action="/get_question", method="POST")
-    else:
-        response.say("Please state your question.")
-        gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    
-    response.append(gather)
-    return str(response)
+        return MCQ_QUESTION_PROMPT
+    return GENERAL_QUESTION_PROMPT
+
+# Endpoint to handle a question and its options spoken in one utterance
+@app.route("/get_full_mcq", methods=['POST'])
+def get_full_mcq():
+    question, options = parse_mcq(request.form['SpeechResult'])
+    print(f"Parsed MCQ: {question} {options}")
+
+    session['mcq_question'] = question
+    for letter, option in zip("abcd", options):
+        session[f'mcq_option_{letter}'] = option
+    if len(options) == 4:
+        return answer_mcq(question, options)
+
+    # Fall back to the step-by-step chain for the options the parser could not find
+    return OPTION_PROMPTS["abcd"[len(options)]]
 
 # Endpoint to handle the question entry
 @app.route("/get_question", methods=['POST'])
@@ -108,12 +127,7 @@ def get_question():
     session['mcq_question'] = request.form['SpeechResult']
     print(f"User's question: {session['mcq_question']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option A.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_a", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["a"]
 
 # Endpoint to handle option A entry
 @app.route("/get_option_a", methods=['POST'])
@@ -121,12 +135,7 @@ def get_option_a():
     session['mcq_option_a'] = request.form['SpeechResult']
     print(f"Option A: {session['mcq_option_a']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option B.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_b", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["b"]
 
 # Endpoint to handle option B entry
 @app.route("/get_option_b", methods=['POST'])
@@ -134,12 +143,7 @@ def get_option_b():
     session['mcq_option_b'] = request.form['SpeechResult']
     print(f"Option B: {session['mcq_option_b']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option C.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_c", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["c"]
 
 # Endpoint to handle option C entry
 @app.route("/get_option_c", methods=['POST'])
@@ -147,45 +151,39 @@ def get_option_c():
     session['mcq_option_c'] = request.form['SpeechResult']
     print(f"Option C: {session['mcq_option_c']}")
 
-    response = VoiceResponse()
-    response.say("Thank you. Please state option D.")
-    
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_option_d", method="POST")
-    response.append(gather)
-    return str(response)
+    return OPTION_PROMPTS["d"]
 
 @app.route("/get_option_d", methods=['POST'])
 def get_option_d():
     session['mcq_option_d'] = request.form['SpeechResult']
     print(f"Option D: {session['mcq_option_d']}")
 
-    # Combine the question and options into a single string
-    mcq_full_question = f"Question: {session['mcq_question']}\nA. {session['mcq_option_a']}\nB. {session['mcq_option_b']}\nC. {session['mcq_option_c']}\nD. {session['mcq_option_d']}"
-    print(f"Full MCQ: {mcq_full_question}")
-
-    # Send the multiple-choice question to ChatGPT
-    chatgpt_response = chat_gpt_response_with_mcq(mcq_full_question)
-    print(f"ChatGPT response: {chatgpt_response}")
+    options = [session['mcq_option_a'], session['mcq_option_b'], session['mcq_option_c'], session['mcq_option_d']]
+    return answer_mcq(session['mcq_question'], options)
 
-    # Respond to the user with the ChatGPT answer
-    response = VoiceResponse()
-    response.say(chatgpt_response)
+def answer_mcq(question, options):
+    """Answer a complete multiple-choice question and prompt for the next one."""
+    # Reuse the answer if someone already asked this question, otherwise ask ChatGPT
+    chatgpt_response = mcq_cache.get(question, options)
+    if chatgpt_response is None:
+        # Combine the question and options into a single string
+        mcq_full_question = f"Question: {question}\nA. {options[0]}\nB. {options[1]}\nC. {options[2]}\nD. {options[3]}"
+        print(f"Full MCQ: {mcq_full_question}")
 
-    # Automatically prompt the user for the next multiple-choice question
-    response.say("Please state your next multiple-choice question.")
-    
-    # Gather the user's next multiple-choice question
-    gather = Gather(input="speech", speechTimeout="auto", action="/get_question", method="POST")
-    response.append(gather)
+        # Send the multiple-choice question to ChatGPT
+        chatgpt_response = chat_gpt_response_with_mcq(mcq_full_question)
+        mcq_cache.set(question, options, chatgpt_response)
+    print(f"ChatGPT response: {chatgpt_response} (MCQ cache: {mcq_cache.stats()})")
 
-    return str(response)
+    # Respond with the answer and prompt for the next multiple-choice question
+    return MCQ_ANSWER.render(answer=chatgpt_response)
 
 
 
 # Function to interact with OpenAI's ChatGPT for multiple-choice questions
 def chat_gpt_response_with_mcq(question_and_options):
     prompt = f"This is a multiple-choice question. Please choose the correct answer.\n\n{question_and_options}\n\nAnswer:"
-    response = openai.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are an expert at answering multiple-choice questions."},
@@ -204,17 +202,16 @@ def transcribe():
 
     # Check if the user said "goodbye"
     if "goodbye" in transcription_text.lower():
-        response = VoiceResponse()
-        response.say("Goodbye!")
-        response.hangup()
-        return str(response)
+        history_manager.forget(request.form.get('CallSid'))
+        end_call('passcode', request.form.get('CallSid'))
+        return GOODBYE
 
     # Append the user's input to the conversation history
     conversation_history = session.get('conversation_history', [])
     conversation_history.append({"role": "user", "content": transcription_text})
     
     # Get the response from ChatGPT using the updated API call
-    chatgpt_response = chat_gpt_response_with_history(conversation_history)
+    chatgpt_response = chat_gpt_response_with_history(conversation_history, request.form.get('CallSid'))
     print(f"ChatGPT response: {chatgpt_response}")
 
     # Append ChatGPT's response to the conversation history
@@ -222,37 +219,22 @@ def transcribe():
     session['conversation_history'] = conversation_history  # Save updated conversation history
 
     # Respond to the user based on their speed preference
-    response = VoiceResponse()
+    # and continue the conversation by using <Gather> again
     if session.get('speed_preference') == 'slow':
-        speak_with_pauses(response, chatgpt_response)
-    else:
-        response.say(chatgpt_response)
-
-    # Continue the conversation by using <Gather> again
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    response.append(gather)
-
-    return str(response)
+        return SLOW_ANSWER_PROMPT.render(twiml=render_slow_speech(chatgpt_response))
+    return ANSWER_PROMPT.render(text=chatgpt_response)
 
 # Function to interact with OpenAI's ChatGPT with conversation history
-def chat_gpt_response_with_history(conversation_history):
-    response = openai.chat.completions.create(
+def chat_gpt_response_with_history(conversation_history, call_sid=None):
+    # Send only the recent turns plus a running summary of older ones
+    messages, stats = history_manager.build_messages("You are a helpful assistant.", conversation_history, key=call_sid)
+    print(f"Prompt tokens: {stats['prompt_tokens']} (saved {stats['saved_tokens']} of {stats['full_tokens']})")
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."}
-        ] + conversation_history,
+        messages=messages,
         max_tokens=150
     )
     return response.choices[0].message.content.strip()
 
-# Function to split text into chunks of 4 words and add pauses in between
-def speak_with_pauses(response, text):
-    words = text.split()
-    for i in range(0, len(words), 4):
-        chunk = " ".join(words[i:i+4])
-        response.say(chunk)
-        if i + 4 < len(words):  # Add pause only if there are more words left
-            response.pause(length=3)
-
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080, debug=True)
@@ -0,0 +1,121 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import werkzeug.security
+from werkzeug.security import generate_password_hash, check_password_hash
+from ttl_cache import TTLCache
+
+# Password hashing is deliberately slow, CPU-bound work. Running it on the request
+# thread lets a burst of logins starve the Twilio webhooks served by the same process,
+# so hashes are computed on a small process pool instead. Admission control rejects
+# work the pool cannot start soon, and each client IP gets a login rate limit.
+
+# werkzeug method string, by default pbkdf2:sha256 at werkzeug's current iteration count,
+# as accounts have always been registered. Raise the cost over time and old hashes are upgraded the next time their owner
+# logs in; a lower setting only applies to new hashes and never rewrites stronger ones
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+# 0 hashes inline on the request thread (useful as a benchmark baseline)
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', str(max(1, PASSWORD_HASH_WORKERS) * 4)))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+LOGIN_RATE_PER_MINUTE = float(os.getenv('LOGIN_RATE_PER_MINUTE', '10'))
+LOGIN_BURST = float(os.getenv('LOGIN_BURST', '5'))
+
+class PasswordPoolBusyError(Exception):
+    """Raised when too many hashes are already queued or a hash did not finish in time."""
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_admission = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+def _get_executor():
+    global _executor
+    # Created on first use so each forked server worker gets its own pool. That first use is on a
+    # request thread of a multithreaded process, and forking one can leave the children stuck on
+    # locks held by other threads, so the hashing processes start from a clean forkserver instead
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context(method))
+    return _executor
+
+def _run(fn, *args):
+    if PASSWORD_HASH_WORKERS == 0:
+        return fn(*args)
+    if not _admission.acquire(blocking=False):
+        raise PasswordPoolBusyError("Password hashing queue is full")
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _admission.release()
+        raise
+    future.add_done_callback(lambda _: _admission.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordPoolBusyError("Password hashing timed out")
+
+def hash_password(password):
+    """Hash a password with the current PASSWORD_HASH_METHOD."""
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    """Check a password against a stored hash."""
+    return _run(check_password_hash, password_hash, password)
+
+def full_method(method):
+    """A werkzeug method string with its defaults filled in, as werkzeug writes it into the hash."""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        # werkzeug's defaults: sha256 and its current iteration count
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else str(getattr(werkzeug.security, 'DEFAULT_PBKDF2_ITERATIONS', 600000))
+        args = [hash_name, iterations]
+    elif name == 'scrypt' and not args:
+        args = ['32768', '8', '1']
+    return ':'.join([name] + args)
+
+def _digest_size(name):
+    try:
+        return hashlib.new(name).digest_size
+    except ValueError:
+        return 0
+
+def needs_rehash(password_hash):
+    """Return True if the current PASSWORD_HASH_METHOD is stronger than the one a stored hash was made with."""
+    stored, *stored_args = full_method(password_hash.split('$', 1)[0]).split(':')
+    current, *current_args = full_method(PASSWORD_HASH_METHOD).split(':')
+    if stored != current:
+        # Switching between pbkdf2 and scrypt is a deliberate migration
+        return True
+    if stored == 'pbkdf2':
+        # pbkdf2:<digest>:<iterations>; a wider digest or more iterations, never fewer
+        if stored_args[0] != current_args[0]:
+            return _digest_size(current_args[0]) > _digest_size(stored_args[0])
+        return int(current_args[1]) > int(stored_args[1])
+    # scrypt:<n>:<r>:<p>; upgraded when no parameter is lower and at least one is higher
+    stored_costs, current_costs = [int(a) for a in stored_args], [int(a) for a in current_args]
+    return current_costs != stored_costs and all(c >= s for c, s in zip(current_costs, stored_costs))
+
+
+# client IP -> (tokens, last refill time)
+_login_buckets = TTLCache(maxsize=100000, ttl=600)
+_bucket_lock = threading.Lock()
+
+def allow_login_attempt(ip):
+    """Token-bucket rate limit on login and registration attempts per client IP."""
+    now = time.monotonic()
+    with _bucket_lock:
+        tokens, last = _login_buckets.get(ip, (LOGIN_BURST, now))
+        tokens = min(LOGIN_BURST, tokens + (now - last) * LOGIN_RATE_PER_MINUTE / 60)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        _login_buckets.set(ip, (tokens, now))
+    return allowed
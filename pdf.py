@@ -1,12 +1,11 @@
 import pdfplumber
-from openai import OpenAI
+import llm_client
 from reportlab.lib import utils
 import PyPDF2
 import re
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 
-client = OpenAI(api_key='YOUR_API_KEY_HERE')
 # Open the PDF file
 with pdfplumber.open('theory.pdf') as pdf:
     # Iterate over each page
@@ -39,7 +38,8 @@ pdf_file = 'theory.pdf'
 questions = extract_questions(pdf_file)
 
 def ask_openai(question):
-    response = client.chat.completions.create(model="gpt-3.5-turbo", 
+    # Batch priority: waits behind live calls for the shared rate limit, for up to ten minutes
+    response = llm_client.chat_completion(priority='batch', deadline=600, model="gpt-3.5-turbo", 
     messages=[
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": question}
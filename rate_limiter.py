@@ -0,0 +1,201 @@
+import abc
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import call_metrics
+
+# Requests-per-minute and tokens-per-minute budget for OpenAI, shared by every
+# worker process. Without it each worker fires requests on its own and a burst of
+# calls runs into the provider's rate limits, which callers hear as errors.
+#
+# Both limits are token buckets that refill continuously. A request takes one
+# request and its estimated tokens (prompt plus max_tokens); the estimate is
+# corrected by the real usage once the response arrives. Priorities keep a share
+# of each bucket in reserve: live-call answers can drain it completely, background
+# work (summaries, speculative answers) stops at RESERVES['background'] of capacity
+# and batch jobs such as pdf.py at RESERVES['batch'], so a queue of batch work never
+# delays a caller. A 429 from OpenAI empties the buckets so every worker backs off.
+
+LLM_RATE_LIMITER = os.getenv('LLM_RATE_LIMITER', 'none').lower()   # none, memory or sqlite
+LLM_RPM = float(os.getenv('LLM_RPM', '3500'))
+LLM_TPM = float(os.getenv('LLM_TPM', '90000'))
+LLM_RATE_LIMIT_DB = os.getenv('LLM_RATE_LIMIT_DB', 'rate_limits.db')
+# Completion tokens to budget for when a request does not set max_tokens
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv('LLM_DEFAULT_COMPLETION_TOKENS', '256'))
+
+# Fraction of each bucket a priority may not dip into
+RESERVES = {'live': 0.0, 'background': 0.2, 'batch': 0.5}
+
+rate_limit_waits = call_metrics.register(call_metrics.Histogram(
+    'llm_rate_limit_wait_seconds', "Time requests waited for the OpenAI rate limit.", ('priority',)))
+
+class RateLimitTimeoutError(Exception):
+    """Raised when the rate limit would not admit a request before its timeout."""
+
+
+_context = threading.local()
+
+@contextmanager
+def priority(name):
+    """Run the block's completions at a priority, e.g. priority('live') on a worker thread."""
+    previous = getattr(_context, 'priority', None)
+    _context.priority = name
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+def resolve_priority(explicit=None):
+    """The priority of a completion: explicit, else the enclosing priority(), else live inside a webhook."""
+    name = explicit or getattr(_context, 'priority', None)
+    if name is None:
+        name = 'live' if call_metrics.in_webhook() else 'background'
+    if name not in RESERVES:
+        raise ValueError(f"Unknown priority: {name}")
+    return name
+
+def estimate_tokens(messages, max_tokens=None):
+    """Rough token cost of a chat completion as the rate limit counts it: prompt plus max_tokens."""
+    prompt = sum(4 + len(str(m.get("content") or "")) // 4 for m in messages or []) + 2
+    return prompt + (max_tokens or LLM_DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucketLimiter(abc.ABC):
+    """Request and token buckets; subclasses keep the bucket levels and update them atomically."""
+
+    def __init__(self, rpm, tpm):
+        # bucket -> (capacity, refill per second); a limit of 0 turns that bucket off
+        self.buckets = {name: (limit, limit / 60.0)
+                        for name, limit in (('requests', rpm), ('tokens', tpm)) if limit > 0}
+
+    @abc.abstractmethod
+    def _update(self, change):
+        """Apply change(levels, now) -> (new levels, result) atomically and return the result."""
+
+    def _refill(self, levels, now):
+        current = {}
+        for name, (capacity, rate) in self.buckets.items():
+            level, updated_at = levels.get(name, (capacity, now))
+            current[name] = min(capacity, level + max(0.0, now - updated_at) * rate)
+        return current
+
+    def try_acquire(self, tokens, priority='live'):
+        """Take one request and `tokens` if the priority's share allows; return 0 or the seconds to wait."""
+        reserve = RESERVES[priority]
+
+        def take(levels, now):
+            current = self._refill(levels, now)
+            costs, wait = {}, 0.0
+            for name, (capacity, rate) in self.buckets.items():
+                floor = capacity * reserve
+                # A request bigger than the priority's share waits for a full share instead of forever
+                cost = min(1 if name == 'requests' else tokens, capacity - floor)
+                costs[name] = cost
+                if current[name] - cost < floor:
+                    wait = max(wait, (floor + cost - current[name]) / rate)
+            if wait == 0.0:
+                current = {name: level - costs[name] for name, level in current.items()}
+            return {name: (level, now) for name, level in current.items()}, wait
+
+        return self._update(take)
+
+    def acquire(self, tokens, priority='live', timeout=None):
+        """Wait until a request of `tokens` is admitted, or raise RateLimitTimeoutError after `timeout` seconds."""
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        while True:
+            wait = self.try_acquire(tokens, priority)
+            if wait == 0.0:
+                rate_limit_waits.observe(time.monotonic() - started, priority=priority)
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                rate_limit_waits.observe(time.monotonic() - started, priority=priority)
+                raise RateLimitTimeoutError(f"OpenAI rate limit would not admit a {priority} request in time")
+            # Short naps so a refund or another worker's idle time is picked up quickly
+            time.sleep(min(wait, 0.25))
+
+    def refund(self, tokens):
+        """Return tokens taken for an estimate that was too high (negative to charge extra)."""
+        if 'tokens' not in self.buckets:
+            return
+
+        def give(levels, now):
+            current = self._refill(levels, now)
+            capacity = self.buckets['tokens'][0]
+            current['tokens'] = min(capacity, current['tokens'] + tokens)
+            return {name: (level, now) for name, level in current.items()}, None
+
+        self._update(give)
+
+    def drain(self):
+        """Empty every bucket, e.g. after OpenAI answered 429, so all workers back off together."""
+        self._update(lambda levels, now: ({name: (0.0, now) for name in self.buckets}, None))
+
+
+class MemoryRateLimiter(TokenBucketLimiter):
+    """Buckets in this process only; for a single worker."""
+
+    def __init__(self, rpm, tpm):
+        super().__init__(rpm, tpm)
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def _update(self, change):
+        with self._lock:
+            self._levels, result = change(self._levels, time.time())
+        return result
+
+
+class SQLiteRateLimiter(TokenBucketLimiter):
+    """Buckets in a SQLite file, shared by every worker process on one host."""
+
+    def __init__(self, rpm, tpm, path='rate_limits.db'):
+        super().__init__(rpm, tpm)
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _update(self, change):
+        conn = self._connection()
+        with conn:
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+            conn.execute('BEGIN IMMEDIATE')
+            levels = {name: (level, updated_at) for name, level, updated_at
+                      in conn.execute('SELECT name, level, updated_at FROM buckets')}
+            levels, result = change(levels, time.time())
+            conn.executemany(
+                'INSERT INTO buckets (name, level, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET level = excluded.level, updated_at = excluded.updated_at',
+                [(name, level, updated_at) for name, (level, updated_at) in levels.items()]
+            )
+        return result
+
+
+def create_rate_limiter():
+    """Build the rate limiter selected by LLM_RATE_LIMITER, or None when it is off."""
+    if LLM_RATE_LIMITER == 'sqlite':
+        return SQLiteRateLimiter(LLM_RPM, LLM_TPM, LLM_RATE_LIMIT_DB)
+    if LLM_RATE_LIMITER == 'memory':
+        return MemoryRateLimiter(LLM_RPM, LLM_TPM)
+    if LLM_RATE_LIMITER == 'none':
+        return None
+    raise ValueError(f"Unknown LLM_RATE_LIMITER backend: {LLM_RATE_LIMITER}")
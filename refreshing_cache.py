@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import call_metrics
+from singleflight import SingleFlight
+
+# Stale-while-revalidate cache for slow upstream lookups whose results change rarely
+# (search results, schedules). A fresh value is served for `ttl` seconds. For the
+# next `stale_ttl` seconds the old value is still served immediately while a single
+# background refresh fetches a new one, so callers never wait on the upstream unless
+# nothing usable is cached. Concurrent misses for a key share one load.
+
+cache_requests = call_metrics.register(call_metrics.Counter(
+    'refreshing_cache_requests_total', "Lookups by cache and outcome (hit, stale, miss, refresh_error).",
+    ('cache', 'outcome')))
+
+
+class RefreshingCache:
+    """Caches loader(key) with a TTL and refreshes stale entries in the background."""
+
+    # Seconds to wait before retrying a background refresh that failed
+    RETRY_AFTER = 60
+
+    def __init__(self, name, loader, ttl=3600, stale_ttl=86400, maxsize=128):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self._entries = {}      # key -> [value, fetched_at, refresh in flight, last refresh failure]
+        self._lock = threading.Lock()
+        self._loads = SingleFlight(name)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so each forked server worker gets its own thread
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def get(self, key):
+        """Return the cached value for key, loading it on a miss and refreshing it in the background when stale."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            age = None if entry is None else now - entry[1]
+            if entry is not None and age < self.ttl:
+                cache_requests.inc(cache=self.name, outcome="hit")
+                return entry[0]
+            if entry is not None and age < self.ttl + self.stale_ttl:
+                if not entry[2] and (entry[3] is None or now - entry[3] >= self.RETRY_AFTER):
+                    entry[2] = True
+                    self._get_executor().submit(self._refresh, key)
+                cache_requests.inc(cache=self.name, outcome="stale")
+                return entry[0]
+
+        cache_requests.inc(cache=self.name, outcome="miss")
+        value, _ = self._loads.do(key, self._load, key)
+        return value
+
+    def _load(self, key):
+        value = self.loader(key)
+        with self._lock:
+            self._entries[key] = [value, time.monotonic(), False, None]
+            while len(self._entries) > self.maxsize:
+                # Drop the entry fetched longest ago
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][1])]
+        return value
+
+    def _refresh(self, key):
+        try:
+            self._load(key)
+        except Exception as e:
+            print(f"Background refresh of {self.name} {key!r} failed: {e}")
+            cache_requests.inc(cache=self.name, outcome="refresh_error")
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry[2], entry[3] = False, time.monotonic()
+
+    def invalidate(self, key):
+        """Forget the cached value for key."""
+        with self._lock:
+            self._entries.pop(key, None)
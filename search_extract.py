@@ -0,0 +1,71 @@
+import re
+from history_window import count_tokens
+from mcq_cache import normalize_text
+
+# Reduces a Google Custom Search response to what an LLM needs to answer from it.
+# The raw payload is mostly request metadata, thumbnails and pagemaps; pasted into a
+# prompt it costs thousands of tokens. Each result is cut down to its title, snippet
+# and a date, duplicates are dropped (the same article syndicated under several URLs)
+# and the list is trimmed, best-ranked first, to a token budget.
+
+# pagemap metatags that carry a page's publication or event date, most specific first
+DATE_METATAGS = ('event:start_date', 'article:published_time', 'og:updated_time', 'date', 'pubdate')
+# Snippets usually start with the page date: "Sep 7, 2024 ... "
+SNIPPET_DATE = re.compile(r"^\s*(\w{3} \d{1,2}, \d{4}|\d+ (?:hours?|days?) ago)\s*\.\.\.\s*")
+
+def _clean(text):
+    return " ".join((text or "").split())
+
+def _pagemap_date(pagemap):
+    for event in pagemap.get('sportsevent', []) + pagemap.get('event', []):
+        if event.get('startdate'):
+            return event['startdate']
+    for tags in pagemap.get('metatags', []):
+        for name in DATE_METATAGS:
+            if tags.get(name):
+                return tags[name]
+    return None
+
+def extract_results(payload):
+    """Turn a Custom Search JSON response into a list of {title, snippet, date} dicts in rank order."""
+    results = []
+    for item in (payload or {}).get('items', []):
+        snippet = _clean(item.get('snippet'))
+        date = _pagemap_date(item.get('pagemap', {}))
+        match = SNIPPET_DATE.match(snippet)
+        if match:
+            date = date or match.group(1)
+            snippet = snippet[match.end():]
+        result = {'title': _clean(item.get('title')), 'snippet': snippet}
+        if date:
+            result['date'] = date
+        results.append(result)
+    return results
+
+def dedupe(results):
+    """Drop results whose title or snippet repeats one ranked higher."""
+    seen, unique = set(), []
+    for result in results:
+        keys = {normalize_text(result['title']), normalize_text(result['snippet'])} - {""}
+        if keys & seen:
+            continue
+        seen |= keys
+        unique.append(result)
+    return unique
+
+def format_result(result):
+    """One line per result: 'title (date): snippet'."""
+    date = f" ({result['date']})" if result.get('date') else ""
+    return f"- {result['title']}{date}: {result['snippet']}"
+
+def compact_results(payload, max_tokens=600, model="gpt-3.5-turbo"):
+    """The search results as prompt text: extracted, deduplicated and capped at max_tokens."""
+    lines, used = [], 0
+    for result in dedupe(extract_results(payload)):
+        line = format_result(result)
+        cost = count_tokens(line, model) + 1
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
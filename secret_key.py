@@ -0,0 +1,36 @@
+import os
+import secrets
+import time
+
+# Flask signs session cookies with app.secret_key. A key generated per process breaks
+# sessions as soon as a second worker serves the same call, so every worker loads the
+# same key: FLASK_SECRET_KEY if it is set, otherwise one generated once and kept on disk.
+
+DEFAULT_KEY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.flask_secret_key')
+
+def load_secret_key(path=None):
+    """Return the shared session secret, creating the key file on first use."""
+    key = os.getenv('FLASK_SECRET_KEY')
+    if key:
+        return key
+    path = path or os.getenv('FLASK_SECRET_KEY_FILE', DEFAULT_KEY_FILE)
+    try:
+        # O_EXCL makes creation atomic, so concurrently starting workers agree on one key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path) as key_file:
+            key = key_file.read().strip()
+        if key:
+            return key
+        # Another worker created the file but has not written the key yet
+        for _ in range(50):
+            time.sleep(0.01)
+            with open(path) as key_file:
+                key = key_file.read().strip()
+            if key:
+                return key
+        raise RuntimeError(f"Secret key file {path} is empty")
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as key_file:
+        key_file.write(key)
+    return key
@@ -0,0 +1,118 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Answer cache for free-form voice questions. Speech-to-text rarely transcribes the
+# same question the same way twice, so questions are matched by the cosine similarity
+# of hashed character n-gram vectors rather than by exact text. Character n-grams
+# score "who won WW1" and "who won WW2" as near-identical, so a match also needs the
+# same numbers and names: questions that differ in one of those are different questions.
+
+NUMBER_WORDS = {
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+    'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen',
+    'nineteen', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety',
+    'hundred', 'thousand', 'million', 'billion', 'first', 'second', 'third', 'half', 'quarter',
+}
+
+def salient_tokens(question):
+    """Tokens that must match exactly for two questions to count as the same: numbers and names."""
+    words = re.findall(r"[A-Za-z0-9]+(?:['.][A-Za-z0-9]+)*", question)
+    tokens = set()
+    for i, word in enumerate(words):
+        lower = word.lower()
+        if any(c.isdigit() for c in word) or lower in NUMBER_WORDS:
+            tokens.add(lower)
+        # Capitalized words after the first are names ("Paris", "Lincoln"); speech-to-text capitalizes them
+        elif i > 0 and word[0].isupper() and word != "I":
+            tokens.add(lower)
+    return frozenset(tokens)
+
+class SemanticCache:
+    """Bounded LRU of question -> answer, looked up by nearest neighbour above a threshold."""
+
+    def __init__(self, threshold=0.9, maxsize=2000, ttl=86400):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # HashingVectorizer is stateless, so no fitting is needed as questions arrive
+        self.vectorizer = HashingVectorizer(
+            analyzer='char_wb', ngram_range=(3, 5), n_features=2 ** 18,
+            lowercase=True, alternate_sign=False, norm='l2'
+        )
+        self._entries = OrderedDict()  # normalized question -> (vector, answer, expires_at, salient tokens)
+        self._matrix = None
+        self._keys = []
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _vectorize(self, question):
+        return self.vectorizer.transform([question])
+
+    def get(self, question):
+        """Return the answer cached for the most similar question, or None."""
+        vector = self._vectorize(question)
+        with self._lock:
+            self._drop_expired()
+            if not self._entries:
+                self.counters["misses"] += 1
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = vstack([self._entries[k][0] for k in self._keys]).tocsr()
+            # Rows are L2-normalized, so the dot product is the cosine similarity
+            similarities = (self._matrix @ vector.T).toarray().ravel()
+            tokens = salient_tokens(question)
+            best = None
+            for index in similarities.argsort()[::-1]:
+                if similarities[index] < self.threshold:
+                    break
+                if self._entries[self._keys[index]][3] == tokens:
+                    best = index
+                    break
+            if best is None:
+                self.counters["misses"] += 1
+                return None
+            key = self._keys[best]
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            print(f"Semantic cache hit ({similarities[best]:.2f}): {key}")
+            return self._entries[key][1]
+
+    def set(self, question, answer, ttl=None):
+        """Cache the answer to a question, evicting the least recently used entry when full."""
+        key = " ".join(question.lower().split())
+        vector = self._vectorize(question)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (vector, answer, expires_at, salient_tokens(question))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+            self._matrix = None
+
+    def _drop_expired(self):
+        now = time.time()
+        expired = [k for k, entry in self._entries.items() if entry[2] < now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=len(self._entries))
+
+
+def create_semantic_cache():
+    """Build a SemanticCache configured from the SEMANTIC_CACHE_* environment variables."""
+    return SemanticCache(
+        threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9')),
+        maxsize=int(os.getenv('SEMANTIC_CACHE_SIZE', '2000')),
+        ttl=int(os.getenv('SEMANTIC_CACHE_TTL', '86400'))
+    )
@@ -0,0 +1,95 @@
+"""Production launcher for the Twilio voice apps.
+
+    python serve.py stripe --workers 4 --threads 8     # flask_stripe/app.py
+    python serve.py memory                             # any app by name or module:app
+    python serve.py gateway                            # all of them, mounted under /<name>/
+    python serve.py reload                             # zero-downtime reload after a deploy
+    python serve.py stop
+
+Workers share the session secret through secret_key.py (FLASK_SECRET_KEY or the
+key file), so a call can be served by any worker.
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# WSGI entry points by short name
+APPS = {
+    'stripe': 'flask_stripe.app:app',
+    'twilly': 'twilly:app',
+    'persistant': 'twilio_persistant:app',
+    'memory': 'memory:app',
+    'multiple': 'multiple:app',
+    'passcode': 'passcode:app',
+    'vader': 'twilio_vader:app',
+    'google': 'twilio_google:app',
+    'calendar': 'twilio_calendar:app',
+    'upcoming': 'twilio_upcoming:app',
+    'better_calendar': 'better_calendar2:app',
+    # Every app above in one process, each under /<name>/ (see gateway.py)
+    'gateway': 'gateway:application',
+}
+
+def read_pid(pidfile):
+    with open(pidfile) as f:
+        return int(f.read().strip())
+
+def reload(pidfile, timeout=60):
+    """Start a new master with fresh code, then gracefully stop the old one.
+
+    With preload_app the code lives in the master, so HUP alone would not pick up
+    changes; USR2 re-executes the master alongside the old one instead.
+    """
+    old_pid = read_pid(pidfile)
+    os.kill(old_pid, signal.SIGUSR2)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        try:
+            new_pid = read_pid(pidfile)
+        except (FileNotFoundError, ValueError):
+            continue
+        if new_pid != old_pid:
+            # Let the new workers finish booting before the old ones drain
+            time.sleep(2)
+            os.kill(old_pid, signal.SIGTERM)
+            print(f"Reloaded: master {old_pid} -> {new_pid}")
+            return
+    print(f"New master did not start within {timeout}s; the old master {old_pid} is still serving")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('app', help=f"reload, stop, one of {', '.join(APPS)}, or a module:app path")
+    parser.add_argument('--workers', type=int, help="worker processes (default: WEB_CONCURRENCY or 1, see gunicorn.conf.py)")
+    parser.add_argument('--threads', type=int, help="request threads per worker (default: WEB_THREADS or 8)")
+    parser.add_argument('--bind', help="address to listen on (default: 0.0.0.0:$PORT or 8080)")
+    parser.add_argument('--no-preload', action='store_true', help="import the app in each worker instead of the master")
+    parser.add_argument('--pidfile', default=os.getenv('GUNICORN_PIDFILE', 'gunicorn.pid'))
+    args = parser.parse_args()
+
+    if args.app == 'reload':
+        reload(args.pidfile)
+        sys.exit(0)
+    if args.app == 'stop':
+        # SIGTERM lets in-flight webhooks finish within graceful_timeout
+        os.kill(read_pid(args.pidfile), signal.SIGTERM)
+        sys.exit(0)
+
+    command = ['gunicorn', '--config', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+               '--chdir', REPO_ROOT, '--pid', args.pidfile]
+    if args.workers:
+        # Through the environment, so gunicorn.conf.py sees the worker count when it picks defaults
+        os.environ['WEB_CONCURRENCY'] = str(args.workers)
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+    if args.bind:
+        command += ['--bind', args.bind]
+    if args.no_preload:
+        os.environ['PRELOAD_APP'] = 'false'
+    command.append(APPS.get(args.app, args.app))
+    os.execvp(command[0], command)
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import threading
+import call_metrics
+
+# Request coalescing. When several callers make the same upstream request at the
+# same moment (a class calling in with the same quiz question, everyone asking
+# about the next Chiefs game) only the first one goes out; the others wait for it
+# and share its result, or its exception. Nothing is kept once the call finishes,
+# so this complements the caches rather than replacing them. Only use it for
+# requests without side effects: two calendar inserts must stay two inserts.
+
+coalesced_calls = call_metrics.register(call_metrics.Counter(
+    'singleflight_calls_total', "Upstream calls by group, made (leader) or shared with one in flight (shared).",
+    ('group', 'outcome')))
+
+def fingerprint(*parts):
+    """Stable key for a request from its JSON-serializable parts, independent of dict ordering."""
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and fans its outcome out to concurrent callers."""
+
+    def __init__(self, group):
+        self.group = group
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return (fn(*args, **kwargs), False), or (result, True) if the identical call was already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            coalesced_calls.inc(group=self.group, outcome="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        coalesced_calls.inc(group=self.group, outcome="leader")
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
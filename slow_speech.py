@@ -0,0 +1,49 @@
+import os
+import re
+from xml.sax.saxutils import escape
+
+# Slow mode for callers who asked for "a slow response with pauses". Instead of one
+# <Say> and a 3 second <Pause> for every four words, the answer is spoken at a
+# slower SSML prosody rate with short breaks at clause boundaries and longer ones
+# between sentences, packed into as few <Say> elements as possible. SSML needs an
+# Amazon Polly or Google voice, so slow answers use SLOW_SPEECH_VOICE.
+
+SLOW_SPEECH_VOICE = os.getenv('SLOW_SPEECH_VOICE', 'Polly.Joanna')
+SLOW_SPEECH_RATE = os.getenv('SLOW_SPEECH_RATE', '85%')                  # SSML prosody rate
+SLOW_SPEECH_CLAUSE_BREAK = os.getenv('SLOW_SPEECH_CLAUSE_BREAK', '400ms')
+SLOW_SPEECH_SENTENCE_BREAK = os.getenv('SLOW_SPEECH_SENTENCE_BREAK', '1s')
+# Polly bills and limits SSML per request, so keep each <Say> well under its limits
+SLOW_SPEECH_MAX_CHARS = int(os.getenv('SLOW_SPEECH_MAX_CHARS', '1500'))
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Commas, semicolons, colons and dashes followed by a space ("1,000" stays whole)
+CLAUSE_END = re.compile(r"(?<=[,;:])\s+|\s+[-–—]+\s+")
+
+def split_sentences(text):
+    """Split text into sentences on ., ! and ? followed by whitespace."""
+    return [s for s in (part.strip() for part in SENTENCE_END.split(text)) if s]
+
+def split_clauses(sentence):
+    """Split a sentence at clause punctuation."""
+    return [c for c in (part.strip() for part in CLAUSE_END.split(sentence)) if c]
+
+def render_slow_speech(text, voice=None, rate=None, clause_break=None, sentence_break=None,
+                       max_chars=None):
+    """Return <Say> elements that speak text slowly, pausing at clause and sentence boundaries."""
+    voice = voice or SLOW_SPEECH_VOICE
+    rate = rate or SLOW_SPEECH_RATE
+    clause_tag = '<break time="%s" />' % escape(clause_break or SLOW_SPEECH_CLAUSE_BREAK, {'"': "&quot;"})
+    sentence_tag = '<break time="%s" />' % escape(sentence_break or SLOW_SPEECH_SENTENCE_BREAK, {'"': "&quot;"})
+    max_chars = max_chars or SLOW_SPEECH_MAX_CHARS
+
+    sentences = [clause_tag.join(escape(c) for c in split_clauses(s)) for s in split_sentences(text)]
+    # Pack whole sentences into as few <Say> elements as the size limit allows
+    groups = []
+    for sentence in sentences:
+        if groups and len(groups[-1]) + len(sentence_tag) + len(sentence) <= max_chars:
+            groups[-1] += sentence_tag + sentence
+        else:
+            groups.append(sentence)
+
+    open_tag = '<Say voice="%s"><prosody rate="%s">' % (escape(voice, {'"': "&quot;"}), escape(rate, {'"': "&quot;"}))
+    return "".join(f"{open_tag}{group}</prosody></Say>" for group in groups)
@@ -0,0 +1,170 @@
+import difflib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from call_metrics import Counter, register, count_tokens
+from mcq_cache import normalize_text
+from ttl_cache import TTLCache
+
+# Speculative answers from Twilio's partial speech results. With a Gather's
+# partialResultCallback, Twilio posts the transcript so far while the caller is
+# still talking. Once it has stopped changing, the answer is started on a worker
+# pool, so the LLM runs during speech endpointing instead of after it. When the
+# final SpeechResult arrives the speculative answer is used if the question
+# matches closely enough; otherwise it is thrown away and the tokens are counted
+# as wasted. Prefetching costs tokens on every miss, so it is off by default.
+
+SPECULATIVE_PREFETCH = os.getenv('SPECULATIVE_PREFETCH', 'false').lower() == 'true'
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+PREFETCH_MIN_WORDS = int(os.getenv('PREFETCH_MIN_WORDS', '3'))
+# A partial counts as stable once the same text arrives this many times in a row,
+# or when Twilio reports at least PREFETCH_MIN_STABILITY for it
+PREFETCH_STABLE_REPEATS = int(os.getenv('PREFETCH_STABLE_REPEATS', '2'))
+PREFETCH_MIN_STABILITY = float(os.getenv('PREFETCH_MIN_STABILITY', '0.9'))
+# How similar the final question must be to the speculated one (0-1, difflib ratio)
+PREFETCH_MATCH_THRESHOLD = float(os.getenv('PREFETCH_MATCH_THRESHOLD', '0.9'))
+
+# Gather attributes that turn on partial results for a prompt
+PREFETCH_GATHER_OPTIONS = (
+    {'partialResultCallback': 'partial_speech', 'partialResultCallbackMethod': 'POST'}
+    if SPECULATIVE_PREFETCH else {}
+)
+
+prefetches = register(Counter('speculative_prefetch_total', "Speculative answers by outcome.", ('app', 'outcome')))
+wasted_tokens = register(Counter('speculative_wasted_tokens_total', "Tokens spent on discarded speculative answers.",
+                                 ('app',)))
+
+def similarity(a, b):
+    """Similarity of two transcripts from 0 to 1, ignoring case and punctuation."""
+    return difflib.SequenceMatcher(None, normalize_text(a), normalize_text(b)).ratio()
+
+
+class Speculation:
+    """One speculative answer: the partial question it was started for and its future."""
+
+    def __init__(self, text):
+        self.text = text
+        self.future = None
+        self.tokens = 0
+
+
+class SpeculativePrefetcher:
+    """Starts answers from stable partial transcripts and hands them over on a matching final one."""
+
+    def __init__(self, app_name, answer, workers=4, min_words=3, stable_repeats=2, min_stability=0.9,
+                 match_threshold=0.9):
+        self.app_name = app_name
+        self.answer = answer  # answer(call_sid, question) -> answer text
+        self.workers = workers
+        self.min_words = min_words
+        self.stable_repeats = stable_repeats
+        self.min_stability = min_stability
+        self.match_threshold = match_threshold
+        # CallSid -> {'partial', 'repeats', 'speculation'}
+        self._calls = TTLCache(maxsize=10000, ttl=120)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so each forked server worker gets its own threads
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _run(self, speculation, call_sid):
+        with count_tokens() as counted:
+            try:
+                return self.answer(call_sid, speculation.text)
+            finally:
+                speculation.tokens = counted['tokens']
+
+    def _discard(self, speculation, outcome):
+        prefetches.inc(app=self.app_name, outcome=outcome)
+        if speculation.future.cancel():
+            return
+        # Already running: count its tokens once it finishes
+        speculation.future.add_done_callback(
+            lambda _: wasted_tokens.inc(speculation.tokens, app=self.app_name))
+
+    def observe(self, call_sid, partial, stability=None):
+        """Record a partial transcript and start a speculative answer once it is stable.
+
+        `stability` is Twilio's 0-1 confidence that the partial will not change, if it sent one.
+        """
+        partial = (partial or "").strip()
+        if len(partial.split()) < self.min_words:
+            return
+        with self._lock:
+            state = self._calls.get(call_sid) or {'partial': None, 'repeats': 0, 'speculation': None}
+            if state['partial'] is not None and normalize_text(state['partial']) == normalize_text(partial):
+                state['repeats'] += 1
+            else:
+                state['partial'], state['repeats'] = partial, 1
+            self._calls.set(call_sid, state)
+
+            stable = state['repeats'] >= self.stable_repeats or (
+                stability is not None and stability >= self.min_stability)
+            current = state['speculation']
+            if not stable or (current is not None and similarity(current.text, partial) >= self.match_threshold):
+                return
+            if current is not None:
+                self._discard(current, "superseded")
+            speculation = state['speculation'] = Speculation(partial)
+            speculation.future = self._get_executor().submit(self._run, speculation, call_sid)
+        prefetches.inc(app=self.app_name, outcome="started")
+
+    def claim(self, call_sid, final_text):
+        """Return the future of a speculative answer to (nearly) final_text, or None."""
+        with self._lock:
+            state = self._calls.pop(call_sid)
+        speculation = state and state['speculation']
+        if speculation is None:
+            return None
+        if similarity(speculation.text, final_text) >= self.match_threshold:
+            prefetches.inc(app=self.app_name, outcome="hit")
+            return speculation.future
+        self._discard(speculation, "miss")
+        return None
+
+    def result(self, call_sid, final_text, timeout=None):
+        """Return the speculative answer to (nearly) final_text, or None if there is none or it failed."""
+        future = self.claim(call_sid, final_text)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Speculative answer failed: {e}")
+            return None
+
+    def forget(self, call_sid):
+        """Drop any speculation for a call that has ended."""
+        with self._lock:
+            state = self._calls.pop(call_sid)
+        if state and state['speculation'] is not None:
+            self._discard(state['speculation'], "abandoned")
+
+
+def observe_partial(prefetcher, form):
+    """Feed the fields of a Twilio partialResultCallback request to a prefetcher."""
+    try:
+        stability = float(form['Stability']) if form.get('Stability') else None
+    except ValueError:
+        stability = None
+    partial = form.get('UnstableSpeechResult') or form.get('StableSpeechResult', '')
+    prefetcher.observe(form['CallSid'], partial, stability)
+
+def create_prefetcher(app_name, answer):
+    """Build a prefetcher for an app from the PREFETCH_* settings."""
+    return SpeculativePrefetcher(
+        app_name,
+        answer,
+        workers=PREFETCH_WORKERS,
+        min_words=PREFETCH_MIN_WORDS,
+        stable_repeats=PREFETCH_STABLE_REPEATS,
+        min_stability=PREFETCH_MIN_STABILITY,
+        match_threshold=PREFETCH_MATCH_THRESHOLD
+    )
@@ -2,7 +2,7 @@ import os
 import datetime
 import speech_recognition as sr
 from dotenv import load_dotenv
-from openai import OpenAI
+import llm_client
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
@@ -11,12 +11,6 @@ from googleapiclient.discovery import build
 # Load environment variables from .env file
 load_dotenv()
 
-# Get the OpenAI API key from the environment
-openai_api_key = os.getenv('OPENAI_API_KEY')
-
-# Set up OpenAI API client
-client = OpenAI(api_key=openai_api_key)
-
 # Define the scope with read/write access
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
@@ -37,7 +31,7 @@ def ask_openai_for_event_details(event_description):
         "Location: 123 Main St.\n\n"
         "Please parse the provided event description accordingly."
     )
-    response = client.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
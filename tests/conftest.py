@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+# The modules under test live at the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# Apps load their session secret at import; without this they would write a key file into the repo
+os.environ.setdefault('FLASK_SECRET_KEY', 'secret')
+
+WEBHOOK_SECRET = 'whsec_test'
+
+
+@pytest.fixture(scope='session')
+def stripe_app(tmp_path_factory):
+    """flask_stripe.app on a throwaway database, so the tracked one is never touched."""
+    pytest.importorskip('flask_sqlalchemy')
+    # Set before the import: the app reads its configuration at module level
+    os.environ['DATABASE_URI'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    os.environ['STRIPE_WEBHOOK_SECRET'] = WEBHOOK_SECRET
+    for name, value in (('PASSCODE_PEPPER', 'pepper'), ('OPENAI_API_KEY', 'sk-test'), ('PASSWORD_HASH_WORKERS', '0')):
+        os.environ.setdefault(name, value)
+    from flask_stripe import app as stripe_app
+    return stripe_app
@@ -0,0 +1,23 @@
+import os
+from conftest import REPO_ROOT
+
+
+def test_stripe_flow_keeps_its_instance_folder(stripe_app, tmp_path, monkeypatch):
+    # Started from anywhere and mounted by the gateway, not from inside flask_stripe/
+    monkeypatch.chdir(tmp_path)
+    import gateway
+
+    app = gateway.LazyDispatcher({'stripe': 'flask_stripe.app:app'}, gateway.index).get_app('stripe')
+    assert app is stripe_app.app
+    assert app.instance_path == os.path.join(REPO_ROOT, 'flask_stripe', 'instance')
+
+
+def test_requests_are_routed_under_the_flow_prefix(stripe_app):
+    import gateway
+    from werkzeug.test import Client
+
+    client = Client(gateway.LazyDispatcher({'stripe': 'flask_stripe.app:app'}, gateway.index))
+    response = client.post('/stripe/voice', data={'CallSid': 'CA1'})
+    assert response.status_code == 200
+    assert b'check_passcode' in response.data
+    assert client.get('/').json['stripe']['voice_url'] == '/stripe/voice'
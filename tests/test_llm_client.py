@@ -0,0 +1,111 @@
+import threading
+import time
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+import llm_client
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def completion(text="ok"):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+
+
+class FakeClient:
+    """Stands in for openai.OpenAI: returns or raises the scripted outcomes in order."""
+
+    def __init__(self, *outcomes, delay=0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(llm_client, 'breaker', llm_client.CircuitBreaker(failure_threshold=2, reset_after=30))
+    monkeypatch.setattr(llm_client, 'rate_limiter', None)
+    # No backoff between retries
+    monkeypatch.setattr(llm_client.random, 'uniform', lambda low, high: 0.0)
+    monkeypatch.setattr(llm_client.token_accounting, 'record', lambda *args, **kwargs: None)
+
+
+def use(monkeypatch, client):
+    monkeypatch.setattr(llm_client, 'get_client', lambda: client)
+    return client
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    client = use(monkeypatch, FakeClient(connection_error(), completion("answer")))
+    response = llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES)
+    assert response.choices[0].message.content == "answer"
+    assert client.calls == 2
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(llm_client, 'LLM_MAX_RETRIES', 2)
+    monkeypatch.setattr(llm_client, 'breaker', llm_client.CircuitBreaker(failure_threshold=100))
+    client = use(monkeypatch, FakeClient(connection_error()))
+    with pytest.raises(llm_client.LLMUnavailableError):
+        llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES)
+    assert client.calls == 3
+
+
+def test_open_breaker_fails_fast_then_lets_one_trial_through(monkeypatch):
+    monkeypatch.setattr(llm_client, 'LLM_MAX_RETRIES', 0)
+    client = use(monkeypatch, FakeClient(connection_error()))
+    for _ in range(2):
+        with pytest.raises(llm_client.LLMUnavailableError):
+            llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES)
+    assert llm_client.breaker.is_open
+    with pytest.raises(llm_client.LLMUnavailableError, match="circuit breaker"):
+        llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES)
+    assert client.calls == 2
+
+    # After reset_after, the half-open trial reaches the upstream and closes the breaker
+    llm_client.breaker._opened_at -= 31
+    client.outcomes = [completion()]
+    llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES)
+    assert not llm_client.breaker.is_open
+
+
+def test_slot_timeout_does_not_hold_the_half_open_trial(monkeypatch):
+    monkeypatch.setattr(llm_client, '_slots', threading.BoundedSemaphore(1))
+    use(monkeypatch, FakeClient(completion()))
+    llm_client.breaker._opened_at = time.monotonic() - 31
+    llm_client._slots.acquire()
+    with pytest.raises(llm_client.LLMUnavailableError, match="slot"):
+        llm_client.chat_completion(deadline=0.05, model="gpt-3.5-turbo", messages=MESSAGES)
+    llm_client._slots.release()
+
+    # The trial was never taken, so the next caller can still make it
+    llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES)
+    assert not llm_client.breaker.is_open
+
+
+def test_identical_concurrent_requests_share_one_completion(monkeypatch):
+    monkeypatch.setattr(llm_client, 'LLM_COALESCE', True)
+    client = use(monkeypatch, FakeClient(completion("shared"), delay=0.2))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        llm_client.chat_completion(model="gpt-3.5-turbo", messages=MESSAGES))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.calls == 1
+    assert [r.choices[0].message.content for r in results] == ["shared"] * 4
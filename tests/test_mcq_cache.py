@@ -0,0 +1,45 @@
+import pytest
+from mcq_cache import MCQCache, remap_letters, mcq_key
+
+CACHED = ["Berlin", "Paris", "Rome", "Madrid"]
+# The same options read out in another order: Paris is now A, Berlin B
+SHUFFLED = ["Paris", "Berlin", "Madrid", "Rome"]
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("B. Paris", "A. Paris"),
+    ("The answer is B.", "The answer is A."),
+    ("The answer is: B", "The answer is: A"),
+    ("Option B, Paris.", "Option A, Paris."),
+    ("The correct option is B", "The correct option is A"),
+    ("B is correct: Paris is the capital.", "A is correct: Paris is the capital."),
+    ("Paris (B) is the capital.", "Paris (A) is the capital."),
+    # Each letter is rewritten once, so swapped letters do not undo each other
+    ("B, not A: the answer is B.", None),
+    ("Option B Paris, not option A Berlin.", "Option A Paris, not option B Berlin."),
+    ("A. Berlin\nB. Paris", "B. Berlin\nA. Paris"),
+])
+def test_letters_follow_the_callers_option_order(answer, expected):
+    assert remap_letters(answer, CACHED, SHUFFLED) == expected
+
+
+def test_answer_is_unchanged_for_the_same_order():
+    assert remap_letters("B, not A.", CACHED, [o.upper() for o in CACHED]) == "B, not A."
+
+
+def test_article_a_is_not_a_letter():
+    assert remap_letters("The answer is B, a city in France.", CACHED, SHUFFLED) == \
+        "The answer is A, a city in France."
+
+
+def test_key_ignores_case_punctuation_and_option_order():
+    assert mcq_key("What is the capital of France?", CACHED) == \
+        mcq_key("what is the capital of france", [o.lower() for o in SHUFFLED])
+
+
+def test_unremappable_answer_is_a_miss(tmp_path):
+    cache = MCQCache(db_path=str(tmp_path / "mcq.db"))
+    cache.set("What is the capital of France?", CACHED, "B, not A: the answer is B.")
+    assert cache.get("What is the capital of France?", CACHED) == "B, not A: the answer is B."
+    assert cache.get("What is the capital of France?", SHUFFLED) is None
+    assert cache.stats()["misses"] == 1
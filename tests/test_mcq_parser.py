@@ -0,0 +1,47 @@
+import pytest
+from mcq_parser import parse_mcq
+
+QUESTION = "What is the capital of France?"
+
+
+@pytest.mark.parametrize("utterance", [
+    "What is the capital of France? Option A Berlin, option B Paris, option C Rome, option D Madrid.",
+    "What is the capital of France? option a: Berlin. option b: Paris. option c: Rome. option d: Madrid",
+    "What is the capital of France? Option A Berlin, option B Paris, option C Rome, and option D Madrid",
+    "What is the capital of France? Choice eh Berlin choice bee Paris choice sea Rome choice dee Madrid",
+])
+def test_all_four_options(utterance):
+    assert parse_mcq(utterance) == (QUESTION, ["Berlin", "Paris", "Rome", "Madrid"])
+
+
+def test_misheard_marker_ends_the_previous_option():
+    utterance = "What is the capital of France? Option A Berlin, option V Paris, option C Rome, option D Madrid."
+    assert parse_mcq(utterance) == (QUESTION, ["Berlin"])
+
+
+def test_skipped_letter_stops_the_parse():
+    utterance = "What is the capital of France? Option A Berlin, option B Paris, option D Madrid."
+    assert parse_mcq(utterance) == (QUESTION, ["Berlin", "Paris"])
+
+
+def test_out_of_order_letter_stops_the_parse():
+    utterance = "What is the capital of France? Option A Berlin, option C Rome, option B Paris, option D Madrid."
+    assert parse_mcq(utterance) == (QUESTION, ["Berlin"])
+
+
+def test_options_heard_before_the_caller_stopped():
+    utterance = "What is the capital of France? Option A Berlin, option B Paris and"
+    assert parse_mcq(utterance) == (QUESTION, ["Berlin", "Paris"])
+
+
+def test_empty_option_stops_the_parse():
+    utterance = "What is the capital of France? Option A Berlin, option B, option C Rome"
+    assert parse_mcq(utterance) == (QUESTION, ["Berlin"])
+
+
+@pytest.mark.parametrize("utterance", [
+    "What is the capital of France?",
+    "Option A Berlin, option B Paris",
+])
+def test_without_a_question_and_option_a_everything_is_the_question(utterance):
+    assert parse_mcq(utterance) == (utterance, [])
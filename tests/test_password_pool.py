@@ -0,0 +1,58 @@
+import pytest
+from werkzeug.security import generate_password_hash, check_password_hash
+import password_pool
+from password_pool import needs_rehash, full_method
+
+
+def stored(method, iterations_hash="$salt$hash"):
+    """A stored hash prefix as werkzeug writes it, without paying for the hashing."""
+    return full_method(method) + iterations_hash
+
+
+def test_default_method_matches_registration_hashes():
+    # Accounts have always been registered with method='pbkdf2:sha256' at werkzeug's iteration count
+    baseline = generate_password_hash('x', method='pbkdf2:sha256').split('$', 1)[0]
+    assert full_method(password_pool.PASSWORD_HASH_METHOD) == baseline
+
+
+@pytest.mark.parametrize("current, hashed, upgrade", [
+    ('pbkdf2:sha256', 'pbkdf2:sha256:1000000', False),
+    ('pbkdf2', 'pbkdf2:sha256:1000000', False),
+    ('pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000', False),   # weaker setting: keep the stronger hash
+    ('pbkdf2:sha256:2000000', 'pbkdf2:sha256:1000000', True),
+    ('pbkdf2:sha256', 'pbkdf2:sha256:260000', True),             # hashed by an older werkzeug
+    ('pbkdf2:sha512:1000000', 'pbkdf2:sha256:1000000', True),
+    ('pbkdf2:sha1:1000000', 'pbkdf2:sha256:1000000', False),
+    ('scrypt', 'scrypt:32768:8:1', False),
+    ('scrypt:65536:8:1', 'scrypt:32768:8:1', True),
+    ('scrypt:16384:8:1', 'scrypt:32768:8:1', False),
+    ('scrypt', 'pbkdf2:sha256:1000000', True),
+])
+def test_only_stronger_settings_trigger_a_rehash(monkeypatch, current, hashed, upgrade):
+    monkeypatch.setattr(password_pool, 'PASSWORD_HASH_METHOD', current)
+    assert needs_rehash(stored(hashed)) is upgrade
+
+
+def test_baseline_hash_is_not_rewritten_on_login(stripe_app):
+    # Users registered before the pool existed were hashed like this
+    with stripe_app.app.app_context():
+        baseline_hash = generate_password_hash('secret', method='pbkdf2:sha256')
+        user = stripe_app.User(username='baseline-user', password=baseline_hash)
+        stripe_app.db.session.add(user)
+        stripe_app.db.session.commit()
+
+    response = stripe_app.app.test_client().post(
+        '/', data={'login': '1', 'username': 'baseline-user', 'password': 'secret'})
+    assert response.status_code == 302
+
+    with stripe_app.app.app_context():
+        password_hash = stripe_app.User.query.filter_by(username='baseline-user').one().password
+    assert password_hash == baseline_hash
+    assert check_password_hash(password_hash, 'secret')
+
+
+def test_pool_hashes_in_fresh_processes(monkeypatch):
+    monkeypatch.setattr(password_pool, 'PASSWORD_HASH_WORKERS', 1)
+    password_hash = password_pool.hash_password('secret')
+    assert password_pool.verify_password(password_hash, 'secret')
+    assert password_pool._get_executor()._mp_context.get_start_method() in ('forkserver', 'spawn')
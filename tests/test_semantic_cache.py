@@ -0,0 +1,37 @@
+import pytest
+from semantic_cache import SemanticCache, salient_tokens
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache()
+
+
+def test_rephrased_question_hits(cache):
+    cache.set("What is the capital of France?", "Paris")
+    assert cache.get("what is the capital of France") == "Paris"
+    cache.set("how tall is Mount Everest", "8849 meters")
+    assert cache.get("how tall is the Mount Everest") == "8849 meters"
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("who won WW1", "who won WW2"),
+    ("what is 12 times 12", "what is 12 times 13"),
+    ("who was the first president of the United States", "who was the second president of the United States"),
+    ("what is the capital of France", "what is the capital of Spain"),
+    ("when did Lincoln die", "when did Kennedy die"),
+])
+def test_questions_differing_in_numbers_or_names_miss(cache, cached, asked):
+    cache.set(cached, "cached answer")
+    assert cache.get(asked) is None
+
+
+def test_similar_entry_with_matching_tokens_wins(cache):
+    cache.set("who won WW1", "the Allies")
+    cache.set("who won WW2", "also the Allies, in 1945")
+    assert cache.get("who won WW2") == "also the Allies, in 1945"
+
+
+def test_salient_tokens():
+    assert salient_tokens("What is 12 times twelve in Paris") == {"12", "twelve", "paris"}
+    assert salient_tokens("What is the answer") == frozenset()
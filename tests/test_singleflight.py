@@ -0,0 +1,101 @@
+import threading
+import pytest
+from singleflight import SingleFlight, fingerprint
+
+
+def run_together(count, target):
+    """Start `count` threads on target, let them all call it at once and return their results."""
+    results, errors = [], []
+    barrier = threading.Barrier(count)
+
+    def call():
+        barrier.wait()
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def slow_call(release, value="result", error=None):
+    """A call that blocks until release is set, and the list of times it ran."""
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        if error is not None:
+            raise error
+        return value
+    return fn, calls
+
+
+def test_concurrent_calls_share_one_result():
+    flight, release = SingleFlight('test'), threading.Event()
+    fn, calls = slow_call(release)
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_together(5, lambda: flight.do('key', fn))
+    assert errors == []
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {value for value, _ in results} == {"result"}
+
+
+def test_error_is_raised_to_every_waiting_caller():
+    flight, release = SingleFlight('test'), threading.Event()
+    fn, calls = slow_call(release, error=RuntimeError("upstream down"))
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_together(3, lambda: flight.do('key', fn))
+    assert results == []
+    assert len(calls) == 1
+    assert [str(e) for e in errors] == ["upstream down"] * 3
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight('test')
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+
+
+def test_a_finished_call_is_not_reused():
+    flight, calls = SingleFlight('test'), []
+    for _ in range(2):
+        flight.do('key', lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_fingerprint_ignores_dict_order_but_not_values():
+    assert fingerprint({'a': 1, 'b': 2}) == fingerprint({'b': 2, 'a': 1})
+    assert fingerprint('primary', {'timeMin': '2026-10-18T13:29:00Z'}) != \
+        fingerprint('primary', {'timeMin': '2026-10-18T13:30:00Z'})
+
+
+def test_upcoming_events_key_covers_account_and_window(monkeypatch):
+    twilio_upcoming = pytest.importorskip('twilio_upcoming')
+    requests = []
+
+    class Service:
+        def events(self):
+            return self
+
+        def list(self, **params):
+            requests.append(params)
+            return self
+
+        def execute(self):
+            return {'items': []}
+
+    keys = []
+    monkeypatch.setattr(twilio_upcoming.events_in_flight, 'do',
+                        lambda key, fn, *args: (keys.append(key), (fn(*args), False))[1])
+    twilio_upcoming.get_upcoming_events(Service(), max_results=5)
+    twilio_upcoming.get_upcoming_events(Service(), max_results=3)
+    assert keys[0] == fingerprint(twilio_upcoming.calendar_pool.token_path, requests[0])
+    assert keys[0] != keys[1]
+    assert requests[0]['calendarId'] == 'primary' and requests[0]['timeMin'].endswith(':00Z')
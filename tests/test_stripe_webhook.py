@@ -0,0 +1,64 @@
+import hashlib
+import hmac
+import json
+import time
+import pytest
+
+from conftest import WEBHOOK_SECRET
+
+pytest.importorskip('stripe')
+
+
+def signed(payload, secret=WEBHOOK_SECRET):
+    """The Stripe-Signature header Stripe would send with `payload`."""
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def checkout_event(event_type, **session):
+    return json.dumps({
+        'id': 'evt_test', 'object': 'event', 'type': event_type,
+        'data': {'object': {'id': 'cs_test_1', 'object': 'checkout.session', **session}},
+    })
+
+
+@pytest.fixture
+def enqueued(stripe_app, monkeypatch):
+    jobs = []
+    monkeypatch.setattr(stripe_app, 'enqueue_fulfillment', lambda *args, **kwargs: jobs.append(args))
+    return jobs
+
+
+def test_signed_completed_checkout_is_fulfilled(stripe_app, enqueued):
+    payload = checkout_event('checkout.session.completed', payment_status='paid',
+                             client_reference_id='7', metadata={'user_id': '7'})
+    response = stripe_app.app.test_client().post(
+        '/stripe_webhook', data=payload, headers={'Stripe-Signature': signed(payload)})
+    assert response.status_code == 200
+    assert enqueued == [('cs_test_1', 7)]
+
+
+def test_user_falls_back_to_metadata(stripe_app, enqueued):
+    payload = checkout_event('checkout.session.completed', payment_status='paid',
+                             client_reference_id=None, metadata={'user_id': '8'})
+    stripe_app.app.test_client().post('/stripe_webhook', data=payload, headers={'Stripe-Signature': signed(payload)})
+    assert enqueued == [('cs_test_1', 8)]
+
+
+def test_unpaid_checkout_is_not_fulfilled(stripe_app, enqueued):
+    payload = checkout_event('checkout.session.completed', payment_status='unpaid',
+                             client_reference_id='7', metadata={})
+    response = stripe_app.app.test_client().post(
+        '/stripe_webhook', data=payload, headers={'Stripe-Signature': signed(payload)})
+    assert response.status_code == 200
+    assert enqueued == []
+
+
+def test_bad_signature_is_rejected(stripe_app, enqueued):
+    payload = checkout_event('checkout.session.completed', payment_status='paid',
+                             client_reference_id='7', metadata={})
+    response = stripe_app.app.test_client().post(
+        '/stripe_webhook', data=payload, headers={'Stripe-Signature': signed(payload, 'whsec_other')})
+    assert response.status_code == 400
+    assert enqueued == []
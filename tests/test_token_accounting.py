@@ -0,0 +1,75 @@
+import queue
+import sqlite3
+import threading
+import time
+import pytest
+import call_metrics
+import token_accounting
+from token_accounting import TokenUsageStore
+
+USAGE = {'prompt_tokens': 100, 'completion_tokens': 20}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = TokenUsageStore(str(tmp_path / "usage.db"))
+    monkeypatch.setattr(token_accounting, 'TOKEN_ACCOUNTING', True)
+    monkeypatch.setattr(token_accounting, '_store', store)
+    monkeypatch.setattr(token_accounting, '_rows', queue.Queue(maxsize=10))
+    monkeypatch.setattr(call_metrics, 'current_route', lambda: ('stripe', '/transcribe'))
+    # No background writer unless a test starts one: rows stay queued until flush()
+    monkeypatch.setattr(token_accounting, '_writer', threading.current_thread())
+    return store
+
+
+def dropped(reason):
+    return token_accounting.dropped_records._values.get((reason,), 0)
+
+
+def test_usage_is_recorded_per_route_and_caller(store):
+    token_accounting.record('gpt-3.5-turbo', 'app.answer', usage=USAGE)
+    token_accounting.record('gpt-3.5-turbo', 'app.answer', usage={'prompt_tokens': 50, 'completion_tokens': 10})
+    assert store.totals() == []
+    token_accounting.flush()
+    assert store.totals(by=('app', 'route', 'caller')) == [('stripe', '/transcribe', 'app.answer', 2, 150, 30)]
+
+
+def test_record_does_not_wait_for_a_locked_database(store, monkeypatch):
+    monkeypatch.setattr(token_accounting, '_writer', None)
+    # Another worker holds the write lock
+    blocker = sqlite3.connect(store.path, isolation_level=None)
+    blocker.execute('BEGIN IMMEDIATE')
+    started = time.monotonic()
+    token_accounting.record('gpt-3.5-turbo', 'app.answer', usage=USAGE)
+    assert time.monotonic() - started < 0.5
+    blocker.execute('COMMIT')
+    blocker.close()
+
+    # The writer gets the lock once it is free
+    deadline = time.monotonic() + 5
+    while not store.totals() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert store.totals(by=('caller',)) == [('app.answer', 1, 100, 20)]
+
+
+def test_rows_are_dropped_when_the_queue_is_full(store, monkeypatch):
+    monkeypatch.setattr(token_accounting, '_rows', queue.Queue(maxsize=1))
+    before = dropped('queue_full')
+    for _ in range(3):
+        token_accounting.record('gpt-3.5-turbo', 'app.answer', usage=USAGE)
+    assert dropped('queue_full') == before + 2
+    token_accounting.flush()
+    assert store.totals(by=('caller',)) == [('app.answer', 1, 100, 20)]
+
+
+def test_nothing_is_queued_when_accounting_is_off(store, monkeypatch):
+    monkeypatch.setattr(token_accounting, 'TOKEN_ACCOUNTING', False)
+    token_accounting.record('gpt-3.5-turbo', 'app.answer', usage=USAGE)
+    assert token_accounting._rows.empty()
+
+
+def test_batches_are_summed_in_one_transaction(store):
+    rows = [('2026-10-18', 'stripe', '/transcribe', 'app.answer', 'gpt-3.5-turbo', 1, 10, 2)] * 3
+    store.add_many(rows)
+    store.add_many(rows[:1])
+    assert store.totals(by=('caller',)) == [('app.answer', 4, 40, 8)]
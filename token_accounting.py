@@ -0,0 +1,257 @@
+"""Prompt and completion tokens per app, route and calling function, to find the flows worth optimizing.
+
+    python token_accounting.py report                      # by route and caller, all time
+    python token_accounting.py report --by caller --days 7
+    python token_accounting.py report --by app --by model
+
+Every chat completion made through llm_client is recorded, as is every LLMChain
+run in user_db.py through langchain_callback(). The route is the webhook being
+handled (or "-" off the request thread) and the caller is the function that made
+the call, e.g. "passcode.chat_gpt_response_with_mcq". Counts come from the usage
+OpenAI reports; when a response carries none they are counted locally with the
+tokenizer. Totals are exported on /metrics and kept per day in TOKEN_USAGE_DB,
+which every worker process shares, for the report. Rows are written by a
+background thread in batches, so a webhook never waits on that file's lock; when
+TOKEN_ACCOUNTING_QUEUE rows are already waiting, new ones are dropped and counted.
+"""
+import argparse
+import atexit
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import call_metrics
+
+TOKEN_ACCOUNTING = os.getenv('TOKEN_ACCOUNTING', 'true').lower() == 'true'
+TOKEN_USAGE_DB = os.getenv('TOKEN_USAGE_DB', 'token_usage.db')
+TOKEN_ACCOUNTING_QUEUE = int(os.getenv('TOKEN_ACCOUNTING_QUEUE', '10000'))
+TOKEN_ACCOUNTING_BATCH = int(os.getenv('TOKEN_ACCOUNTING_BATCH', '200'))
+TOKEN_ACCOUNTING_FLUSH = float(os.getenv('TOKEN_ACCOUNTING_FLUSH', '1'))
+
+GROUPS = ('app', 'route', 'caller', 'model')
+
+route_tokens = call_metrics.register(call_metrics.Counter(
+    'llm_route_tokens_total', "Chat completion tokens by app, route, calling function and kind.",
+    ('app', 'route', 'caller', 'kind')))
+dropped_records = call_metrics.register(call_metrics.Counter(
+    'token_accounting_dropped_total', "Usage rows dropped because the write queue was full or the write failed.",
+    ('reason',)))
+
+def caller_name(depth=1):
+    """'module.function' of the frame `depth` levels above the caller of this function."""
+    frame = sys._getframe(depth + 1)
+    module = frame.f_globals.get('__name__', '?')
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+def local_counts(model, messages=None, completion=None, prompts=None):
+    """(prompt, completion) token counts from the tokenizer, for responses without usage."""
+    # Imported here: history_window itself imports llm_client, which imports this module
+    from history_window import count_tokens, count_message_tokens
+
+    prompt_tokens = count_message_tokens(messages, model) if messages else 0
+    prompt_tokens += sum(count_tokens(p, model) for p in prompts or [])
+    return prompt_tokens, count_tokens(completion or "", model)
+
+
+class TokenUsageStore:
+    """Daily token totals per app, route, caller and model in a SQLite file shared by every worker."""
+
+    def __init__(self, path='token_usage.db'):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS token_usage (
+                day TEXT NOT NULL,
+                app TEXT NOT NULL,
+                route TEXT NOT NULL,
+                caller TEXT NOT NULL,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                PRIMARY KEY (day, app, route, caller, model)
+            )
+        ''')
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, app, route, caller, model, prompt_tokens, completion_tokens):
+        """Add one request's tokens to today's totals."""
+        self.add_many([(time.strftime('%Y-%m-%d'), app, route, caller, model, 1, prompt_tokens, completion_tokens)])
+
+    def add_many(self, rows):
+        """Add (day, app, route, caller, model, requests, prompt tokens, completion tokens) rows in one transaction."""
+        totals = {}
+        for *key, requests, prompt_tokens, completion_tokens in rows:
+            total = totals.setdefault(tuple(key), [0, 0, 0])
+            total[0] += requests
+            total[1] += prompt_tokens
+            total[2] += completion_tokens
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(day, app, route, caller, model) DO UPDATE SET '
+                'requests = requests + excluded.requests, prompt_tokens = prompt_tokens + excluded.prompt_tokens, '
+                'completion_tokens = completion_tokens + excluded.completion_tokens',
+                [key + tuple(total) for key, total in totals.items()]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def totals(self, by=('route', 'caller'), days=None):
+        """Rows of (*group values, requests, prompt tokens, completion tokens), most tokens first."""
+        columns = ', '.join(by)
+        where, params = '', ()
+        if days is not None:
+            where, params = 'WHERE day >= ?', (time.strftime('%Y-%m-%d', time.localtime(time.time() - days * 86400)),)
+        return self._connection().execute(
+            f'SELECT {columns}, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens) FROM token_usage '
+            f'{where} GROUP BY {columns} ORDER BY SUM(prompt_tokens) + SUM(completion_tokens) DESC',
+            params
+        ).fetchall()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """The process-wide usage store, or None when TOKEN_ACCOUNTING is off."""
+    global _store
+    if not TOKEN_ACCOUNTING:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TokenUsageStore(TOKEN_USAGE_DB)
+    return _store
+
+_rows = queue.Queue(maxsize=TOKEN_ACCOUNTING_QUEUE)
+_writer = None
+_writer_lock = threading.Lock()
+
+def _write_batch(batch):
+    try:
+        get_store().add_many(batch)
+    except sqlite3.Error as e:
+        # Accounting must never fail the calls it is counting
+        dropped_records.inc(len(batch), reason="error")
+        print(f"Could not record token usage: {e}")
+
+def _run_writer():
+    while True:
+        # Block for the first row, then collect whatever else arrives within the flush window
+        batch = [_rows.get()]
+        deadline = time.monotonic() + TOKEN_ACCOUNTING_FLUSH
+        while len(batch) < TOKEN_ACCOUNTING_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_rows.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _write_batch(batch)
+
+def _enqueue(row):
+    global _writer
+    # Start the writer on first use so forking servers start one per worker process
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_run_writer, daemon=True)
+            _writer.start()
+    try:
+        _rows.put_nowait(row)
+    except queue.Full:
+        dropped_records.inc(reason="queue_full")
+
+@atexit.register
+def flush():
+    """Write the rows still waiting in the queue, e.g. on shutdown."""
+    batch = []
+    while True:
+        try:
+            batch.append(_rows.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        _write_batch(batch)
+
+def record(model, caller, usage=None, messages=None, completion=None, prompts=None):
+    """Account one completion to the current route and `caller`, from `usage` or the local tokenizer.
+
+    `usage` is the response's usage (an object or a dict with prompt_tokens and completion_tokens).
+    """
+    if isinstance(usage, dict):
+        prompt_tokens, completion_tokens = usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+    elif usage is not None:
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    else:
+        prompt_tokens, completion_tokens = local_counts(model, messages, completion, prompts)
+    app, route = call_metrics.current_route()
+    route_tokens.inc(prompt_tokens, app=app, route=route, caller=caller, kind="prompt")
+    route_tokens.inc(completion_tokens, app=app, route=route, caller=caller, kind="completion")
+    if TOKEN_ACCOUNTING:
+        # Written by the background writer; the webhook never waits on the shared file
+        _enqueue((time.strftime('%Y-%m-%d'), app, route, caller, model, 1, prompt_tokens, completion_tokens))
+
+def langchain_callback(caller):
+    """A LangChain callback handler that records every LLM run under `caller`."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TokenAccountingHandler(BaseCallbackHandler):
+        def __init__(self):
+            self._prompts = threading.local()
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self._prompts.value = prompts
+
+        def on_llm_end(self, response, **kwargs):
+            output = response.llm_output or {}
+            completion = "".join(g.text for generations in response.generations for g in generations)
+            record(output.get('model_name', ''), caller, usage=output.get('token_usage') or None, completion=completion,
+                   prompts=getattr(self._prompts, 'value', None))
+
+    return TokenAccountingHandler()
+
+
+def print_report(by, days):
+    rows = TokenUsageStore(TOKEN_USAGE_DB).totals(by, days)
+    total = sum(row[-2] + row[-1] for row in rows) or 1
+    widths = [max([len(name)] + [len(str(row[i])) for row in rows]) for i, name in enumerate(by)]
+    header = '  '.join(name.ljust(width) for name, width in zip(by, widths))
+    print(f"{header}  {'requests':>8}  {'prompt':>10}  {'completion':>10}  {'total':>10}  {'share':>6}")
+    for row in rows:
+        keys = '  '.join(str(value).ljust(width) for value, width in zip(row, widths))
+        requests, prompt_tokens, completion_tokens = row[-3:]
+        tokens = prompt_tokens + completion_tokens
+        print(f"{keys}  {requests:>8}  {prompt_tokens:>10}  {completion_tokens:>10}  {tokens:>10}  {tokens / total:>6.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['report'])
+    parser.add_argument('--by', action='append', choices=GROUPS, help="group by (repeatable); default route and caller")
+    parser.add_argument('--days', type=float, help="only the last N days")
+    args = parser.parse_args()
+
+    if not os.path.exists(TOKEN_USAGE_DB):
+        print(f"No token usage recorded yet in {TOKEN_USAGE_DB}")
+        sys.exit(1)
+    print_report(args.by or ['route', 'caller'], args.days)
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a fixed time-to-live."""
+
+    def __init__(self, maxsize=1000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            # Mark the entry as most recently used
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entry when full."""
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            # Drop expired entries from the least recently used end, so entries that are
+            # never read again do not wait for the cache to fill up to be released
+            while self._data:
+                oldest_expiry = next(iter(self._data.values()))[0]
+                if oldest_expiry >= now:
+                    break
+                self._data.popitem(last=False)
+
+    def touch(self, key):
+        """Push back the expiry of an existing entry without changing its value."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data[key] = (time.monotonic() + self.ttl, item[1])
+                self._data.move_to_end(key)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value."""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -1,42 +1,38 @@
-import os
 import datetime
-import speech_recognition as sr
 from flask import Flask, request, session
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
-import openai
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import llm_client
+from call_metrics import instrument, stage
+from calendar_pool import get_calendar_pool, CalendarAuthError
+from secret_key import load_secret_key
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secret key for session management
-
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'calendar')  # Per-stage webhook timings, served at /metrics
 
 # Define the scope with read/write access
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Calendar clients and credentials shared by every thread and app in the process
+calendar_pool = get_calendar_pool(SCOPES)
 
 def get_google_calendar_service():
-    """Authenticate and return the Google Calendar service."""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=8080)
-        with open('token.json', 'w') as token:
+    """Return this thread's Google Calendar service from the shared pool (see calendar_pool.py)."""
+    try:
+        return calendar_pool.get()
+    except CalendarAuthError:
+        # No usable token: authorize in the browser, then the pool picks up the new token.json
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+        creds = flow.run_local_server(port=8080)
+        with open(calendar_pool.token_path, 'w') as token:
             token.write(creds.to_json())
-    return build('calendar', 'v3', credentials=creds)
+        return calendar_pool.get()
 
 def ask_openai_for_event_details(event_description):
     """Query the OpenAI API to extract event details."""
@@ -48,7 +44,7 @@ def ask_openai_for_event_details(event_description):
         "Time: [HH:MM AM/PM]\n"
         "Location: [Event Location]\n"
     )
-    response = openai.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -96,11 +92,14 @@ def add_event_to_calendar(service, summary, location, start_time, end_time, time
             'useDefault': True,
         },
     }
-    event = service.events().insert(calendarId='primary', body=event).execute()
+    with stage('google_calendar'):
+        event = service.events().insert(calendarId='primary', body=event).execute()
     print(f"Event created: {event.get('htmlLink')}")
 
 def recognize_speech_from_audio(audio):
     """Convert audio to text using speech recognition."""
+    import speech_recognition as sr
+
     recognizer = sr.Recognizer()
     try:
         text = recognizer.recognize_google(audio)
@@ -121,7 +120,7 @@ def voice():
     response.say("Hello! Please describe the event you would like to add to your Google Calendar.")
 
     # Use Twilio's <Gather> to capture speech input from the user
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
+    gather = Gather(input="speech", speechTimeout="auto", action="transcribe", method="POST")
     response.append(gather)
 
     return str(response)
@@ -150,7 +149,8 @@ def transcribe():
         end_time = (datetime.datetime.fromisoformat(start_time) + datetime.timedelta(hours=1)).isoformat()
 
         # Add event to Google Calendar
-        service = get_google_calendar_service()
+        with stage('google_calendar'):
+            service = get_google_calendar_service()
         add_event_to_calendar(
             service,
             summary=event_details['summary'],
@@ -1,39 +1,110 @@
 from flask import Flask, request, jsonify
 from twilio.twiml.voice_response import VoiceResponse, Gather
-import openai
+import llm_client
+from call_metrics import instrument, stage
+from refreshing_cache import RefreshingCache
+from search_extract import compact_results
+from singleflight import fingerprint
+from ttl_cache import TTLCache
+from secret_key import load_secret_key
 import os
 import json
+import threading
 from dotenv import load_dotenv
-import requests
+from cassette import requests_session
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
-app.secret_key = "123456789"  # Use a persistent secret key in production
-
-# Load OpenAI API key from environment variable
-openai.api_key = os.getenv('OPENAI_API_KEY')
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'google')  # Per-stage webhook timings, served at /metrics
 
 # Google Custom Search API Configuration
 GOOGLE_SEARCH_ENGINE_ID = os.getenv('GOOGLE_CSE_ID') 
+CHIEFS_QUERY = "Kansas City Chiefs upcoming games"
+# The schedule changes at most daily: serve results for SEARCH_TTL seconds, then keep
+# serving them for up to SEARCH_STALE_TTL more while a background refresh runs
+SEARCH_TTL = float(os.getenv('SEARCH_TTL', '21600'))
+SEARCH_STALE_TTL = float(os.getenv('SEARCH_STALE_TTL', '86400'))
+# Prompt tokens the extracted search results may use
+SEARCH_CONTEXT_TOKENS = int(os.getenv('SEARCH_CONTEXT_TOKENS', '600'))
+
+# Keep-alive session; records or replays when CASSETTE_MODE is set (see cassette.py)
+http = requests_session()
+
+# token.json parsed once and re-read only when the file changes: (mtime, access token)
+_token = (None, None)
+_token_lock = threading.Lock()
+
+def load_access_token(path="token.json"):
+    """Return the access token from token.json, cached in memory until the file is modified."""
+    global _token
+    mtime = os.stat(path).st_mtime  # FileNotFoundError if there is no token file
+    with _token_lock:
+        if _token[0] != mtime:
+            with open(path, "r") as token_file:
+                _token = (mtime, json.load(token_file)['access_token'])
+        return _token[1]
+
+def fetch_search(search_url):
+    """GET a Custom Search URL and return its JSON, raising for HTTP errors."""
+    with stage('google_search'):
+        response = http.get(search_url)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    return response.json()
+
+def run_search(query):
+    """Query the Google Custom Search API and return its JSON response."""
+    search_url = f"https://www.googleapis.com/customsearch/v1?q={query}&cx={GOOGLE_SEARCH_ENGINE_ID}&access_token={load_access_token()}"
+    return fetch_search(search_url)
+
+def load_search(query):
+    """A search cache entry: the response JSON and, once a caller has asked, the games parsed from it."""
+    return {'payload': run_search(query), 'games': None}
+
+# Search results by query; concurrent misses share one request
+search_cache = RefreshingCache('google_search', load_search, ttl=SEARCH_TTL, stale_ttl=SEARCH_STALE_TTL)
+
+# Game lists parsed by the LLM, keyed by the extracted results they were parsed from,
+# so a refresh that brings back the same results is not parsed again
+games_cache = TTLCache(maxsize=16, ttl=SEARCH_TTL + SEARCH_STALE_TTL)
+
+def list_games(search):
+    """Have the LLM list the upcoming games in a search cache entry, parsed once per entry."""
+    # Kept on the entry, so callers served from the cache skip extraction as well as the LLM
+    if search['games'] is not None:
+        return search['games']
+    context = compact_results(search['payload'], max_tokens=SEARCH_CONTEXT_TOKENS)
+    key = fingerprint(context)
+    games = games_cache.get(key)
+    if games is not None:
+        search['games'] = games
+        return games
+
+    # Use OpenAI to extract and list the games, opponents, and times
+    openai_response = llm_client.chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": (
+                "Here are the results of a Google search for upcoming Kansas City Chiefs games:\n\n"
+                f"{context}\n\n"
+                "Please extract and list the upcoming Kansas City Chiefs games, including the dates, opponents, and times."
+            )}
+        ],
+        max_tokens=150
+    )
+    games = openai_response.choices[0].message.content.strip()
+    games_cache.set(key, games)
+    search['games'] = games
+    return games
 
 @app.route("/search_chiefs")
 def search_chiefs():
     try:
-        # Load token from token.json
-        with open("token.json", "r") as token_file:
-            token = json.load(token_file)
-        access_token = token['access_token']
-
-        # Query the Google Custom Search API
-        query = "Kansas City Chiefs upcoming games"
-        search_url = f"https://www.googleapis.com/customsearch/v1?q={query}&cx={GOOGLE_SEARCH_ENGINE_ID}&access_token={access_token}"
-        response = requests.get(search_url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-
-        # Return the JSON response
-        return response.json()
+        # Cached results, refreshed in the background once they are SEARCH_TTL old
+        return search_cache.get(CHIEFS_QUERY)['payload']
     except FileNotFoundError:
         return "Token file not found. Please ensure token.json is available.", 400
     except Exception as e:
@@ -45,7 +116,7 @@ def voice():
     response = VoiceResponse()
 
     # Greet the user and ask what they would like to know
-    gather = Gather(input="speech", action="/handle_speech", method="POST")
+    gather = Gather(input="speech", action="handle_speech", method="POST")
     gather.say("Hello! You can ask me about upcoming Kansas City Chiefs games. What would you like to know?")
     response.append(gather)
 
@@ -55,40 +126,25 @@ def voice():
 def handle_speech():
     speech_result = request.form.get('SpeechResult', None)
     if speech_result:
-        # Query the Google Custom Search API and get upcoming Chiefs games
-        chiefs_info = search_chiefs()
-
-        # Use OpenAI to extract and list the games, opponents, and times
-        conversation_history = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": (
-                "Here is a JSON response from a Google Custom Search API query:\n\n"
-                f"{json.dumps(chiefs_info, indent=2)}\n\n"
-                "Please extract and list the upcoming Kansas City Chiefs games, including the dates, opponents, and times."
-            )}
-        ]
-        openai_response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."}
-            ] + conversation_history,
-            max_tokens=150
-        )
-
-        parsed_data = openai_response.choices[0].message.content.strip()
-
-        # Respond with the parsed data
         response = VoiceResponse()
-        response.say(parsed_data)
+        try:
+            # Query the Google Custom Search API (or its cache) for upcoming Chiefs games
+            search = search_cache.get(CHIEFS_QUERY)
+        except Exception as e:
+            print(f"Error making API request: {str(e)}")
+            response.say("Sorry, I couldn't look up the Chiefs schedule right now.")
+        else:
+            # Respond with the parsed data
+            response.say(list_games(search))
         response.say("Is there anything else you would like to know?")
-        gather = Gather(input="speech", action="/handle_speech", method="POST")
+        gather = Gather(input="speech", action="handle_speech", method="POST")
         response.append(gather)
         return str(response)
     
     # If no speech was recognized, prompt again
     response = VoiceResponse()
     response.say("Sorry, I didn't catch that. Could you please repeat?")
-    gather = Gather(input="speech", action="/handle_speech", method="POST")
+    gather = Gather(input="speech", action="handle_speech", method="POST")
     response.append(gather)
     return str(response)
 
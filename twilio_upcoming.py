@@ -1,42 +1,39 @@
-import os
 import datetime
-import speech_recognition as sr
 from flask import Flask, request, session
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
-import openai
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import llm_client
+from call_metrics import instrument, stage
+from calendar_pool import get_calendar_pool, CalendarAuthError
+from singleflight import SingleFlight, fingerprint
+from secret_key import load_secret_key
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secret key for session management
-
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+app.secret_key = load_secret_key()  # Shared by every worker process
+instrument(app, 'upcoming')  # Per-stage webhook timings, served at /metrics
 
 # Define the scope with read/write access
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Calendar clients and credentials shared by every thread and app in the process
+calendar_pool = get_calendar_pool(SCOPES)
 
 def get_google_calendar_service():
-    """Authenticate and return the Google Calendar service."""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=8080)
-        with open('token.json', 'w') as token:
+    """Return this thread's Google Calendar service from the shared pool (see calendar_pool.py)."""
+    try:
+        return calendar_pool.get()
+    except CalendarAuthError:
+        # No usable token: authorize in the browser, then the pool picks up the new token.json
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+        creds = flow.run_local_server(port=8080)
+        with open(calendar_pool.token_path, 'w') as token:
             token.write(creds.to_json())
-    return build('calendar', 'v3', credentials=creds)
+        return calendar_pool.get()
 
 def ask_openai_for_event_details(event_description):
     """Query the OpenAI API to extract event details."""
@@ -48,7 +45,7 @@ def ask_openai_for_event_details(event_description):
         "Time: [HH:MM AM/PM]\n"
         "Location: [Event Location]\n"
     )
-    response = openai.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -113,16 +110,32 @@ def add_event_to_calendar(service, summary, location, start_time, end_time, time
             'useDefault': True,
         },
     }
-    event = service.events().insert(calendarId='primary', body=event).execute()
+    with stage('google_calendar'):
+        event = service.events().insert(calendarId='primary', body=event).execute()
     print(f"Event created: {event.get('htmlLink')}")
 
+# Concurrent "upcoming events" lookups share one Calendar request. Inserts are never
+# coalesced: two callers adding an event must add two events.
+events_in_flight = SingleFlight('google_calendar')
+
+def upcoming_events_request(max_results):
+    """The events().list arguments for the next max_results events on the primary calendar."""
+    # timeMin is cut to the minute so lookups in flight together make the same request
+    now = datetime.datetime.utcnow().replace(second=0, microsecond=0).isoformat() + 'Z'  # 'Z' indicates UTC time
+    return {'calendarId': 'primary', 'timeMin': now, 'maxResults': max_results,
+            'singleEvents': True, 'orderBy': 'startTime'}
+
+def list_upcoming_events(service, params):
+    """Fetch events from Google Calendar with the events().list arguments in params."""
+    with stage('google_calendar'):
+        return service.events().list(**params).execute()
+
 def get_upcoming_events(service, max_results=5):
     """Retrieve and return upcoming events from Google Calendar with natural language formatting."""
-    now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-    events_result = service.events().list(
-        calendarId='primary', timeMin=now,
-        maxResults=max_results, singleEvents=True,
-        orderBy='startTime').execute()
+    params = upcoming_events_request(max_results)
+    # Keyed on the account and the exact request, so only identical lookups share a response
+    key = fingerprint(calendar_pool.token_path, params)
+    events_result, _ = events_in_flight.do(key, list_upcoming_events, service, params)
     events = events_result.get('items', [])
     
     if not events:
@@ -140,6 +153,8 @@ def get_upcoming_events(service, max_results=5):
 
 def recognize_speech_from_audio(audio):
     """Convert audio to text using speech recognition."""
+    import speech_recognition as sr
+
     recognizer = sr.Recognizer()
     try:
         text = recognizer.recognize_google(audio)
@@ -161,7 +176,7 @@ def voice():
     response.say("Hello! Would you like to add an event to your calendar, or hear your upcoming events?")
 
     # Use Twilio's <Gather> to capture speech input from the user
-    gather = Gather(input="speech", speechTimeout="auto", action="/handle_action", method="POST")
+    gather = Gather(input="speech", speechTimeout="auto", action="handle_action", method="POST")
     response.append(gather)
 
     return str(response)
@@ -175,7 +190,8 @@ def handle_action():
 
     # Check if the user wants to hear upcoming events
     if "upcoming events" in transcription_text.lower():
-        service = get_google_calendar_service()
+        with stage('google_calendar'):
+            service = get_google_calendar_service()
         upcoming_events = get_upcoming_events(service)
         response = VoiceResponse()
         response.say(upcoming_events)
@@ -185,14 +201,14 @@ def handle_action():
     if "add an event" in transcription_text.lower() or "add event" in transcription_text.lower():
         response = VoiceResponse()
         response.say("What event would you like to add to your calendar?")
-        gather = Gather(input="speech", speechTimeout="auto", action="/transcribe_event", method="POST")
+        gather = Gather(input="speech", speechTimeout="auto", action="transcribe_event", method="POST")
         response.append(gather)
         return str(response)
 
     # Default response if the action is unclear
     response = VoiceResponse()
     response.say("Sorry, I didn't understand that. Please say 'add an event' or 'upcoming events'.")
-    gather = Gather(input="speech", speechTimeout="auto", action="/handle_action", method="POST")
+    gather = Gather(input="speech", speechTimeout="auto", action="handle_action", method="POST")
     response.append(gather)
 
     return str(response)
@@ -214,7 +230,8 @@ def transcribe_event():
         end_time = (datetime.datetime.fromisoformat(start_time) + datetime.timedelta(hours=1)).isoformat()
 
         # Add event to Google Calendar
-        service = get_google_calendar_service()
+        with stage('google_calendar'):
+            service = get_google_calendar_service()
         add_event_to_calendar(
             service,
             summary=event_details['summary'],
@@ -1,40 +1,52 @@
 import os
+import threading
 from flask import Flask, request
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from twilio.rest import Client
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
-import openai
+import llm_client
+from call_metrics import instrument
+from cassette import twilio_http_client
+from offline_assets import require_nltk, startup_step
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Download the VADER lexicon for sentiment analysis
-nltk.download('vader_lexicon')
-
 app = Flask(__name__)
+instrument(app, 'vader')  # Per-stage webhook timings, served at /metrics
 
 # Twilio credentials from environment variables
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-# OpenAI API Key from environment variable
-openai.api_key = os.getenv('OPENAI_API_KEY')
+twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=twilio_http_client())
 
 # The number to forward the call to if sentiment is negative
 forward_number = "+18162560783"
 
-# Initialize the sentiment analyzer
-sid = SentimentIntensityAnalyzer()
+# The sentiment analyzer, built when the first caller is analysed
+_sentiment_analyzer = None
+_sentiment_lock = threading.Lock()
+
+def get_sentiment_analyzer():
+    """Return the VADER sentiment analyzer, loading NLTK and its lexicon on first use."""
+    global _sentiment_analyzer
+    if _sentiment_analyzer is None:
+        with _sentiment_lock:
+            if _sentiment_analyzer is None:
+                with startup_step('sentiment analyzer'):
+                    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+                    # Load the VADER lexicon from the bundled assets (python offline_assets.py prepare)
+                    require_nltk('vader_lexicon')
+                    _sentiment_analyzer = SentimentIntensityAnalyzer()
+    return _sentiment_analyzer
 
 @app.route("/voice", methods=['POST'])
 def voice():
     response = VoiceResponse()
 
     # Prompt the user to speak their thoughts
-    gather = Gather(input="speech", action="/process_speech", method="POST")
+    gather = Gather(input="speech", action="process_speech", method="POST")
     gather.say("Please tell me how you are feeling today.")
     response.append(gather)
 
@@ -48,7 +60,7 @@ def process_speech():
     user_input = request.form['SpeechResult']
 
     # Analyze the sentiment
-    sentiment_scores = sid.polarity_scores(user_input)
+    sentiment_scores = get_sentiment_analyzer().polarity_scores(user_input)
     compound_score = sentiment_scores['compound']
 
     if compound_score < 0:
@@ -58,7 +70,7 @@ def process_speech():
         response.hangup()  # Ensure the call ends after dialing
     else:
         # If sentiment is positive, ask the user to ask a question
-        gather = Gather(input="speech", action="/chatgpt", method="POST")
+        gather = Gather(input="speech", action="chatgpt", method="POST")
         gather.say("I'm glad to hear that you're doing well. You can now ask me any question.")
         response.append(gather)
 
@@ -72,7 +84,7 @@ def chatgpt():
     user_question = request.form['SpeechResult']
 
     # Send the question to OpenAI's ChatGPT
-    chat_response = openai.chat.completions.create(
+    chat_response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are an expert at answering multiple-choice questions."},
@@ -1,28 +1,37 @@
 from flask import Flask, request, make_response
-from twilio.twiml.voice_response import VoiceResponse, Gather
-import openai
+import llm_client
+from call_metrics import instrument
 from dotenv import load_dotenv
-import os
+from semantic_cache import create_semantic_cache
+from speculative import create_prefetcher, observe_partial, PREFETCH_GATHER_OPTIONS
+from twiml_cache import speech_prompt, compile_twiml, say_then_prompt
 
 # Initialize Flask app
 app = Flask(__name__)
+instrument(app, 'twilly')  # Per-stage webhook timings, served at /metrics
 
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Answers to earlier questions, matched by similarity rather than exact wording
+semantic_cache = create_semantic_cache()
+
+# Replies serialized once at import; answers are rendered into a template (see twiml_cache.py)
+GREETING_PROMPT = compile_twiml(speech_prompt(
+    "Hello! I'm a chatbot powered by ChatGPT. What would you like to talk about today?", "transcribe", **PREFETCH_GATHER_OPTIONS))
+ANSWER_PROMPT = say_then_prompt("transcribe", **PREFETCH_GATHER_OPTIONS)
+
+# Answers started from partial speech results while the caller is still talking
+prefetcher = create_prefetcher('twilly', lambda call_sid, question: chat_gpt_response(question))
 
 # Endpoint to handle incoming voice calls
 @app.route("/voice", methods=['POST'])
 def voice():
-    response = VoiceResponse()
-
     # Greet the user and ask them to say something
-    response.say("Hello! I'm a chatbot powered by ChatGPT. What would you like to talk about today?")
+    return GREETING_PROMPT
 
-    # Use Twilio's <Gather> to capture speech input from the user
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    response.append(gather)
-
-    return str(response)
+# Endpoint Twilio posts partial speech results to while the caller is still talking
+@app.route("/partial_speech", methods=['POST'])
+def partial_speech():
+    observe_partial(prefetcher, request.form)
+    return "", 204
 
 # Endpoint to handle the transcribed speech
 @app.route("/transcribe", methods=['POST'])
@@ -31,23 +40,24 @@ def transcribe():
     transcription_text = request.form['SpeechResult']
     print(f"User asked: {transcription_text}")
 
-    # Get the response from ChatGPT
-    chatgpt_response = chat_gpt_response(transcription_text)
+    # Reuse the answer to a similar question if there is one, otherwise ask ChatGPT
+    call_sid = request.form.get('CallSid')
+    chatgpt_response = semantic_cache.get(transcription_text)
+    if chatgpt_response is None:
+        # An answer prefetched from partial speech counts if it was for this question
+        chatgpt_response = (prefetcher.result(call_sid, transcription_text, timeout=llm_client.LLM_DEADLINE)
+                            or chat_gpt_response(transcription_text))
+        semantic_cache.set(transcription_text, chatgpt_response)
+    else:
+        prefetcher.forget(call_sid)
     print(f"ChatGPT response: {chatgpt_response}")
 
     # Respond to the user with the generated text from ChatGPT
-    response = VoiceResponse()
-    response.say(chatgpt_response)
-
-    # Optionally, allow the user to continue the conversation
-    gather = Gather(input="speech", speechTimeout="auto", action="/transcribe", method="POST")
-    response.append(gather)
-
-    return str(response)
+    return ANSWER_PROMPT.render(text=chatgpt_response)
 
 # Function to interact with OpenAI's ChatGPT
 def chat_gpt_response(prompt):
-    response = openai.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -0,0 +1,99 @@
+import re
+from xml.sax.saxutils import escape
+from twilio.twiml.voice_response import VoiceResponse, Gather
+from call_metrics import stage
+
+# Most webhook replies are the same prompt on every call, and the rest differ only
+# in the text being spoken. Building a VoiceResponse tree and serializing it to XML
+# on each request is pure overhead, so static replies are serialized once at import
+# and dynamic ones are rendered from a precompiled template by string joins.
+#
+# Actions and redirect URLs are relative ("transcribe", not "/transcribe"). Twilio
+# resolves them against the webhook's own URL, so the same TwiML works whether an
+# app is served at the root or mounted under a prefix by gateway.py.
+
+SLOT_PATTERN = re.compile(r"\{\{(slot|raw):(\w+)\}\}")
+
+def slot(name, raw=False):
+    """Placeholder for a value filled in when a TwiMLTemplate is rendered.
+
+    Values are XML-escaped unless raw is set, in which case they must already be TwiML.
+    """
+    return "{{%s:%s}}" % ("raw" if raw else "slot", name)
+
+def speech_prompt(text, action, **gather_options):
+    """VoiceResponse that says `text` (a string or a list of them) and then gathers speech for `action`."""
+    response = VoiceResponse()
+    for line in ([text] if isinstance(text, str) else text):
+        response.say(line)
+    gather_options.setdefault('speechTimeout', 'auto')
+    response.append(Gather(input="speech", action=action, method="POST", **gather_options))
+    return response
+
+def digits_prompt(text, action, num_digits=None, **gather_options):
+    """VoiceResponse that says `text` and then gathers keypad digits for `action`.
+
+    Pass `num_digits` to stop after that many digits, or e.g. finish_on_key="#".
+    """
+    response = VoiceResponse()
+    response.say(text)
+    if num_digits is not None:
+        gather_options['num_digits'] = num_digits
+    response.append(Gather(input="dtmf", action=action, method="POST", **gather_options))
+    return response
+
+def redirect_response(url, text=None, pause=None, **redirect_options):
+    """VoiceResponse that optionally speaks or pauses, then redirects the call to `url`."""
+    response = VoiceResponse()
+    if text:
+        response.say(text)
+    if pause:
+        response.pause(length=pause)
+    response.redirect(url, **redirect_options)
+    return response
+
+def hangup_response(text):
+    """VoiceResponse that says `text` and hangs up."""
+    response = VoiceResponse()
+    response.say(text)
+    response.hangup()
+    return response
+
+def compile_twiml(response):
+    """Serialize a response once; serve the returned bytes on every request."""
+    return str(response).encode()
+
+
+class TwiMLTemplate:
+    """A response serialized once with slot() placeholders, rendered by joining strings."""
+
+    def __init__(self, response):
+        parts = SLOT_PATTERN.split(str(response))
+        self.literals = parts[0::3]
+        self.slots = list(zip(parts[2::3], (kind == "raw" for kind in parts[1::3])))
+
+    def render(self, **values):
+        """Return the XML with each slot replaced by its escaped value."""
+        with stage('render'):
+            out = [self.literals[0]]
+            for (name, raw), literal in zip(self.slots, self.literals[1:]):
+                # Escaping quotes too makes values safe in attributes as well as text
+                out.append(values[name] if raw else escape(str(values[name]), {'"': "&quot;"}))
+                out.append(literal)
+            return "".join(out)
+
+
+def say_then_prompt(action, **gather_options):
+    """Template that speaks the `text` slot and then gathers speech for `action`."""
+    return TwiMLTemplate(speech_prompt(slot('text'), action, **gather_options))
+
+def twiml_then_prompt(action, **gather_options):
+    """Template that inserts the ready-made TwiML in the `twiml` slot and then gathers speech for `action`."""
+    response = speech_prompt([], action, **gather_options)
+    # The response's text comes before its children, i.e. ahead of the <Gather>
+    response.value = slot('twiml', raw=True)
+    return TwiMLTemplate(response)
+
+
+# Shared by the apps that end the call when the caller says goodbye
+GOODBYE = compile_twiml(hangup_response("Goodbye!"))
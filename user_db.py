@@ -4,6 +4,8 @@ from langchain_openai import OpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from dotenv import load_dotenv
+from call_metrics import instrument
+from token_accounting import langchain_callback
 import os
 
 # Load environment variables
@@ -11,6 +13,7 @@ load_dotenv()
 
 # Initialize the Flask app
 app = Flask(__name__)
+instrument(app, 'user_db')  # Request timings and per-route token counts, served at /metrics
 
 # Initialize the OpenAI API key
 openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -31,7 +34,7 @@ SQL Query:
 prompt = PromptTemplate(template=template, input_variables=["query"])
 
 # Create the LLMChain using the prompt and the model
-chain = LLMChain(prompt=prompt, llm=llm)
+chain = LLMChain(prompt=prompt, llm=llm, callbacks=[langchain_callback('user_db.home')])
 
 # Initialize SQLite database connection
 def get_db_connection():
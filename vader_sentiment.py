@@ -2,14 +2,15 @@ import speech_recognition as sr
 from gtts import gTTS
 from playsound import playsound
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
 import os
+from offline_assets import require_nltk, startup_step
 
-# Download the VADER lexicon for sentiment analysis
-nltk.download('vader_lexicon')
+# Load the VADER lexicon from the bundled assets (python offline_assets.py prepare)
+require_nltk('vader_lexicon')
 
 # Initialize the sentiment analyzer
-sid = SentimentIntensityAnalyzer()
+with startup_step('sentiment analyzer'):
+    sid = SentimentIntensityAnalyzer()
 
 def recognize_speech_from_streaming_audio():
     recognizer = sr.Recognizer()
@@ -1,6 +1,6 @@
-import os
 import tempfile
-import openai
+import llm_client
+from secret_key import load_secret_key
 import speech_recognition as sr
 from gtts import gTTS
 from flask import Flask, session
@@ -8,10 +8,7 @@ import pygame
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secret key for session management
-
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+app.secret_key = load_secret_key()  # Shared by every worker process
 
 # Initialize the speech recognizer
 recognizer = sr.Recognizer()
@@ -74,7 +71,7 @@ def transcribe_from_microphone():
 
 # Function to interact with OpenAI's ChatGPT with conversation history
 def chat_gpt_response_with_history(conversation_history):
-    response = openai.chat.completions.create(
+    response = llm_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a helpful assistant."}
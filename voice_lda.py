@@ -1,17 +1,16 @@
 import speech_recognition as sr
 import re
-import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from gensim import corpora
 from gensim.models import LdaModel
+from offline_assets import require_nltk, startup_step
 from gtts import gTTS
 import os
 from playsound import playsound
 
-# Ensure necessary NLTK downloads
-nltk.download('punkt')
-nltk.download('stopwords')
+# Load the tokenizer and stopwords from the bundled assets (python offline_assets.py prepare)
+require_nltk('punkt', 'stopwords')
 
 # Function to speak text using gTTS
 def speak(text):
@@ -106,7 +105,8 @@ dictionary = corpora.Dictionary(processed_texts)
 corpus = [dictionary.doc2bow(text) for text in processed_texts]
 
 # Train the LDA model on predefined text corpus
-lda_model = LdaModel(corpus=corpus, id2word=dictionary, num_topics=3, passes=10, random_state=100)
+with startup_step('LDA model'):
+    lda_model = LdaModel(corpus=corpus, id2word=dictionary, num_topics=3, passes=10, random_state=100)
 
 # Function to predict the topic from the user's input
 def predict_topic(text):